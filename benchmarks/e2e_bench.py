@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+e2e_bench.py
+离线端到端压测：本地模拟 OpenAI 接口 + 本地 paramiko SSH 服务，不消耗 token、不碰生产主机。
+
+场景（--scenarios 逗号分隔，默认全部）：
+    api           llm_api.get_command_from_api
+    local_llm     llm_vllm.get_command_from_llm
+    stream_ttft   直接以 stream=true 请求模拟接口，统计首 token 时间
+    model_worker  main.ModelWorker.run（需要 PyQt5）
+    local_exec    command_executor.execute_command（一次性子进程）
+    local_shell   shell_session 常驻本地 shell
+    remote_exec   ssh_executor.execute_remote_command（每条命令一个 exec 通道）
+    remote_shell  ssh_executor.execute_remote_command（常驻远端 shell）
+每个场景按 --concurrency 中的并发度依次运行，输出 p50 / p95 / p99 延迟、吞吐与内存峰值。
+
+用法：
+    python benchmarks/e2e_bench.py --requests 100 --concurrency 1,4,16 --latency 0.05 --tps 200
+    python benchmarks/e2e_bench.py --scenarios api,remote_shell --json bench.json
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+# 压测不应写入用户的历史库，也不应被相似度索引短路
+os.environ.setdefault("HISTORY_DB", os.path.join(tempfile.mkdtemp(prefix="yandao-bench-"), "history.db"))
+os.environ["PROMPT_INDEX"] = "0"
+
+SCENARIOS = ("api", "local_llm", "stream_ttft", "model_worker",
+             "local_exec", "local_shell", "remote_exec", "remote_shell")
+PROMPT = "列出当前目录下的文件"
+COMMAND = "echo bench"
+
+
+def percentile(values, q: float) -> float:
+    """最近秩百分位（q 取 0~100）"""
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    rank = max(int(round(q / 100.0 * len(ordered) + 0.5)) - 1, 0)
+    return ordered[min(rank, len(ordered) - 1)]
+
+
+def _is_error(result) -> bool:
+    if isinstance(result, tuple):
+        result = result[-1]
+    return isinstance(result, str) and result.startswith(("❌", "⚠️"))
+
+
+# ========= 各场景的单次调用 =========
+def _session_key(prefix: str) -> str:
+    return f"bench-{prefix}-{threading.get_ident()}"
+
+
+def build_scenarios(api_url: str, ssh_client):
+    import llm_api
+    import llm_vllm
+    import command_executor
+    import shell_session
+    import ssh_executor
+    import requests
+
+    def api_call():
+        sid = _session_key("api")
+        try:
+            return llm_api.get_command_from_api(PROMPT, "Linux", api_base=api_url, api_key="bench",
+                                                api_model="mock", session_id=sid)
+        finally:
+            llm_api.clear_memory(session_id=sid)
+
+    def local_llm_call():
+        sid = _session_key("local")
+        try:
+            return llm_vllm.get_command_from_llm(PROMPT, "Linux", api_url, session_id=sid)
+        finally:
+            llm_vllm.clear_context(sid)
+
+    def stream_call():
+        # 返回值为首 token 时间，由 run_scenario 识别
+        t0 = time.perf_counter()
+        with requests.post(api_url + "/chat/completions", stream=True, timeout=60,
+                           json={"model": "mock", "stream": True,
+                                 "messages": [{"role": "user", "content": PROMPT}]}) as resp:
+            for line in resp.iter_lines():
+                if line.startswith(b"data: ") and line != b"data: [DONE]":
+                    return ("ttft", time.perf_counter() - t0)
+        return "❌ 未收到任何 token"
+
+    def model_worker_call():
+        from main import ModelWorker
+        sid = _session_key("worker")
+        out = {}
+        worker = ModelWorker("api", PROMPT, "Linux",
+                             {"api_base": api_url, "api_key": "bench", "api_model": "mock"}, session_id=sid)
+        worker.finished_signal.connect(lambda s: out.setdefault("text", s))
+        worker.error_signal.connect(lambda e: out.setdefault("text", f"❌ {e}"))
+        worker.run()   # 直接在压测线程中执行，不经过 Qt 事件循环
+        llm_api.clear_memory(session_id=sid)
+        return out.get("text", "")
+
+    def local_exec_call():
+        return command_executor.execute_command(COMMAND)
+
+    def local_shell_call():
+        code, out = shell_session.get_local_shell(_session_key("shell")).run(COMMAND, timeout=30)
+        return out if code == 0 else f"❌ exit={code}"
+
+    def remote_exec_call():
+        return ssh_executor.execute_remote_command(COMMAND, "Linux", client=ssh_client)
+
+    def remote_shell_call():
+        return ssh_executor.execute_remote_command(COMMAND, "Linux", client=ssh_client,
+                                                   session_key=_session_key("remote"))
+
+    return {
+        "api": api_call, "local_llm": local_llm_call, "stream_ttft": stream_call,
+        "model_worker": model_worker_call, "local_exec": local_exec_call, "local_shell": local_shell_call,
+        "remote_exec": remote_exec_call, "remote_shell": remote_shell_call,
+    }
+
+
+def run_scenario(name: str, fn, concurrency: int, requests_count: int) -> dict:
+    """以给定并发度执行 requests_count 次，返回统计结果"""
+    latencies, errors = [], 0
+    lock = threading.Lock()
+
+    def one(_):
+        nonlocal errors
+        t0 = time.perf_counter()
+        try:
+            result = fn()
+            failed = _is_error(result)
+        except Exception:
+            result, failed = None, True
+        elapsed = time.perf_counter() - t0
+        if isinstance(result, tuple) and result and result[0] == "ttft":
+            elapsed = result[1]
+        with lock:
+            latencies.append(elapsed)
+            errors += failed
+
+    # 预热一次（建立连接 / 启动 shell / 导入模块），不计入统计
+    with contextlib.redirect_stdout(io.StringIO()):
+        try:
+            fn()
+        except Exception:
+            pass
+
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):   # 执行器内的 print 不干扰报表
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            list(pool.map(one, range(requests_count)))
+    wall = time.perf_counter() - t0
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "scenario": name, "concurrency": concurrency, "requests": requests_count, "errors": errors,
+        "p50_ms": percentile(latencies, 50) * 1000, "p95_ms": percentile(latencies, 95) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000, "throughput_rps": requests_count / wall if wall else 0.0,
+        "peak_mem_kb": peak / 1024,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="言道 OS 离线端到端压测")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS))
+    parser.add_argument("--concurrency", default="1,4,16", help="逗号分隔的并发度")
+    parser.add_argument("--requests", type=int, default=50, help="每个并发度下的请求数")
+    parser.add_argument("--latency", type=float, default=0.05, help="模拟接口的首 token 延迟（秒）")
+    parser.add_argument("--tps", type=float, default=200.0, help="模拟接口的输出速度（token/秒）")
+    parser.add_argument("--json", help="将结果写入 JSON 文件")
+    args = parser.parse_args()
+
+    scenarios = [s.strip() for s in args.scenarios.split(",") if s.strip()]
+    unknown = [s for s in scenarios if s not in SCENARIOS]
+    if unknown:
+        parser.error(f"未知场景：{', '.join(unknown)}")
+    levels = [int(c) for c in args.concurrency.split(",") if c.strip()]
+
+    from mock_openai_server import MockConfig, start_mock_server
+    api_server, api_url = start_mock_server(MockConfig(args.latency, args.tps))
+
+    ssh_server = ssh_client = None
+    if any(s.startswith("remote") for s in scenarios):
+        from mock_ssh_server import start_mock_ssh_server
+        import ssh_executor
+        ssh_server = start_mock_ssh_server()
+        with contextlib.redirect_stdout(io.StringIO()):
+            ssh_client, _ = ssh_executor.connect_ssh(ssh_server.host, ssh_server.port, "bench", "bench")
+
+    if "model_worker" in scenarios:
+        try:
+            from PyQt5.QtCore import QCoreApplication
+            _app = QCoreApplication.instance() or QCoreApplication([])
+        except ImportError:
+            print("⚠️ 未安装 PyQt5，跳过 model_worker 场景")
+            scenarios.remove("model_worker")
+
+    calls = build_scenarios(api_url, ssh_client)
+    print(f"🧪 模拟接口 {api_url}（latency={args.latency}s, {args.tps:g} tok/s）"
+          + (f"，模拟 SSH 127.0.0.1:{ssh_server.port}" if ssh_server else ""))
+    header = f"{'scenario':<14}{'conc':>5}{'n':>6}{'err':>5}{'p50(ms)':>10}{'p95(ms)':>10}{'p99(ms)':>10}{'req/s':>9}{'peak(KB)':>10}"
+    print(header)
+    print("-" * len(header))
+
+    results = []
+    for name in scenarios:
+        for level in levels:
+            r = run_scenario(name, calls[name], level, args.requests)
+            results.append(r)
+            print(f"{name:<14}{level:>5}{r['requests']:>6}{r['errors']:>5}{r['p50_ms']:>10.1f}{r['p95_ms']:>10.1f}"
+                  f"{r['p99_ms']:>10.1f}{r['throughput_rps']:>9.1f}{r['peak_mem_kb']:>10.0f}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"latency": args.latency, "tps": args.tps, "results": results}, f, ensure_ascii=False, indent=2)
+
+    api_server.shutdown()
+    if ssh_server:
+        ssh_server.close()
+    return 1 if any(r["errors"] for r in results) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+mock_openai_server.py
+本地模拟的 OpenAI 兼容接口（/v1/chat/completions），供离线压测使用。
+
+可调参数：
+- latency：收到请求到开始输出的延迟（秒），模拟排队 + prefill；
+- tokens_per_second：输出速度，按回复的 token 数计算生成耗时；
+- stream：请求里 "stream": true 时按 SSE 逐 token 推送，否则整体返回。
+单独运行：python benchmarks/mock_openai_server.py --port 8000 --latency 0.2 --tps 50
+"""
+
+import argparse
+import json
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_REPLY = "EXECUTE: 列出当前目录\nls -la"
+
+
+class MockConfig:
+    def __init__(self, latency: float = 0.05, tokens_per_second: float = 200.0, reply: str = DEFAULT_REPLY):
+        self.latency = latency
+        self.tokens_per_second = tokens_per_second
+        self.reply = reply
+        self.requests = 0
+        self._lock = threading.Lock()
+
+    def count(self):
+        with self._lock:
+            self.requests += 1
+
+
+def _tokenize(text: str):
+    """粗略切分为“token”：每个空白分隔的片段、每个非 ASCII 字符各算一个"""
+    tokens, buf = [], ""
+    for ch in text:
+        if ch.isspace() or ord(ch) > 127:
+            if buf:
+                tokens.append(buf)
+                buf = ""
+            tokens.append(ch)
+        else:
+            buf += ch
+    if buf:
+        tokens.append(buf)
+    return tokens
+
+
+def _make_handler(config: MockConfig):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_POST(self):
+            if not self.path.rstrip("/").endswith("/chat/completions"):
+                self.send_error(404)
+                return
+            length = int(self.headers.get("Content-Length") or 0)
+            try:
+                body = json.loads(self.rfile.read(length) or b"{}")
+            except ValueError:
+                self.send_error(400, "invalid json")
+                return
+            config.count()
+            prompt_tokens = sum(len(_tokenize(m.get("content", ""))) for m in body.get("messages", []))
+            tokens = _tokenize(config.reply)
+            per_token = 1.0 / config.tokens_per_second if config.tokens_per_second > 0 else 0.0
+            time.sleep(config.latency)
+            if body.get("stream"):
+                self._stream(body, tokens, per_token)
+            else:
+                time.sleep(per_token * len(tokens))
+                self._json({
+                    "id": f"chatcmpl-{uuid.uuid4().hex[:12]}",
+                    "object": "chat.completion",
+                    "created": int(time.time()),
+                    "model": body.get("model", "mock"),
+                    "choices": [{"index": 0, "finish_reason": "stop",
+                                 "message": {"role": "assistant", "content": config.reply}}],
+                    "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": len(tokens),
+                              "total_tokens": prompt_tokens + len(tokens)},
+                })
+
+        def _json(self, obj):
+            data = json.dumps(obj, ensure_ascii=False).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _stream(self, body, tokens, per_token):
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            cid = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+
+            def send(payload: str):
+                data = f"data: {payload}\n\n".encode("utf-8")
+                self.wfile.write(f"{len(data):X}\r\n".encode() + data + b"\r\n")
+                self.wfile.flush()
+
+            try:
+                for tok in tokens:
+                    send(json.dumps({"id": cid, "object": "chat.completion.chunk", "model": body.get("model", "mock"),
+                                     "choices": [{"index": 0, "delta": {"content": tok}, "finish_reason": None}]},
+                                    ensure_ascii=False))
+                    time.sleep(per_token)
+                send(json.dumps({"id": cid, "object": "chat.completion.chunk",
+                                 "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]}))
+                send("[DONE]")
+                self.wfile.write(b"0\r\n\r\n")
+            except (BrokenPipeError, ConnectionResetError):
+                # 客户端拿到首 token 后提前断开（stream_ttft 场景）
+                self.close_connection = True
+
+        def log_message(self, *args):
+            pass
+
+    return Handler
+
+
+def start_mock_server(config: MockConfig = None, host: str = "127.0.0.1", port: int = 0):
+    """在后台线程启动模拟服务，返回 (server, base_url)；base_url 形如 http://127.0.0.1:PORT/v1"""
+    config = config or MockConfig()
+    server = ThreadingHTTPServer((host, port), _make_handler(config))
+    server.daemon_threads = True
+    server.config = config
+    threading.Thread(target=server.serve_forever, name="mock-openai", daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}/v1"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="模拟 OpenAI 兼容接口")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--tps", type=float, default=200.0)
+    parser.add_argument("--reply", default=DEFAULT_REPLY)
+    args = parser.parse_args()
+    srv, url = start_mock_server(MockConfig(args.latency, args.tps, args.reply), port=args.port)
+    print(f"🧪 模拟接口已启动：{url}（Ctrl+C 退出）")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        srv.shutdown()
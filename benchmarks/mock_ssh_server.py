@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+mock_ssh_server.py
+基于 paramiko 的本地 SSH 服务，供离线压测使用（只监听 127.0.0.1）。
+
+支持：
+- 任意用户名 / 密码登录；
+- exec 与 shell 请求：在本机用 /bin/sh 执行，stdout / stderr / 退出码原样回传；
+- sftp 子系统：直接读写本机文件系统。
+仅用于基准测试，切勿暴露在外部网络。
+"""
+
+import os
+import select
+import socket
+import struct
+import subprocess
+import threading
+
+import paramiko
+
+
+class _Server(paramiko.ServerInterface):
+    """
+    exec / shell 请求先登记，等 paramiko 发出请求应答（CHANNEL_SUCCESS）后才启动命令：
+    否则很快结束的命令可能在应答之前就发送退出码并关闭通道，客户端会误报 "Channel closed"。
+    """
+
+    def __init__(self):
+        self._pending = {}   # 客户端通道号 -> (通道, 命令)
+        self._lock = threading.Lock()
+
+    def _defer(self, channel, command):
+        with self._lock:
+            self._pending[channel.remote_chanid] = (channel, command)
+        return True
+
+    def on_reply_sent(self, remote_chanid: int):
+        with self._lock:
+            pending = self._pending.pop(remote_chanid, None)
+        if pending is not None:
+            threading.Thread(target=_run, args=pending, daemon=True).start()
+
+    def check_channel_request(self, kind, chanid):
+        if kind == "session":
+            return paramiko.OPEN_SUCCEEDED
+        return paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
+
+    def get_allowed_auths(self, username):
+        return "password"
+
+    def check_auth_password(self, username, password):
+        return paramiko.AUTH_SUCCESSFUL
+
+    def check_channel_exec_request(self, channel, command):
+        return self._defer(channel, command.decode("utf-8", errors="ignore"))
+
+    def check_channel_shell_request(self, channel):
+        return self._defer(channel, None)
+
+    def check_channel_pty_request(self, channel, term, width, height, pixelwidth, pixelheight, modes):
+        return True
+
+
+class _SFTPHandle(paramiko.SFTPHandle):
+    def stat(self):
+        try:
+            return paramiko.SFTPAttributes.from_stat(os.fstat(self.readfile.fileno()))
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+
+    def chattr(self, attr):
+        return paramiko.SFTP_OK
+
+
+class _SFTPServer(paramiko.SFTPServerInterface):
+    """本机文件系统上的最小 SFTP 实现"""
+
+    def _attrs(self, path, fn):
+        try:
+            return paramiko.SFTPAttributes.from_stat(fn(path), os.path.basename(path))
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+
+    def canonicalize(self, path):
+        # 相对路径按服务进程的工作目录解析（相当于真实服务端的家目录）
+        return os.path.abspath(path)
+
+    def stat(self, path):
+        return self._attrs(path, os.stat)
+
+    def lstat(self, path):
+        return self._attrs(path, os.lstat)
+
+    def list_folder(self, path):
+        try:
+            return [paramiko.SFTPAttributes.from_stat(os.lstat(os.path.join(path, n)), n) for n in os.listdir(path)]
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+
+    def open(self, path, flags, attr):
+        try:
+            fd = os.open(path, flags, 0o644)
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+        if flags & os.O_WRONLY:
+            mode = "ab" if flags & os.O_APPEND else "wb"
+        elif flags & os.O_RDWR:
+            mode = "a+b" if flags & os.O_APPEND else "r+b"
+        else:
+            mode = "rb"
+        handle = _SFTPHandle(flags)
+        handle.filename = path
+        handle.readfile = handle.writefile = os.fdopen(fd, mode)
+        return handle
+
+    def _call(self, fn, *args):
+        try:
+            fn(*args)
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+        return paramiko.SFTP_OK
+
+    def remove(self, path):
+        return self._call(os.remove, path)
+
+    def rename(self, oldpath, newpath):
+        return self._call(os.rename, oldpath, newpath)
+
+    def posix_rename(self, oldpath, newpath):
+        return self._call(os.replace, oldpath, newpath)
+
+    def mkdir(self, path, attr):
+        mode = attr.st_mode & 0o7777 if attr.st_mode is not None else 0o777
+        return self._call(os.mkdir, path, mode)
+
+    def rmdir(self, path):
+        return self._call(os.rmdir, path)
+
+    def chattr(self, path, attr):
+        if attr.st_mode is not None:
+            result = self._call(os.chmod, path, attr.st_mode)
+            if result != paramiko.SFTP_OK:
+                return result
+        if attr.st_atime is not None and attr.st_mtime is not None:
+            return self._call(os.utime, path, (attr.st_atime, attr.st_mtime))
+        return paramiko.SFTP_OK
+
+
+def _run(channel, command):
+    """在本机执行命令（command 为 None 时启动交互 shell），双向转发数据"""
+    argv = ["/bin/sh", "-c", command] if command is not None else ["/bin/sh"]
+    proc = subprocess.Popen(argv, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+    def pump_stdin():
+        try:
+            while True:
+                data = channel.recv(65536)
+                if not data:
+                    break
+                proc.stdin.write(data)
+                proc.stdin.flush()
+        except Exception:
+            pass
+        finally:
+            try:
+                proc.stdin.close()
+            except Exception:
+                pass
+
+    threading.Thread(target=pump_stdin, daemon=True).start()
+    sinks = {proc.stdout.fileno(): channel.sendall, proc.stderr.fileno(): channel.sendall_stderr}
+    try:
+        while sinks:
+            ready, _, _ = select.select(list(sinks), [], [])
+            for fd in ready:
+                data = os.read(fd, 65536)
+                if data:
+                    sinks[fd](data)
+                else:
+                    sinks.pop(fd)
+        channel.send_exit_status(proc.wait())
+    except Exception:
+        proc.kill()
+    finally:
+        channel.close()
+
+
+_REPLIES = (paramiko.common.cMSG_CHANNEL_SUCCESS, paramiko.common.cMSG_CHANNEL_FAILURE)
+
+
+def _notify_replies(transport, server: _Server):
+    """包装传输层的发送：每发出一个通道请求应答，通知 server 启动登记的命令"""
+    send = transport._send_user_message
+
+    def send_and_notify(m):
+        send(m)
+        data = m.asbytes()
+        if data[:1] in _REPLIES:
+            server.on_reply_sent(struct.unpack(">I", data[1:5])[0])
+
+    transport._send_user_message = send_and_notify
+
+
+class MockSSHServer:
+    def __init__(self, host: str = "127.0.0.1", port: int = 0):
+        self.host_key = paramiko.RSAKey.generate(2048)
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind((host, port))
+        self.sock.listen(64)
+        self.host, self.port = self.sock.getsockname()
+        self._transports = []
+        self._closed = False
+
+    def _accept_loop(self):
+        while not self._closed:
+            try:
+                conn, _ = self.sock.accept()
+            except OSError:
+                break
+            transport = paramiko.Transport(conn)
+            transport.add_server_key(self.host_key)
+            transport.set_subsystem_handler("sftp", paramiko.SFTPServer, _SFTPServer)
+            server = _Server()
+            _notify_replies(transport, server)
+            try:
+                transport.start_server(server=server)
+            except Exception:
+                continue
+            self._transports.append(transport)
+
+    def start(self):
+        threading.Thread(target=self._accept_loop, name="mock-ssh", daemon=True).start()
+        return self
+
+    def close(self):
+        self._closed = True
+        try:
+            self.sock.close()
+        except Exception:
+            pass
+        for t in self._transports:
+            t.close()
+
+
+def start_mock_ssh_server(port: int = 0) -> MockSSHServer:
+    """在后台启动模拟 SSH 服务，返回服务对象（.host / .port）"""
+    return MockSSHServer(port=port).start()
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+startup_time.py
+启动耗时基准：统计 main.py 的导入耗时分布，并检查是否超出启动预算。
+
+用法：
+    python benchmarks/startup_time.py               # 仅分析 import main 的耗时
+    python benchmarks/startup_time.py --show-window # 额外测量到窗口显示为止的耗时
+环境变量 / 参数：
+    STARTUP_BUDGET_MS  启动预算（毫秒，默认 1500），超出时返回码为 1
+"""
+
+import argparse
+import json
+import os
+import re
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+_IMPORT_LINE = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S.*)$")
+
+# 这些模块应当在首次使用时才加载，启动阶段出现即视为回退
+LAZY_MODULES = ("paramiko", "sounddevice", "speech_recognition", "numpy", "requests", "llm_api", "llm_vllm", "ssh_executor")
+
+
+def measure_imports(module: str = "main"):
+    """用 -X importtime 导入指定模块，返回 [(模块名, self_us, cumulative_us, depth)]"""
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=ROOT, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(f"导入 {module} 失败：\n{proc.stderr[-2000:]}")
+    rows = []
+    for line in proc.stderr.splitlines():
+        m = _IMPORT_LINE.match(line)
+        if m:
+            self_us, cum_us, indent, name = m.groups()
+            rows.append((name.strip(), int(self_us), int(cum_us), len(indent) // 2))
+    return rows
+
+
+def measure_window(runs: int = 3):
+    """启动 GUI 并在窗口显示后立即退出，返回每次的墙钟耗时（秒）"""
+    env = dict(os.environ, YANDAO_EXIT_AFTER_SHOW="1")
+    results = []
+    for _ in range(runs):
+        t0 = time.perf_counter()
+        subprocess.run([sys.executable, "main.py"], cwd=ROOT, env=env,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+        results.append(time.perf_counter() - t0)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="言道 OS 启动耗时基准")
+    parser.add_argument("--module", default="main")
+    parser.add_argument("--top", type=int, default=15)
+    parser.add_argument("--budget-ms", type=float, default=float(os.getenv("STARTUP_BUDGET_MS", "1500")))
+    parser.add_argument("--show-window", action="store_true")
+    parser.add_argument("--json", help="将结果写入 JSON 文件")
+    args = parser.parse_args()
+
+    rows = measure_imports(args.module)
+    top_level = [r for r in rows if r[3] == 0]
+    total_ms = sum(r[2] for r in top_level) / 1000.0
+
+    print(f"📦 import {args.module}: {total_ms:.1f} ms（顶层模块 {len(top_level)} 个）")
+    print(f"{'cumulative(ms)':>15} {'self(ms)':>10}  module")
+    for name, self_us, cum_us, _ in sorted(top_level, key=lambda r: r[2], reverse=True)[:args.top]:
+        print(f"{cum_us / 1000:15.1f} {self_us / 1000:10.1f}  {name}")
+
+    loaded = {r[0] for r in rows}
+    eager = [m for m in LAZY_MODULES if m in loaded]
+    if eager:
+        print(f"⚠️ 以下模块应按需加载，却在启动时被导入：{', '.join(eager)}")
+
+    report = {"import_ms": total_ms, "eager_modules": eager,
+              "top": [{"module": n, "self_ms": s / 1000, "cumulative_ms": c / 1000}
+                      for n, s, c, _ in sorted(top_level, key=lambda r: r[2], reverse=True)[:args.top]]}
+    measured_ms = total_ms
+    if args.show_window:
+        runs = measure_window()
+        best_ms = min(runs) * 1000
+        report["window_ms"] = [r * 1000 for r in runs]
+        measured_ms = best_ms
+        print(f"🪟 到窗口显示：best {best_ms:.0f} ms / runs {', '.join(f'{r * 1000:.0f}' for r in runs)}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+    ok = measured_ms <= args.budget_ms and not eager
+    print(("✅" if ok else "❌") + f" 启动预算 {args.budget_ms:.0f} ms，实测 {measured_ms:.0f} ms")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -4,15 +4,18 @@
 executor.py
 安全命令执行器（带黑名单与基本注入检测）。
 """
+import os
 import re
 import subprocess
 import shlex
 import platform
-from utils.blacklist_loader import load_blacklist
+from utils.blacklist_loader import load_blacklist_cached
+from utils import metrics
+from utils import result_cache
 
 SYSTEM = platform.system()   # 'Windows', 'Linux', or 'Darwin'
 # print(f"🖥️ 当前操作系统：{SYSTEM}")
-DANGEROUS_KEYWORDS = load_blacklist(SYSTEM)
+# 黑名单在第一次安全检查时才读取（见 _dangerous_keywords），避免导入时的文件 IO
 DANGEROUS_INJECTION_PATTERNS = [";", "&&", "||", "`", "$(", ">${", "> /dev", "2>&1"]
 ALLOWED_PIPELINE_COMMANDS = {
     "df", "grep", "awk", "sed", "cut", "tr", "sort", "uniq", "wc", "head", "tail", "cat"
@@ -61,9 +64,13 @@ def _is_safe_pipeline(command: str) -> bool:
         if not tokens or tokens[0] not in ALLOWED_PIPELINE_COMMANDS:
             return False
     return True
+def _dangerous_keywords():
+    return load_blacklist_cached(SYSTEM)
+
+
 def is_safe_command(command: str, system_type: str = None) -> bool:
     cmd_lower = command.lower()
-    for kw in DANGEROUS_KEYWORDS:
+    for kw in _dangerous_keywords():
         if kw in cmd_lower:
             return False
     if not command.strip():
@@ -81,11 +88,62 @@ def is_safe_command(command: str, system_type: str = None) -> bool:
     return True
 
 
-def execute_command(command: str, timeout: int = 15) -> str:
-    """安全执行命令并返回执行结果字符串（最小改动版：遇到 WinError 2 时回退到 shell=True）"""
-    if not is_safe_command(command):
+def execute_command(command: str, timeout: int = 15, cache: bool = None, refresh: bool = False) -> str:
+    """
+    安全执行命令并返回执行结果字符串（最小改动版：遇到 WinError 2 时回退到 shell=True）。
+    cache 为 None 时按 RESULT_CACHE 决定是否经只读命令结果缓存；refresh=True 时忽略已缓存的结果。
+    """
+    with metrics.timer("safety_check_seconds", target="local"):
+        safe = is_safe_command(command)
+    if not safe:
+        metrics.inc("commands_blocked_total", target="local")
         return f"⚠️ 检测到危险或不安全的命令：{command}\n已阻止执行。"
 
+    if cache is None:
+        cache = result_cache.enabled()
+    if cache:
+        out, _ = result_cache.run_cached("local", os.getcwd(), command, lambda: _execute(command, timeout),
+                                         refresh=refresh, ok=lambda res: not res.startswith(("❌", "⚠️")))
+        return out
+    result_cache.note_executed("local", command)
+    return _execute(command, timeout)
+
+
+def _execute(command: str, timeout: int) -> str:
+    metrics.inc("commands_total", target="local")
+    with metrics.timer("command_exec_seconds", target="local"):
+        import sandbox_exec
+        if sandbox_exec.enabled():
+            return _run_sandboxed(command, timeout)
+        fast = _run_builtin(command)
+        if fast is not None:
+            return fast
+        return _run_command(command, timeout)
+
+
+def _run_builtin(command: str):
+    """常见只读命令走进程内快速通道；不适用时返回 None"""
+    import builtin_exec
+    res = builtin_exec.try_run(command)
+    if res is None:
+        return None
+    rc, out, err = res
+    if rc == 0:
+        return out.strip() or "✅ 命令执行成功，无输出。"
+    return f"❌ 命令执行出错（returncode={rc}）：\n{err.strip()}"
+
+
+def _run_sandboxed(command: str, timeout: int) -> str:
+    """SANDBOX_EXEC=1 时在资源限制下执行，结果后附资源占用"""
+    import sandbox_exec
+    rc, out, usage = sandbox_exec.run(command, timeout=timeout)
+    report = sandbox_exec.format_usage(usage, timeout=timeout)
+    if rc == 0:
+        return (out.strip() or "✅ 命令执行成功，无输出。") + "\n" + report
+    return f"❌ 命令执行出错（returncode={rc}）：\n{out.strip()}\n{report}"
+
+
+def _run_command(command: str, timeout: int) -> str:
     try:
         # 尝试用非 shell 的方式执行（更安全）
         cmd_list = shlex.split(command)
@@ -7,9 +7,14 @@ llm_api.py
 支持短期上下文记忆（messages）
 """
 import os
+import time
 import requests
 from dotenv import load_dotenv
 from utils.prompt_loader import load_system_prompt
+from utils import metrics
+from utils.cassette import http_post
+from utils.output_compactor import estimate_tokens, format_execution_feedback
+from utils.rate_limiter import get_limiter, retry_after_seconds
 
 load_dotenv()
 
@@ -18,38 +23,88 @@ API_BASE = os.getenv("API_BASE", "https://api.deepseek.com/v1")
 API_KEY = os.getenv("API_KEY", "")
 API_MODEL = os.getenv("API_MODEL", "deepseek-chat")
 API_TIMEOUT = int(os.getenv("API_TIMEOUT", "60"))
+API_MAX_429_RETRIES = int(os.getenv("API_MAX_429_RETRIES", "2"))
+EXEC_FEEDBACK_TOKENS = int(os.getenv("EXEC_FEEDBACK_TOKENS", "400"))
 
 # ========= 全局上下文消息缓存（短期记忆） =========
-CONVERSATION_MEMORY = {}  # key = system_type, value = list[dict(role, content)]
+# key = system_type（未指定会话时）或 "session_id:system_type"，value = list[dict(role, content)]
+CONVERSATION_MEMORY = {}
 
 
-def init_conversation(system_type: str):
+def _memory_key(system_type: str, session_id: str = None) -> str:
+    return f"{session_id}:{system_type}" if session_id else system_type
+
+
+def init_conversation(system_type: str, session_id: str = None):
     """初始化对话上下文"""
     SYSTEM_PROMPT = load_system_prompt(system_type)
-    CONVERSATION_MEMORY[system_type] = [{"role": "system", "content": SYSTEM_PROMPT}]
-    return CONVERSATION_MEMORY[system_type]
+    key = _memory_key(system_type, session_id)
+    CONVERSATION_MEMORY[key] = [{"role": "system", "content": SYSTEM_PROMPT}]
+    return CONVERSATION_MEMORY[key]
 
 
-def get_messages(system_type: str):
-    """获取（或初始化）指定类型的上下文消息"""
-    if system_type not in CONVERSATION_MEMORY:
-        return init_conversation(system_type)
-    return CONVERSATION_MEMORY[system_type]
+def get_messages(system_type: str, session_id: str = None):
+    """获取（或初始化）指定类型（及会话）的上下文消息"""
+    key = _memory_key(system_type, session_id)
+    if key not in CONVERSATION_MEMORY:
+        return init_conversation(system_type, session_id)
+    return CONVERSATION_MEMORY[key]
 
 
-def append_message(system_type: str, role: str, content: str):
+def append_message(system_type: str, role: str, content: str, session_id: str = None):
     """将消息追加到上下文"""
-    msgs = get_messages(system_type)
+    msgs = get_messages(system_type, session_id)
     msgs.append({"role": role, "content": content})
     # 限制上下文长度，避免消息爆炸（只保留最近 10 轮）
     if len(msgs) > 20:
-        CONVERSATION_MEMORY[system_type] = msgs[:1] + msgs[-18:]
+        CONVERSATION_MEMORY[_memory_key(system_type, session_id)] = msgs[:1] + msgs[-18:]
+
+
+def append_execution_result(command: str, output: str, system_type: str = None, exit_code: int = None,
+                            session_id: str = None):
+    """
+    将命令执行结果（压缩后）写回上下文，便于模型回答“哪个最大”之类的追问。
+    结果附加在最近一条 assistant 消息之后，保持 user/assistant 交替，兼容严格的对话模板。
+    """
+    sys_type = system_type or "default"
+    feedback = format_execution_feedback(command, output, exit_code, EXEC_FEEDBACK_TOKENS)
+    msgs = get_messages(sys_type, session_id)
+    if msgs and msgs[-1]["role"] == "assistant":
+        msgs[-1] = {"role": "assistant", "content": msgs[-1]["content"] + "\n\n" + feedback}
+    else:
+        append_message(sys_type, "assistant", feedback, session_id)
+
+
+def _with_examples(messages: list, examples: str = None) -> list:
+    """把 few-shot 示例并入系统提示（返回新列表，不修改记忆）"""
+    if not examples or not messages or messages[0]["role"] != "system":
+        return messages
+    return [{"role": "system", "content": messages[0]["content"] + "\n\n" + examples}] + messages[1:]
+
+
+def remember_turn(prompt: str, reply: str, system_type: str = None, session_id: str = None):
+    """把未经模型生成的一轮问答（例如相似度索引直接给出的建议）记入上下文"""
+    sys_type = system_type or "default"
+    append_message(sys_type, "user", prompt, session_id)
+    append_message(sys_type, "assistant", reply, session_id)
 
 
-def clear_memory(system_type: str = None):
-    """清空某一系统类型或全部记忆"""
+def forget_last_turn(system_type: str = None, session_id: str = None):
+    """删除最近一轮问答（格式无效、将要重答的那一轮），不让它留在上下文里"""
+    msgs = get_messages(system_type or "default", session_id)
+    if len(msgs) > 1 and msgs[-1]["role"] == "assistant":
+        msgs.pop()
+    if len(msgs) > 1 and msgs[-1]["role"] == "user":
+        msgs.pop()
+
+
+def clear_memory(system_type: str = None, session_id: str = None):
+    """清空某一系统类型（可限定会话）、某一会话或全部记忆"""
     if system_type:
-        CONVERSATION_MEMORY.pop(system_type, None)
+        CONVERSATION_MEMORY.pop(_memory_key(system_type, session_id), None)
+    elif session_id:
+        for key in [k for k in CONVERSATION_MEMORY if k.startswith(f"{session_id}:")]:
+            CONVERSATION_MEMORY.pop(key, None)
     else:
         CONVERSATION_MEMORY.clear()
 
@@ -89,6 +144,16 @@ def _extract_text_from_response_json(data: dict) -> str:
     return repr(data)
 
 
+def _record_throughput(data: dict, elapsed: float, provider: str):
+    """根据 usage.completion_tokens 记录生成吞吐"""
+    try:
+        tokens = int((data.get("usage") or {}).get("completion_tokens") or 0)
+    except Exception:
+        tokens = 0
+    if tokens and elapsed > 0:
+        metrics.observe("llm_tokens_per_second", tokens / elapsed, provider=provider)
+
+
 def get_command_from_api(prompt: str,
                          system_type: str = None,
                          api_base: str = None,
@@ -96,9 +161,17 @@ def get_command_from_api(prompt: str,
                          api_model: str = None,
                          max_new_tokens: int = 512,
                          temperature: float = 0.7,
-                         clear: bool = False) -> str:
+                         clear: bool = False,
+                         examples: str = None,
+                         session_id: str = None,
+                         on_queue=None,
+                         structured=None) -> str:
     """
     调用远端 API（兼容 OpenAI-style chat completions），支持上下文记忆。
+    examples: 可选的 few-shot 提示（相似历史命令），只随本次请求发送，不写入记忆。
+    session_id: 可选的会话标识；不同会话的上下文互不干扰（不传则按系统类型共享）。
+    on_queue(position, eta_seconds): 触发客户端限流排队时回调。
+    structured: 可选的 action_schema.RequestOptions（格式说明、停止词 / response_format）。
     """
     try:
         base = api_base or API_BASE
@@ -113,28 +186,61 @@ def get_command_from_api(prompt: str,
 
         # 清空记忆（如果需要）
         if clear:
-            clear_memory(sys_type)
-
-        # 获取或初始化上下文
-        messages = get_messages(sys_type)
-
-        # 添加用户输入
-        append_message(sys_type, "user", prompt)
-
-        # 构造请求
-        url, payload, headers = _choose_url_and_payload(base, model, messages, max_new_tokens, temperature, key)
-
-        resp = requests.post(url, headers=headers, json=payload, timeout=API_TIMEOUT)
+            clear_memory(sys_type, session_id)
+
+        with metrics.timer("llm_prompt_build_seconds", provider="api"):
+            # 获取或初始化上下文
+            messages = get_messages(sys_type, session_id)
+
+            # 添加用户输入
+            append_message(sys_type, "user", prompt, session_id)
+
+            # 构造请求（追加后可能触发截断，重新取一次）
+            messages = get_messages(sys_type, session_id)
+            extra = "\n\n".join(x for x in (structured.instruction if structured else "", examples) if x)
+            url, payload, headers = _choose_url_and_payload(base, model, _with_examples(messages, extra),
+                                                            max_new_tokens, temperature, key)
+            if structured:
+                payload.update(structured.payload)
+
+        # 客户端限流：预扣 提示词 + max_tokens 的 token 额度，超额时按会话公平排队
+        limiter = get_limiter(base, key)
+        cost = sum(estimate_tokens(m.get("content") or "") for m in payload["messages"]) + max_new_tokens
+        for attempt in range(API_MAX_429_RETRIES + 1):
+            ticket = limiter.acquire(session_id or sys_type, cost, on_wait=on_queue)
+            metrics.inc("llm_requests_total", provider="api")
+            t0 = time.perf_counter()
+            try:
+                resp = http_post(url, headers=headers, json=payload, timeout=API_TIMEOUT)
+            except Exception:
+                limiter.settle(ticket, 0)
+                raise
+            elapsed = time.perf_counter() - t0
+            metrics.observe("llm_http_seconds", elapsed, provider="api")
+            if resp.status_code == 429 and attempt < API_MAX_429_RETRIES:
+                # 服务端仍然限流：暂停整个 key 的发送后重新排队
+                limiter.settle(ticket, 0)
+                limiter.penalize(retry_after_seconds(resp))
+                continue
+            break
+        # 非流式请求：以响应头到达时间近似首字时间
+        metrics.observe("llm_time_to_first_token_seconds", resp.elapsed.total_seconds(), provider="api")
         resp.raise_for_status()
-        data = resp.json()
-        text = _extract_text_from_response_json(data)
+        with metrics.timer("llm_parse_seconds", provider="api"):
+            data = resp.json()
+            text = _extract_text_from_response_json(data)
+        _record_throughput(data, elapsed, "api")
+        usage = (data.get("usage") or {}) if isinstance(data, dict) else {}
+        limiter.settle(ticket, usage.get("total_tokens"))
 
         # 保存模型回答
-        append_message(sys_type, "assistant", text)
+        append_message(sys_type, "assistant", text, session_id)
         return text
     except requests.exceptions.HTTPError as e:
+        metrics.inc("llm_errors_total", provider="api")
         return f"❌ API HTTP 错误: {e} | 响应: {getattr(e.response, 'text', '')}"
     except Exception as e:
+        metrics.inc("llm_errors_total", provider="api")
         return f"❌ API 请求失败: {e}"
 
 
@@ -9,19 +9,32 @@ llm_vllm.py
 """
 
 import os
+import time
 import requests
 from dotenv import load_dotenv
 from utils.prompt_loader import load_system_prompt
+from utils import metrics
+from utils.cassette import http_post
+from utils.output_compactor import format_execution_feedback
 
 # ========= 加载环境变量 =========
 load_dotenv()
 LOCAL_ADDR = os.getenv("LOCAL_ADDR", "http://127.0.0.1:8000/v1")   # 默认本机端口
 LOCAL_TIMEOUT = int(os.getenv("LOCAL_TIMEOUT", "60"))
+LOCAL_MODEL = os.getenv("LOCAL_MODEL", "local-DeepSeek")
+EXEC_FEEDBACK_TOKENS = int(os.getenv("EXEC_FEEDBACK_TOKENS", "400"))
 
 # ========= 全局会话缓存（用于上下文） =========
 # 格式: { session_id: [ {"role": "system"/"user"/"assistant", "content": "..."}, ... ] }
 CONTEXT_CACHE = {}
 
+def _with_examples(messages: list, examples: str = None) -> list:
+    """把 few-shot 示例并入系统提示（返回新列表，不修改上下文缓存）"""
+    if not examples or not messages or messages[0]["role"] != "system":
+        return messages
+    return [{"role": "system", "content": messages[0]["content"] + "\n\n" + examples}] + messages[1:]
+
+
 # ========= 核心函数 =========
 def get_command_from_llm(prompt: str,
                          system_type: str = None,
@@ -29,7 +42,10 @@ def get_command_from_llm(prompt: str,
                          session_id: str = "default",
                          max_new_tokens: int = 512,
                          temperature: float = 0.7,
-                         keep_context: bool = True) -> str:
+                         keep_context: bool = True,
+                         examples: str = None,
+                         model: str = None,
+                         structured=None) -> str:
     """
     调用服务器上的 llm_vllm_server.py 服务。
     参数：
@@ -38,6 +54,9 @@ def get_command_from_llm(prompt: str,
         local_addr: API 地址
         session_id: 当前会话标识符
         keep_context: 是否保留上下文
+        examples: 可选的 few-shot 提示（相似历史命令），只随本次请求发送
+        model: 模型名（由模型路由选择），默认 LOCAL_MODEL
+        structured: 可选的 action_schema.RequestOptions（格式说明、guided_json / 停止词）
     返回：
         大模型的回复文本
     """
@@ -45,6 +64,7 @@ def get_command_from_llm(prompt: str,
     base = addr.rstrip("/")
     url = f"{base}/chat/completions" if not base.endswith("/chat/completions") else base
 
+    t_build = time.perf_counter()
     # === 初始化上下文 ===
     if session_id not in CONTEXT_CACHE or not keep_context:
         SYSTEM_PROMPT = load_system_prompt(system_type)
@@ -56,16 +76,27 @@ def get_command_from_llm(prompt: str,
     # === 发送请求 ===
     headers = {"Content-Type": "application/json"}
     payload = {
-        "model": "local-DeepSeek",
-        "messages": CONTEXT_CACHE[session_id],
+        "model": model or LOCAL_MODEL,
+        "messages": _with_examples(CONTEXT_CACHE[session_id],
+                                   "\n\n".join(x for x in (structured.instruction if structured else "", examples) if x)),
         "temperature": temperature,
         "max_tokens": max_new_tokens,
         "stream": False
     }
+    if structured:
+        payload.update(structured.payload)
+    metrics.observe("llm_prompt_build_seconds", time.perf_counter() - t_build, provider="local")
 
     try:
-        response = requests.post(url, headers=headers, json=payload, timeout=LOCAL_TIMEOUT)
+        metrics.inc("llm_requests_total", provider="local")
+        t0 = time.perf_counter()
+        response = http_post(url, headers=headers, json=payload, timeout=LOCAL_TIMEOUT)
+        elapsed = time.perf_counter() - t0
+        metrics.observe("llm_http_seconds", elapsed, provider="local")
+        metrics.observe("llm_time_to_first_token_seconds", response.elapsed.total_seconds(), provider="local")
         response.raise_for_status()
+
+        t_parse = time.perf_counter()
         data = response.json()
 
         if "choices" in data and len(data["choices"]) > 0:
@@ -78,6 +109,11 @@ def get_command_from_llm(prompt: str,
                 reply = str(data)
         else:
             reply = str(data)
+        metrics.observe("llm_parse_seconds", time.perf_counter() - t_parse, provider="local")
+
+        tokens = (data.get("usage") or {}).get("completion_tokens") if isinstance(data, dict) else None
+        if tokens and elapsed > 0:
+            metrics.observe("llm_tokens_per_second", tokens / elapsed, provider="local")
 
         # === 存入对话上下文 ===
         CONTEXT_CACHE[session_id].append({"role": "assistant", "content": reply})
@@ -85,10 +121,40 @@ def get_command_from_llm(prompt: str,
         return reply
 
     except Exception as e:
+        metrics.inc("llm_errors_total", provider="local")
         return f"❌ 本地 vLLM API 请求失败: {e}"
 
 
 # ========= 辅助函数 =========
+def append_execution_result(command: str, output: str, session_id: str = "default", exit_code: int = None):
+    """将命令执行结果（压缩后）附加到最近一条 assistant 消息，供后续追问使用"""
+    msgs = CONTEXT_CACHE.get(session_id)
+    if not msgs:
+        return
+    feedback = format_execution_feedback(command, output, exit_code, EXEC_FEEDBACK_TOKENS)
+    if msgs[-1]["role"] == "assistant":
+        msgs[-1] = {"role": "assistant", "content": msgs[-1]["content"] + "\n\n" + feedback}
+    else:
+        msgs.append({"role": "assistant", "content": feedback})
+
+
+def remember_turn(prompt: str, reply: str, system_type: str = None, session_id: str = "default"):
+    """把未经模型生成的一轮问答（例如相似度索引直接给出的建议）记入上下文"""
+    if session_id not in CONTEXT_CACHE:
+        CONTEXT_CACHE[session_id] = [{"role": "system", "content": load_system_prompt(system_type)}]
+    CONTEXT_CACHE[session_id].append({"role": "user", "content": prompt})
+    CONTEXT_CACHE[session_id].append({"role": "assistant", "content": reply})
+
+
+def forget_last_turn(session_id: str = "default"):
+    """删除最近一轮问答（格式无效、将要重答的那一轮），不让它留在上下文里"""
+    msgs = CONTEXT_CACHE.get(session_id) or []
+    if len(msgs) > 1 and msgs[-1]["role"] == "assistant":
+        msgs.pop()
+    if len(msgs) > 1 and msgs[-1]["role"] == "user":
+        msgs.pop()
+
+
 def clear_context(session_id: str = "default"):
     """清除指定会话的上下文"""
     if session_id in CONTEXT_CACHE:
@@ -1,9 +1,14 @@
 # frent_gui.py
+import time
+_T_START = time.perf_counter()
+
 import sys
+import importlib
 import re
 import os
 import subprocess
 import threading
+import uuid
 from functools import partial
 
 from PyQt5.QtCore import Qt, QThread, pyqtSignal, QObject, QTimer
@@ -11,7 +16,7 @@ from PyQt5.QtWidgets import (
     QApplication, QMainWindow, QWidget, QVBoxLayout, QHBoxLayout,
     QLabel, QLineEdit, QPushButton, QRadioButton, QButtonGroup,
     QComboBox, QTextEdit, QPlainTextEdit, QMessageBox, QDialog,
-    QFormLayout, QSpinBox, QCheckBox, QGroupBox
+    QFormLayout, QSpinBox, QCheckBox, QGroupBox, QFileDialog, QInputDialog, QTabWidget
 )
 
 # 新增：路径与安全转义工具
@@ -19,78 +24,202 @@ import posixpath
 import ntpath
 import shlex
 
-# ----- 尝试导入项目已有模块（按你项目结构来） -----
-try:
-    from llm_api import get_command_from_api
-except Exception:
-    get_command_from_api = None
-
-try:
-    from llm_vllm import get_command_from_llm
-except Exception:
-    get_command_from_llm = None
-
-try:
-    import ssh_executor
-    connect_ssh_fn = getattr(ssh_executor, "connect_ssh", None)
-    execute_remote_command_fn = getattr(ssh_executor, "execute_remote_command", None)
-    close_ssh_fn = getattr(ssh_executor, "close_ssh", None)
-except Exception:
-    ssh_executor = None
-    connect_ssh_fn = None
-    execute_remote_command_fn = None
-    close_ssh_fn = None
+from utils import metrics
+from utils import profiler
+from utils import action_schema
+from utils.profiler import profiled
+
+# ----- 项目模块按需导入（按你项目结构来） -----
+# llm_api / llm_vllm 会拉起 requests、dotenv，ssh_executor 会拉起 paramiko 及其加密库，
+# 这些都推迟到第一次使用时再导入，保证窗口先显示出来。
+_lazy_modules = {}
+_lazy_lock = threading.Lock()
+
+
+def _lazy_import(module_name: str):
+    """
+    首次使用时导入模块；导入失败返回 None（与原先 try/except 回退行为一致）。
+    锁只保护字典读写：导入本身由 import 系统按模块加锁，后台预热 llm_api 时不会挡住界面线程导入其他模块。
+    """
+    with _lazy_lock:
+        if module_name in _lazy_modules:
+            return _lazy_modules[module_name]
+    t0 = time.perf_counter()
+    try:
+        mod = importlib.import_module(module_name)
+    except Exception as e:
+        print(f"⚠️ 模块 {module_name} 导入失败：{e}")
+        mod = None
+    with _lazy_lock:
+        if module_name not in _lazy_modules:
+            metrics.observe("lazy_import_seconds", time.perf_counter() - t0, module=module_name)
+            _lazy_modules[module_name] = mod
+        return _lazy_modules[module_name]
+
+
+def _lazy_attr(module_name: str, attr: str):
+    mod = _lazy_import(module_name)
+    return getattr(mod, attr, None) if mod is not None else None
+
+
+def _preload_providers():
+    """窗口显示后在后台预热模型模块，使首次发送不再付出导入开销"""
+    for name in ("llm_api", "llm_vllm"):
+        _lazy_import(name)
 
 # ----------------- Worker（在后台调用 LLM / 执行命令） -----------------
 class ModelWorker(QThread):
     finished_signal = pyqtSignal(str)
     error_signal = pyqtSignal(str)
+    queue_signal = pyqtSignal(int, float)   # 客户端限流排队：(排位, 预计等待秒数)
 
-    def __init__(self, provider: str, user_input: str, system_type: str, provider_settings: dict):
+    def __init__(self, provider: str, user_input: str, system_type: str, provider_settings: dict,
+                 session_id: str = None, revision=None):
         super().__init__()
         self.provider = provider
         self.user_input = user_input
         self.system_type = system_type
         self.settings = provider_settings or {}
-
-    def run(self):
+        self.session_id = session_id
+        self.revision = revision   # (文件名, 当前内容)：要求修改上一次生成的脚本时非空
+        self.served_from_index = False
+        self.route = None   # 本次请求的模型路由决策
+
+    def _lookup_similar(self):
+        """查询本地相似度索引，返回 (可直接建议的匹配, few-shot 提示文本)"""
+        index_mod = _lazy_import("utils.prompt_index")
+        if index_mod is None:
+            return None, None
         try:
+            served, matches = index_mod.lookup(self.user_input, self.system_type)
+        except Exception as e:
+            print(f"⚠️ 相似度索引查询失败：{e}")
+            return None, None
+        return served, (index_mod.format_examples(matches) if matches else None)
+
+    def _serve_from_index(self, match) -> str:
+        """相似度足够高时直接给出历史命令（仍需用户确认），并记入对话上下文"""
+        score, _, command, _ = match
+        response = f"EXECUTE: 历史相似请求的命令（相似度 {score:.2f}，未调用模型）\n{command}"
+        module = "llm_vllm" if self.provider == "local" else "llm_api"
+        remember = _lazy_attr(module, "remember_turn")
+        if remember:
             if self.provider == "local":
-                if get_command_from_llm is None:
-                    raise RuntimeError("本地 llm_vllm 模块未找到或未实现 get_command_from_llm")
-                # 尝试不同签名：优先传入 local_addr，如果实现不接受则回退
-                try:
-                    response = get_command_from_llm(self.user_input, self.system_type, self.settings.get("local_addr"))
-                except TypeError:
-                    # 回退到 2-arg 签名
-                    response = get_command_from_llm(self.user_input, self.system_type)
+                remember(self.user_input, response, system_type=self.system_type, session_id=self.session_id or "default")
             else:
-                if get_command_from_api is None:
-                    raise RuntimeError("远程 API 模块未找到或未实现 get_command_from_api")
-                # 尝试以最完整签名调用： (user_input, system_type, api_base, api_key, api_model)
+                remember(self.user_input, response, system_type=self.system_type, session_id=self.session_id)
+        self.served_from_index = True
+        metrics.inc("prompt_index_served_total")
+        return response
+
+    def _route_model(self):
+        """按请求复杂度选择模型；路由表为 "*" 或路由不可用时返回 None（沿用已配置的模型）"""
+        router = _lazy_import("utils.model_router")
+        if router is None:
+            return None
+        decision = router.route(self.user_input, self.provider)
+        self.route = decision
+        return None if decision.model == "*" else decision.model
+
+    def _call_provider(self, prompt: str, examples, model, options):
+        """调用本地或在线模型，返回回复文本"""
+        if self.provider == "local":
+            get_command_from_llm = _lazy_attr("llm_vllm", "get_command_from_llm")
+            if get_command_from_llm is None:
+                raise RuntimeError("本地 llm_vllm 模块未找到或未实现 get_command_from_llm")
+            # 尝试不同签名：优先传入 local_addr，如果实现不接受则回退
+            try:
+                return get_command_from_llm(prompt, self.system_type, self.settings.get("local_addr"),
+                                            session_id=self.session_id or "default", examples=examples,
+                                            model=model, max_new_tokens=options.max_tokens, structured=options)
+            except TypeError:
+                # 回退到 2-arg 签名
+                return get_command_from_llm(prompt, self.system_type)
+
+        get_command_from_api = _lazy_attr("llm_api", "get_command_from_api")
+        if get_command_from_api is None:
+            raise RuntimeError("远程 API 模块未找到或未实现 get_command_from_api")
+        # 尝试以最完整签名调用： (user_input, system_type, api_base, api_key, api_model)
+        try:
+            return get_command_from_api(
+                prompt,
+                self.system_type,
+                self.settings.get("api_base"),
+                self.settings.get("api_key"),
+                model or self.settings.get("api_model"),
+                max_new_tokens=options.max_tokens,
+                examples=examples,
+                session_id=self.session_id,
+                on_queue=self.queue_signal.emit,
+                structured=options
+            )
+        except TypeError:
+            # 回退 2-arg 调用 (user_input, system_type)
+            try:
+                return get_command_from_api(prompt, self.system_type)
+            except TypeError:
+                # 最后尝试将 settings 当作关键字参数（如果实现支持）
                 try:
-                    response = get_command_from_api(
-                        self.user_input,
-                        self.system_type,
-                        self.settings.get("api_base"),
-                        self.settings.get("api_key"),
-                        self.settings.get("api_model")
-                    )
-                except TypeError:
-                    # 回退 2-arg 调用 (user_input, system_type)
-                    try:
-                        response = get_command_from_api(self.user_input, self.system_type)
-                    except TypeError:
-                        # 最后尝试将 settings 当作关键字参数（如果实现支持）
-                        try:
-                            kwargs = {"system_type": self.system_type, **self.settings}
-                            response = get_command_from_api(self.user_input, **kwargs)
-                        except Exception as e:
-                            raise RuntimeError(f"调用 get_command_from_api 时出错：{e}")
-            if response is None:
-                response = ""
+                    kwargs = {"system_type": self.system_type, **self.settings}
+                    return get_command_from_api(prompt, **kwargs)
+                except Exception as e:
+                    raise RuntimeError(f"调用 get_command_from_api 时出错：{e}")
+
+    def _configured_model(self):
+        if self.provider == "local":
+            return _lazy_attr("llm_vllm", "LOCAL_MODEL")
+        return self.settings.get("api_model") or _lazy_attr("llm_api", "API_MODEL")
+
+    def _forget_last_turn(self):
+        if self.provider == "local":
+            forget = _lazy_attr("llm_vllm", "forget_last_turn")
+            if forget:
+                forget(self.session_id or "default")
+        else:
+            forget = _lazy_attr("llm_api", "forget_last_turn")
+            if forget:
+                forget(self.system_type, self.session_id)
+
+    @profiled("ModelWorker.run")
+    def run(self):
+        t0 = time.perf_counter()
+        try:
+            served, examples = (None, None) if self.revision else self._lookup_similar()
+            if served is not None:
+                self.finished_signal.emit(self._serve_from_index(served))
+                return
+            if examples:
+                metrics.inc("prompt_index_hints_total")
+            if self.revision:
+                # 附上当前脚本，让模型只输出统一 diff（只随本次请求发送，不写入对话记忆）
+                revision_context = _lazy_attr("utils.script_patch", "revision_context")
+                if revision_context is not None:
+                    context = revision_context(*self.revision, mode=action_schema.mode_for(self.provider))
+                    examples = "\n\n".join(x for x in (examples, context) if x)
+                    metrics.inc("script_revision_requests_total")
+            model = self._route_model()
+            options = action_schema.request_options(self.provider, self.route.tier if self.route else "simple",
+                                                    model=model or self._configured_model())
+            response = self._call_provider(self.user_input, examples, model, options) or ""
+            # 严格校验；格式不合格时自动让模型重答，而不是让用户再发一次
+            for _ in range(action_schema.REPAIR_RETRIES):
+                if response.startswith("❌"):
+                    break   # 请求本身失败，重试格式没有意义
+                try:
+                    action_schema.parse_action(response)
+                    break
+                except action_schema.ActionParseError as e:
+                    metrics.inc("action_parse_retries_total", provider=self.provider)
+                    print(f"⚠️ 模型回复格式无效（{e}），自动重试")
+                    # 无效的一轮从上下文中删掉，重新发送原请求，纠正提示只随本次请求附带
+                    self._forget_last_turn()
+                    repair = action_schema.repair_prompt(e, action_schema.mode_for(self.provider))
+                    response = self._call_provider(self.user_input, "\n\n".join(x for x in (examples, repair) if x),
+                                                   model, options) or ""
+            metrics.observe("model_turn_seconds", time.perf_counter() - t0, provider=self.provider)
             self.finished_signal.emit(response)
         except Exception as e:
+            metrics.inc("model_turn_errors_total", provider=self.provider)
             self.error_signal.emit(str(e))
 
 
@@ -99,49 +228,170 @@ class LocalExecWorker(QThread):
     finished_signal = pyqtSignal(str)
     error_signal = pyqtSignal(str)
 
-    def __init__(self, command: str):
+    def __init__(self, command: str, session_key: str = None, cache: bool = False, refresh: bool = False,
+                 sandbox: bool = False):
         super().__init__()
         self.command = command
-
+        self.session_key = session_key   # 非空时在该会话的常驻 shell 中执行
+        self.cache = cache               # 只读命令经结果缓存
+        self.refresh = refresh           # 忽略已缓存的结果，重新执行
+        self.sandbox = sandbox           # 在资源限制下执行（CPU / 内存 / 文件数 / 进程数 / 输出）
+        self.returncode = None
+        self.elapsed = None
+        self.cached_age = None           # 结果来自缓存时为缓存年龄（秒）
+        self.usage = None                # 资源受限执行时的资源占用（sandbox_exec.Usage）
+
+    @profiled("LocalExecWorker.run")
     def run(self):
+        t0 = time.perf_counter()
         try:
-            proc = subprocess.Popen(
-                self.command,
-                shell=True,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.STDOUT,
-                text=True,
-                bufsize=1,
-                universal_newlines=True
-            )
-            output_accum = []
-            if proc.stdout:
-                for line in proc.stdout:
-                    self.line_signal.emit(line.rstrip("\n"))
-                    output_accum.append(line)
-            proc.wait()
-            final = "".join(output_accum)
+            shell_session = _lazy_import("shell_session") if self.session_key else None
+            use_shell = shell_session is not None and shell_session.supported()
+            cwd = shell_session.get_local_shell(self.session_key).cwd if use_shell else None
+            result_cache = _lazy_import("utils.result_cache")
+            if result_cache is None:
+                self.returncode, final = self._execute(shell_session if use_shell else None, cwd)
+            elif self.cache:
+                (self.returncode, final), self.cached_age = result_cache.run_cached(
+                    "local", cwd or os.getcwd(), self.command,
+                    lambda: self._execute(shell_session if use_shell else None, cwd),
+                    refresh=self.refresh, ok=lambda res: res[0] == 0)
+                if self.cached_age is not None:
+                    self.line_signal.emit(final.rstrip("\n"))
+            else:
+                result_cache.note_executed("local", self.command)
+                self.returncode, final = self._execute(shell_session if use_shell else None, cwd)
+            self.elapsed = time.perf_counter() - t0
+            if self.cached_age is None:
+                metrics.observe("command_exec_seconds", self.elapsed, target="local")
             self.finished_signal.emit(final)
         except Exception as e:
             self.error_signal.emit(str(e))
 
+    def _execute(self, shell_session, cwd):
+        """实际执行命令（逐行发出输出），返回 (returncode, 完整输出)"""
+        metrics.inc("commands_total", target="local")
+        sandbox_exec = _lazy_import("sandbox_exec") if self.sandbox else None
+        if sandbox_exec is not None and sandbox_exec.supported():
+            # 每条命令一个受限子进程（在常驻 shell 的当前目录下执行，cd / export 不会保留）
+            returncode, out, self.usage = sandbox_exec.run(self.command, cwd=cwd, on_line=self.line_signal.emit)
+            report = sandbox_exec.format_usage(self.usage)
+            self.line_signal.emit(report)
+            return returncode, out + report + "\n"
+        # 常见只读命令直接在进程内完成（在常驻 shell 的当前目录下），不支持的再交给 shell / 子进程
+        builtin_exec = _lazy_import("builtin_exec")
+        if builtin_exec is not None:
+            fast = builtin_exec.try_run(self.command, cwd=cwd, on_line=self.line_signal.emit)
+            if fast is not None:
+                returncode, out, err = fast
+                if err:
+                    self.line_signal.emit(err)
+                return returncode, out + (err + "\n" if err else "")
+        if shell_session is not None:
+            shell = shell_session.get_local_shell(self.session_key)
+            return shell.run(self.command, on_line=self.line_signal.emit)
+        proc = subprocess.Popen(
+            self.command,
+            shell=True,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            text=True,
+            bufsize=1,
+            universal_newlines=True
+        )
+        output_accum = []
+        if proc.stdout:
+            for line in proc.stdout:
+                self.line_signal.emit(line.rstrip("\n"))
+                output_accum.append(line)
+        return proc.wait(), "".join(output_accum)
+
 
 class RemoteExecWorker(QThread):
     chunk_signal = pyqtSignal(str)
     finished_signal = pyqtSignal(str)
     error_signal = pyqtSignal(str)
 
-    def __init__(self, command: str, system_type: str, ssh_client=None):
+    def __init__(self, command: str, system_type: str, ssh_client=None, session_key: str = None,
+                 parallel: bool = False, cache: bool = False, refresh: bool = False):
         super().__init__()
         self.command = command
         self.system_type = system_type
         self.ssh_client = ssh_client
-
+        self.session_key = session_key
+        self.parallel = parallel
+        self.cache = cache       # 只读命令经结果缓存
+        self.refresh = refresh   # 忽略已缓存的结果，重新执行
+        self.returncode = None   # 连接失败 / 被拦截时退出码未知
+        self.elapsed = None
+        self.cached_age = None   # 结果来自缓存时为缓存年龄（秒）
+        self.summary = None      # 多条命令时的汇总行（逐条输出已通过 chunk_signal 显示）
+
+    def _run_many(self, commands, t0, batch: bool = False):
+        """
+        每行一条命令：默认在同一连接上各开一个通道并发执行，完成一条输出一条；
+        batch=True 时合成一个脚本在一次 exec 中依次执行（一个往返），结束后逐条输出。
+        """
+        fn_name = "execute_remote_batch" if batch else "execute_remote_commands"
+        run_many = _lazy_attr("ssh_executor", fn_name)
+        if run_many is None:
+            raise RuntimeError(f"未找到 ssh_executor.{fn_name} 函数")
+        total = len(commands)
+        label = "批量执行" if batch else "并行执行"
+        info = getattr(self.ssh_client, "_connection_info", None)
+        host = f"{info[2]}@{info[0]}:{info[1]}" if info else "remote"
+        blocks = [None] * total
+
+        def on_result(i, res):
+            code = res["exit_status"]
+            body = "\n".join(x for x in (res["stdout"].strip(), res["stderr"].strip()) if x)
+            blocks[i] = f"[{i + 1}/{total}] {host} $ {res['command']}  (exit={code}, {res['seconds']:.2f}s)\n{body}".rstrip()
+            self.chunk_signal.emit(blocks[i])
+
+        results = run_many(commands, self.system_type, client=self.ssh_client, on_result=on_result)
+        codes = [r["exit_status"] for r in results]
+        self.returncode = None if None in codes else max(codes)
+        self.elapsed = time.perf_counter() - t0
+        failed = sum(1 for c in codes if c != 0)
+        self.summary = (f"✅ {label} {total} 条命令，失败 {failed} 条。" if not failed
+                        else f"⚠️ {label} {total} 条命令，失败 {failed} 条。")
+        # 完整输出（每条命令带主机 / 命令头）供历史、审计、回写模型与相似度索引使用；终端已逐条显示，只补摘要
+        blocks = [b or f"[{i + 1}/{total}] {host} $ {commands[i]}  (exit=None)" for i, b in enumerate(blocks)]
+        self.finished_signal.emit("\n\n".join(blocks + [self.summary]))
+
+    def _uses_persistent_shell(self) -> bool:
+        shell_session = _lazy_import("shell_session") if self.session_key else None
+        return bool(shell_session is not None and shell_session.PERSISTENT_SHELL
+                    and "windows" not in (self.system_type or "").lower())
+
+    @profiled("RemoteExecWorker.run")
     def run(self):
+        t0 = time.perf_counter()
         try:
+            commands = [ln.strip() for ln in self.command.splitlines() if ln.strip()]
+            if self.parallel and len(commands) > 1:
+                self._run_many(commands, t0)
+                return
+            # 不走常驻 shell 时，多行命令合成一次 exec 执行，并按行拆分输出与退出码
+            if len(commands) > 1 and not self._uses_persistent_shell():
+                self._run_many(commands, t0, batch=True)
+                return
+            execute_remote_command_fn = _lazy_attr("ssh_executor", "execute_remote_command")
             if execute_remote_command_fn is None:
                 raise RuntimeError("未找到 ssh_executor.execute_remote_command 函数")
-            res = execute_remote_command_fn(self.command, self.system_type)
+            def run():
+                return execute_remote_command_fn(self.command, self.system_type, client=self.ssh_client,
+                                                 session_key=self.session_key, with_status=True, cache=False)
+
+            result_cache = _lazy_import("utils.result_cache") if self.cache else None
+            if result_cache is not None:
+                host, cwd = _lazy_attr("ssh_executor", "remote_cache_scope")(self.ssh_client, self.session_key)
+                (self.returncode, res), self.cached_age = result_cache.run_cached(
+                    host, cwd, self.command, run, refresh=self.refresh,
+                    ok=lambda r: r[0] == 0 and not str(r[1]).startswith("❌"))
+            else:
+                self.returncode, res = run()
+            self.elapsed = time.perf_counter() - t0
             if isinstance(res, str):
                 self.finished_signal.emit(res)
             else:
@@ -150,33 +400,171 @@ class RemoteExecWorker(QThread):
             self.error_signal.emit(str(e))
 
 # ============== 新增：SFTP 工具（远端创建目录、写入文本） ==============
-def _sftp_mkdirs(sftp, remote_dir: str):
-    # 将路径统一转 POSIX 分隔再逐层创建
-    if not remote_dir:
-        return
-    path = remote_dir.replace("\\", "/")
-    parts = [p for p in path.split("/") if p]
-    cur = "/" if path.startswith("/") else ""
-    for p in parts:
-        nextp = (cur + "/" + p) if cur else ("/" + p if path.startswith("/") else p)
+def sftp_write_text(ssh_client, remote_path: str, content: str, progress=None):
+    # 复用 ssh_executor 中按连接缓存的 SFTP 会话
+    fn = _lazy_attr("ssh_executor", "sftp_write_text")
+    if fn is None:
+        raise RuntimeError("未找到 ssh_executor.sftp_write_text")
+    fn(ssh_client, remote_path, content, progress=progress)
+
+
+class SSHConnectWorker(QThread):
+    """后台建立 SSH 连接并探测远端系统"""
+    finished_signal = pyqtSignal(object, object)   # (client, detected_system)
+    error_signal = pyqtSignal(str)
+
+    def __init__(self, host, port, username, password):
+        super().__init__()
+        self.args = (host, port, username, password)
+
+    def run(self):
         try:
-            sftp.stat(nextp)
-        except IOError:
-            sftp.mkdir(nextp)
-        cur = nextp
+            connect_ssh_fn = _lazy_attr("ssh_executor", "connect_ssh")
+            if connect_ssh_fn is None:
+                raise RuntimeError("未找到 ssh_executor.connect_ssh")
+            try:
+                conn_res = connect_ssh_fn(*self.args)
+            except TypeError:
+                conn_res = connect_ssh_fn()
+            # 兼容返回 (client, remote_system)
+            ssh_client = conn_res[0] if isinstance(conn_res, (list, tuple)) else conn_res
+            detected_sys = (conn_res[1] if isinstance(conn_res, (list, tuple)) and len(conn_res) > 1 else None)
+            self.finished_signal.emit(ssh_client, detected_sys)
+        except Exception as e:
+            self.error_signal.emit(str(e))
 
-def sftp_write_text(ssh_client, remote_path: str, content: str):
-    sftp = ssh_client.open_sftp()
-    try:
-        # 统一用 POSIX 切分拿目录
-        dirpath = remote_path.replace("\\", "/")
-        if "/" in dirpath:
-            dir_only = dirpath.rsplit("/", 1)[0]
-            _sftp_mkdirs(sftp, dir_only)
-        with sftp.open(remote_path, "w") as f:
-            f.write(content)
-    finally:
-        sftp.close()
+
+class ScriptSaveWorker(QThread):
+    """后台保存生成的脚本（本地写文件或 SFTP 写入远端），带进度信号，不阻塞界面"""
+    progress_signal = pyqtSignal(int, int)
+    finished_signal = pyqtSignal(str)
+    error_signal = pyqtSignal(str)
+
+    CHUNK = 256 * 1024
+
+    def __init__(self, path: str, content: str, ssh_client=None, cache_os: str = None, base=None):
+        super().__init__()
+        self.path = path
+        self.content = content
+        self.ssh_client = ssh_client   # 非空时写入远端
+        self.cache_os = cache_os       # 非空时写入远端脚本缓存（按内容寻址，path 只取文件名）
+        self.base = base               # (旧脚本路径, 旧内容)：应用 PATCH 时非空，远端只发送差量
+        self.uploaded = True           # 远端缓存命中时为 False
+        self.transfer = None           # 应用 PATCH 时为 (方式, 发送字节数)
+        self._last_emit = 0.0
+
+    def _progress(self, done: int, total: int):
+        now = time.perf_counter()
+        if done >= total or now - self._last_emit >= 0.1:
+            self._last_emit = now
+            self.progress_signal.emit(done, total)
+
+    def _run_patch(self):
+        base_path, base_content = self.base
+        if self.ssh_client is not None and self.cache_os is not None:
+            ensure_patched = _lazy_attr("script_cache", "ensure_patched")
+            if ensure_patched is None:
+                raise RuntimeError("未找到 script_cache.ensure_patched")
+            filename = ntpath.basename(self.path) if "win" in self.cache_os else posixpath.basename(self.path)
+            self.path, mode, sent = ensure_patched(self.ssh_client, filename, base_path, base_content,
+                                                   self.content, self.cache_os)
+            self.uploaded = mode != "cached"
+        elif self.ssh_client is not None:
+            patch_remote_file = _lazy_attr("ssh_sync", "patch_remote_file")
+            if patch_remote_file is None:
+                raise RuntimeError("未找到 ssh_sync.patch_remote_file")
+            mode, sent = patch_remote_file(self.ssh_client, base_path, base_content.encode("utf-8"),
+                                           self.content.encode("utf-8"), dest_path=self.path)
+        else:
+            with open(base_path, "r", encoding="utf-8") as f:
+                if f.read() != base_content:
+                    raise RuntimeError(f"{base_path} 在生成后已被修改，未应用补丁")
+            tmp = f"{self.path}.yandao-patch.tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                f.write(self.content)
+            os.chmod(tmp, os.stat(base_path).st_mode & 0o7777)
+            os.replace(tmp, self.path)
+            mode, sent = "local", len(self.content.encode("utf-8"))
+        self.transfer = (mode, sent)
+
+    def run(self):
+        try:
+            if self.base is not None:
+                self._run_patch()
+            elif self.ssh_client is not None and self.cache_os is not None:
+                ensure_script = _lazy_attr("script_cache", "ensure_script")
+                if ensure_script is None:
+                    raise RuntimeError("未找到 script_cache.ensure_script")
+                filename = ntpath.basename(self.path) if "win" in self.cache_os else posixpath.basename(self.path)
+                try:
+                    self.path, self.uploaded = ensure_script(self.ssh_client, filename, self.content,
+                                                             self.cache_os, progress=self._progress)
+                except _lazy_attr("script_cache", "CacheUnavailable"):
+                    # 缓存目录不是当前用户私有：不走缓存，按原路径普通上传
+                    self.cache_os = None
+                    sftp_write_text(self.ssh_client, self.path, self.content, progress=self._progress)
+            elif self.ssh_client is not None:
+                sftp_write_text(self.ssh_client, self.path, self.content, progress=self._progress)
+            else:
+                os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+                total = len(self.content)
+                with open(self.path, "w", encoding="utf-8") as f:
+                    for start in range(0, total, self.CHUNK):
+                        f.write(self.content[start:start + self.CHUNK])
+                        self._progress(min(start + self.CHUNK, total), total)
+            self.finished_signal.emit(self.path)
+        except Exception as e:
+            self.error_signal.emit(str(e))
+
+
+class TransferWorker(QThread):
+    """后台 SFTP 上传 / 下载，带进度信号"""
+    progress_signal = pyqtSignal(int, int)
+    finished_signal = pyqtSignal(str)
+    error_signal = pyqtSignal(str)
+
+    def __init__(self, direction: str, local_path: str, remote_path: str, ssh_client=None):
+        super().__init__()
+        self.direction = direction
+        self.local_path = local_path
+        self.remote_path = remote_path
+        self.ssh_client = ssh_client
+        self._last_emit = 0.0
+
+    def _progress(self, done: int, total: int):
+        # 限制信号频率，避免大文件传输时刷爆 UI 事件队列
+        now = time.perf_counter()
+        if done >= total or now - self._last_emit >= 0.1:
+            self._last_emit = now
+            self.progress_signal.emit(done, total)
+
+    def run(self):
+        try:
+            if self.direction == "upload":
+                fn = _lazy_attr("ssh_executor", "sftp_upload")
+                if fn is None:
+                    raise RuntimeError("未找到 ssh_executor.sftp_upload")
+                n = fn(self.local_path, self.remote_path, client=self.ssh_client, progress=self._progress)
+                self.finished_signal.emit(f"✅ 已上传 {self.local_path} -> {self.remote_path}（{n} 字节）")
+            elif self.direction == "sync":
+                fn = _lazy_attr("ssh_sync", "sync_directory")
+                if fn is None:
+                    raise RuntimeError("未找到 ssh_sync.sync_directory")
+                st = fn(self.local_path, self.remote_path, client=self.ssh_client, progress=self._progress)
+                msg = (f"✅ 已同步 {self.local_path} -> {self.remote_path}：共 {st['files']} 个文件，"
+                       f"跳过 {st['skipped']}，增量 {st['delta']}，整文件 {st['full']}，"
+                       f"发送 {st['bytes_sent']} / {st['bytes_total']} 字节，耗时 {st['seconds']:.1f}s")
+                if st["errors"]:
+                    msg += "\n⚠️ 失败：\n" + "\n".join(st["errors"])
+                self.finished_signal.emit(msg)
+            else:
+                fn = _lazy_attr("ssh_executor", "sftp_download")
+                if fn is None:
+                    raise RuntimeError("未找到 ssh_executor.sftp_download")
+                n = fn(self.remote_path, self.local_path, client=self.ssh_client, progress=self._progress)
+                self.finished_signal.emit(f"✅ 已下载 {self.remote_path} -> {self.local_path}（{n} 字节）")
+        except Exception as e:
+            self.error_signal.emit(str(e))
 
 # ----------------- SSH 参数输入对话框 -----------------
 class SSHDialog(QDialog):
@@ -226,21 +614,105 @@ class SSHDialog(QDialog):
             "system_type": self.os_combo.currentText()
         }
 
-# ----------------- 主窗口 -----------------
-class MainWindow(QMainWindow):
+# ----------------- 历史记录对话框 -----------------
+class HistorySearchWorker(QThread):
+    """后台查询历史记录（首次打开时还要等待数据库初始化），不阻塞界面"""
+    finished_signal = pyqtSignal(int, list)
+    error_signal = pyqtSignal(int, str)
+
+    def __init__(self, store, text: str, seq: int):
+        super().__init__()
+        self.store = store
+        self.text = text
+        self.seq = seq
+
+    def run(self):
+        try:
+            self.finished_signal.emit(self.seq, self.store.search(self.text))
+        except Exception as e:
+            self.error_signal.emit(self.seq, str(e))
+
+
+class HistoryDialog(QDialog):
+    def __init__(self, store, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle("历史记录")
+        self.resize(800, 560)
+        self.store = store
+
+        self.search_input = QLineEdit()
+        self.search_input.setPlaceholderText("搜索提示词 / 回复 / 命令 / 输出，留空显示最近记录")
+        self.results = QPlainTextEdit()
+        self.results.setReadOnly(True)
+
+        vbox = QVBoxLayout()
+        vbox.addWidget(self.search_input)
+        vbox.addWidget(self.results)
+        self.setLayout(vbox)
+
+        # 输入防抖：停止输入 200ms 后再查询
+        self.search_timer = QTimer(self)
+        self.search_timer.setSingleShot(True)
+        self.search_timer.timeout.connect(self.refresh)
+        self.search_input.textChanged.connect(lambda _: self.search_timer.start(200))
+        self._seq = 0
+        self._workers = set()
+        self.results.setPlainText("正在加载历史记录…")
+        self.refresh()
+
+    def refresh(self):
+        # 只显示最后一次查询的结果；更早的查询结束后直接丢弃
+        self._seq += 1
+        worker = HistorySearchWorker(self.store, self.search_input.text(), self._seq)
+        worker.finished_signal.connect(self._show_rows)
+        worker.error_signal.connect(
+            lambda seq, e: seq == self._seq and self.results.setPlainText(f"❌ 查询失败：{e}"))
+        worker.finished.connect(lambda: self._workers.discard(worker))
+        self._workers.add(worker)
+        worker.start()
+
+    def _show_rows(self, seq: int, rows: list):
+        if seq != self._seq:
+            return
+        blocks = []
+        for r in rows:
+            ts = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(r["ts"] or 0))
+            head = f"[{ts}] {r['provider'] or ''} / {r['system_type'] or ''}" + (f" @ {r['host']}" if r["host"] else "")
+            lines = [head, f"🧑 {r['prompt']}"]
+            if r["command"]:
+                status = "" if r["exit_status"] is None else f"（退出码 {r['exit_status']}）"
+                lines.append(f"$ {r['command']} {r['decision'] or ''}{status}")
+            if r["output_preview"]:
+                lines.append(r["output_preview"])
+            elif r["response"]:
+                lines.append(r["response"])
+            blocks.append("\n".join(lines))
+        self.results.setPlainText(("\n" + "─" * 40 + "\n").join(blocks) or "（暂无记录）")
+
+
+# ----------------- 会话标签页 -----------------
+class SessionTab(QWidget):
+    """
+    一个独立会话：拥有自己的会话 ID、模型配置、SSH 目标与上下文。
+    不同标签页的请求互不阻塞，可以并发进行。
+    """
 
     voice_text_signal = pyqtSignal(str)
     voice_done_signal = pyqtSignal()
+    title_changed = pyqtSignal(str)
 
-
-    def __init__(self):
-        super().__init__()
-        self.setWindowTitle("言道 OS 前端 — PyQt5")
-        self.resize(1000, 720)
+    def __init__(self, title: str = "会话", parent=None):
+        super().__init__(parent)
+        self.title = title
 
         self.ssh_client = None
+        self.ssh_target = None
         self.remote_system_type = None
         self.is_recording = False
+        self.session_id = uuid.uuid4().hex   # 模型上下文与历史记录共用的会话标识
+        self.history_started = False
+        self.current_turn_id = None
+        self.last_script = None   # 上一次生成 / 修改的脚本：{"filename", "path", "content", "remote_os"}
 
         # 顶部设置区
         top_widget = QWidget()
@@ -255,6 +727,23 @@ class MainWindow(QMainWindow):
         self.rb_local.setChecked(True)
         mg_layout.addWidget(self.rb_local)
         mg_layout.addWidget(self.rb_ssh)
+        # 多行命令在同一 SSH 连接上并发执行（各行需相互独立）
+        self.chk_parallel = QCheckBox("多行命令并行执行（SSH）")
+        mg_layout.addWidget(self.chk_parallel)
+        # 只读命令（df / free / uname / ls 等）在有效期内直接返回上次结果
+        cache_row = QHBoxLayout()
+        self.chk_result_cache = QCheckBox("只读命令结果缓存")
+        self.chk_result_cache.setChecked(bool((_lazy_attr("utils.result_cache", "enabled") or (lambda: False))()))
+        self.btn_cache_refresh = QPushButton("强制刷新")
+        self.btn_cache_refresh.setEnabled(False)
+        cache_row.addWidget(self.chk_result_cache)
+        cache_row.addWidget(self.btn_cache_refresh)
+        mg_layout.addLayout(cache_row)
+        # 本机命令在 CPU / 内存 / 文件数 / 进程数 / 输出上限下执行，避免失控命令拖垮本机
+        self.chk_sandbox = QCheckBox("资源受限执行（本机）")
+        self.chk_sandbox.setEnabled(bool((_lazy_attr("sandbox_exec", "supported") or (lambda: False))()))
+        self.chk_sandbox.setChecked(bool((_lazy_attr("sandbox_exec", "enabled") or (lambda: False))()))
+        mg_layout.addWidget(self.chk_sandbox)
         mode_groupbox.setLayout(mg_layout)
         top_layout.addWidget(mode_groupbox)
 
@@ -349,8 +838,14 @@ class MainWindow(QMainWindow):
         bottom_row = QHBoxLayout()
         self.btn_clear = QPushButton("清空终端")
         self.btn_disconnect = QPushButton("断开 SSH（若已连接）")
+        self.btn_upload = QPushButton("上传文件")
+        self.btn_download = QPushButton("下载文件")
+        self.btn_sync = QPushButton("同步目录")
         bottom_row.addWidget(self.btn_clear)
         bottom_row.addStretch()
+        bottom_row.addWidget(self.btn_upload)
+        bottom_row.addWidget(self.btn_download)
+        bottom_row.addWidget(self.btn_sync)
         bottom_row.addWidget(self.btn_disconnect)
 
         central_layout.addWidget(input_box)
@@ -358,27 +853,58 @@ class MainWindow(QMainWindow):
         central_layout.addLayout(bottom_row)
 
         # 总体布局
-        main_widget = QWidget()
         main_layout = QVBoxLayout()
-        main_widget.setLayout(main_layout)
         main_layout.addWidget(top_widget)
         main_layout.addWidget(central)
-        self.setCentralWidget(main_widget)
+        self.setLayout(main_layout)
 
         # 信号连接
         self.provider_combo.currentIndexChanged.connect(self.on_provider_changed)
         self.btn_ssh_cfg.clicked.connect(self.open_ssh_dialog)
+        self.btn_cache_refresh.clicked.connect(self.on_cache_refresh_clicked)
         self.btn_send.clicked.connect(self.on_send_clicked)
         self.btn_voice.clicked.connect(self.on_voice_clicked)
         self.input_text.returnPressed.connect(self.on_send_clicked)
         self.btn_clear.clicked.connect(self.terminal.clear)
         self.btn_disconnect.clicked.connect(self.disconnect_ssh)
+        self.btn_upload.clicked.connect(self.on_upload_clicked)
+        self.btn_download.clicked.connect(self.on_download_clicked)
+        self.btn_sync.clicked.connect(self.on_sync_clicked)
         self.voice_text_signal.connect(self._apply_voice_text)
         self.voice_done_signal.connect(self._reset_voice_ui)
 
         # 初始化可见性
         self.on_provider_changed()
 
+    def _on_request_queued(self, position: int, eta: float):
+        self._show_status(f"⏳ API 限流排队中：第 {position} 位，预计等待 {eta:.0f} 秒", int((eta + 2) * 1000))
+
+    def _show_status(self, msg: str, timeout: int = 0):
+        """在所属主窗口的状态栏显示消息"""
+        win = self.window()
+        if isinstance(win, QMainWindow):
+            win.statusBar().showMessage(f"[{self.title}] {msg}", timeout)
+
+    def is_busy(self) -> bool:
+        """是否还有后台任务在运行（关闭标签页前检查）"""
+        for name in ("model_worker", "local_exec_worker", "remote_exec_worker", "transfer_worker",
+                     "script_save_worker", "ssh_connect_worker"):
+            w = getattr(self, name, None)
+            if w is not None and w.isRunning():
+                return True
+        return False
+
+    def shutdown(self):
+        """标签页关闭时释放常驻 shell、SSH 连接（共享连接只减少引用计数）与本会话的模型上下文"""
+        if "shell_session" in sys.modules:
+            sys.modules["shell_session"].close_sessions(self.session_id)
+        self.disconnect_ssh()
+        for module, fn_name in (("llm_api", "clear_memory"), ("llm_vllm", "clear_context")):
+            if module in sys.modules:
+                fn = getattr(sys.modules[module], fn_name, None)
+                if fn:
+                    fn(session_id=self.session_id)
+
     # ---------- Provider 面板可见性 ----------
     def on_provider_changed(self):
         provider = self.provider_combo.currentText()
@@ -400,34 +926,117 @@ class MainWindow(QMainWindow):
             system_type = vals["system_type"]
             self.remote_system_type = system_type
             self.lbl_ssh_status.setText(f"SSH: 连接中 -> {host}:{port} ...")
-            QApplication.processEvents()
-            try:
-                if connect_ssh_fn is None:
-                    raise RuntimeError("未找到 ssh_executor.connect_ssh")
-                try:
-                    conn_res = connect_ssh_fn(host, port, username, password)
-                except TypeError:
-                    conn_res = connect_ssh_fn()
-                # 兼容返回 (client, remote_system)
-                ssh_client = conn_res[0] if isinstance(conn_res, (list, tuple)) else conn_res
-                detected_sys = (conn_res[1] if isinstance(conn_res, (list, tuple)) and len(conn_res) > 1 else None)
-                self.ssh_client = ssh_client
-                if detected_sys and not self.remote_system_type:
-                    self.remote_system_type = detected_sys
-                self.lbl_ssh_status.setText(f"SSH: 已连接到 {host}:{port}")
-            except Exception as e:
-                self.ssh_client = None
-                self.lbl_ssh_status.setText(f"SSH: 连接失败 — {e}")
-                QMessageBox.warning(self, "SSH 连接失败", f"无法连接到远程主机：\n{e}")
+            # 握手、认证与系统探测都在后台线程完成，界面保持响应
+            self.btn_ssh_cfg.setEnabled(False)
+            self.ssh_connect_worker = SSHConnectWorker(host, port, username, password)
+            self.ssh_connect_worker.finished_signal.connect(
+                lambda client, detected: self._on_ssh_connected(client, detected, host, port, username))
+            self.ssh_connect_worker.error_signal.connect(self._on_ssh_connect_failed)
+            self.ssh_connect_worker.start()
+
+    def _on_ssh_connected(self, ssh_client, detected_sys, host, port, username):
+        self.btn_ssh_cfg.setEnabled(True)
+        if self.ssh_client is ssh_client:
+            # 重连到同一目标：连接池复用同一连接并已加一次引用，释放本标签页之前持有的那一次
+            close_ssh_fn = _lazy_attr("ssh_executor", "close_ssh")
+            if close_ssh_fn:
+                close_ssh_fn(ssh_client)
+        elif self.ssh_client is not None:
+            # 切换目标：释放本标签页之前持有的连接
+            self.disconnect_ssh()
+        self.ssh_client = ssh_client
+        self.ssh_target = f"{username}@{host}:{port}"
+        if detected_sys and not self.remote_system_type:
+            self.remote_system_type = detected_sys
+        self.lbl_ssh_status.setText(f"SSH: 已连接到 {host}:{port}")
+        self.title_changed.emit(f"{self.title} — {host}")
+
+    def _on_ssh_connect_failed(self, e: str):
+        self.btn_ssh_cfg.setEnabled(True)
+        self.ssh_client = None
+        self.lbl_ssh_status.setText(f"SSH: 连接失败 — {e}")
+        QMessageBox.warning(self, "SSH 连接失败", f"无法连接到远程主机：\n{e}")
 
     def disconnect_ssh(self):
+        # 从未连接过时不必为了断开而导入 paramiko
+        close_ssh_fn = _lazy_attr("ssh_executor", "close_ssh") if self.ssh_client else None
         if self.ssh_client and close_ssh_fn:
             try:
                 close_ssh_fn(self.ssh_client)
             except Exception:
                 pass
+        was_connected = self.ssh_client is not None
         self.ssh_client = None
+        self.ssh_target = None
         self.lbl_ssh_status.setText("SSH: 未连接")
+        if was_connected:
+            self.title_changed.emit(self.title)
+
+    # ---------- 历史记录 ----------
+    def _history(self):
+        return _history_store()
+
+    def _audit(self, event: str, **fields):
+        """写一条审计记录（后台批量落盘，不阻塞界面）"""
+        mod = _lazy_import("utils.audit_log")
+        if mod is None:
+            return
+        host = (self.ssh_target or "ssh") if self.rb_ssh.isChecked() else "localhost"
+        mod.get_audit_log().record(event, session=self.session_id, turn=self.current_turn_id, host=host,
+                                   prompt_sha=mod.digest(getattr(self, "last_prompt", "")), **fields)
+
+    # ---------- 文件传输（SFTP） ----------
+    def _start_transfer(self, direction: str, local_path: str, remote_path: str):
+        self.transfer_worker = TransferWorker(direction, local_path, remote_path, ssh_client=self.ssh_client)
+        label = {"upload": "上传", "download": "下载", "sync": "同步"}[direction]
+        if direction == "sync":
+            self.transfer_worker.progress_signal.connect(
+                lambda done, total: self._show_status(f"同步中：{done} / {total} 个文件"))
+        else:
+            self.transfer_worker.progress_signal.connect(
+                lambda done, total: self._show_status(
+                    f"{label}中：{done / 1048576:.1f} / {total / 1048576:.1f} MB" + (f"（{done * 100 // total}%）" if total else "")))
+        self.transfer_worker.finished_signal.connect(lambda msg: (self.terminal.appendPlainText(msg + "\n"),
+                                                                  self._show_status(msg, 5000)))
+        self.transfer_worker.error_signal.connect(lambda e: self.terminal.appendPlainText(f"❌ {label}失败: {e}\n"))
+        self.terminal.appendPlainText(f"📦 开始{label}: {local_path} <-> {remote_path}\n")
+        self.transfer_worker.start()
+
+    def on_upload_clicked(self):
+        if not self.ssh_client:
+            QMessageBox.warning(self, "未连接 SSH", "请先点击“SSH 设置 / 连接”。")
+            return
+        local_path, _ = QFileDialog.getOpenFileName(self, "选择要上传的文件")
+        if not local_path:
+            return
+        default_remote = posixpath.join("/tmp/yandao_os", os.path.basename(local_path))
+        remote_path, ok = QInputDialog.getText(self, "上传到远端", "远端路径：", text=default_remote)
+        if ok and remote_path.strip():
+            self._start_transfer("upload", local_path, remote_path.strip())
+
+    def on_download_clicked(self):
+        if not self.ssh_client:
+            QMessageBox.warning(self, "未连接 SSH", "请先点击“SSH 设置 / 连接”。")
+            return
+        remote_path, ok = QInputDialog.getText(self, "从远端下载", "远端文件路径：")
+        if not ok or not remote_path.strip():
+            return
+        remote_path = remote_path.strip()
+        local_path, _ = QFileDialog.getSaveFileName(self, "保存到", os.path.basename(remote_path.replace("\\", "/")))
+        if local_path:
+            self._start_transfer("download", local_path, remote_path)
+
+    def on_sync_clicked(self):
+        if not self.ssh_client:
+            QMessageBox.warning(self, "未连接 SSH", "请先点击“SSH 设置 / 连接”。")
+            return
+        local_dir = QFileDialog.getExistingDirectory(self, "选择要同步的本地目录")
+        if not local_dir:
+            return
+        default_remote = posixpath.join("/tmp/yandao_os", os.path.basename(local_dir.rstrip("/\\")))
+        remote_dir, ok = QInputDialog.getText(self, "同步到远端", "远端目录（POSIX 绝对路径）：", text=default_remote)
+        if ok and remote_dir.strip():
+            self._start_transfer("sync", local_dir, remote_dir.strip())
 
     # ---------- 发送到模型 ----------
     def on_send_clicked(self):
@@ -458,67 +1067,182 @@ class MainWindow(QMainWindow):
         else:
             provider_settings["local_addr"] = self.local_addr_input.text().strip() or None
 
+        # 记录本轮使用的 provider / 系统类型 / 提示词，执行结果回写上下文与收录索引时使用
+        self.last_turn = (provider, system_type)
+        self.last_prompt = user_text
+
+        # 写入历史（异步）
+        store = self._history()
+        if store is not None:
+            if not self.history_started:
+                store.start_session(self.title, session_id=self.session_id)
+                self.history_started = True
+            host = self.ssh_target if self.rb_ssh.isChecked() else "localhost"
+            self.current_turn_id = store.record_prompt(self.session_id, user_text, provider, system_type, host)
+        self.turn_started_at = time.perf_counter()
+
         # 清理旧输出
         self.model_resp.clear()
         self.terminal.appendPlainText(f">>> 发送请求到模型（{provider}），系统类型：{system_type}\n")
 
+        # 要求修改上一次生成的脚本时，附上脚本内容，让模型以 PATCH 动作只输出改动
+        revision = None
+        script_patch = _lazy_import("utils.script_patch") if self.last_script else None
+        if script_patch is not None and script_patch.wants_revision(user_text, self.last_script["filename"]):
+            revision = (self.last_script["filename"], self.last_script["content"])
+
         # 调用后台模型线程（传入 provider_settings）
-        self.model_worker = ModelWorker(provider, user_text, system_type, provider_settings)
+        self.model_worker = ModelWorker(provider, user_text, system_type, provider_settings, session_id=self.session_id,
+                                        revision=revision)
         self.model_worker.finished_signal.connect(self.on_model_response)
         self.model_worker.error_signal.connect(lambda e: self.append_model_error(e))
+        self.model_worker.queue_signal.connect(self._on_request_queued)
         self.model_worker.start()
         self.btn_send.setEnabled(False)
 
         self.input_text.clear()
 
+    def _on_exec_finished(self, turn_id, command: str, output: str, exit_code=None, elapsed=None, index_entry=None):
+        """命令执行结束：写入历史，把结果回写对话上下文；成功的 EXECUTE 命令收录进相似度索引"""
+        store = self._history()
+        if store is not None and turn_id:
+            store.record_execution(turn_id, command, output, exit_code, elapsed)
+        self._audit("executed", command=command, exit_status=exit_code,
+                    seconds=round(elapsed, 3) if elapsed is not None else None,
+                    output_bytes=len((output or "").encode("utf-8", errors="ignore")))
+        self._feed_back_output(command, output, exit_code)
+        succeeded = exit_code == 0 or (exit_code is None and not (output or "").lstrip().startswith(("❌", "⚠️")))
+        if index_entry and succeeded:
+            add_async = _lazy_attr("utils.prompt_index", "add_async")
+            if add_async is not None:
+                prompt, system_type = index_entry
+                add_async(prompt, command, system_type)
+
+    def _start_exec(self, turn_id, command: str, index_entry=None, refresh: bool = False):
+        """执行已确认的命令（SSH 模式下在远端）；refresh=True 时忽略结果缓存重新执行"""
+        self.terminal.appendPlainText(f"🪶 正在{'重新' if refresh else ''}执行: {command}\n")
+        self.last_exec = (turn_id, command, index_entry)
+        self.btn_cache_refresh.setEnabled(False)
+        cache = self.chk_result_cache.isChecked()
+
+        if self.rb_ssh.isChecked():
+            self.remote_exec_worker = RemoteExecWorker(command, self.remote_system_type or "Linux",
+                                                       ssh_client=self.ssh_client, session_key=self.session_id,
+                                                       parallel=self.chk_parallel.isChecked(),
+                                                       cache=cache, refresh=refresh)
+            worker = self.remote_exec_worker
+            self.remote_exec_worker.chunk_signal.connect(lambda s: self.terminal.appendPlainText(s))
+            self.remote_exec_worker.finished_signal.connect(
+                lambda s: self.terminal.appendPlainText("\n[远程执行结束]\n" + (worker.summary or s or "")))
+            self.remote_exec_worker.finished_signal.connect(lambda _: self._show_cache_age(worker))
+            self.remote_exec_worker.finished_signal.connect(
+                lambda out: self._on_exec_finished(turn_id, command, out, worker.returncode, worker.elapsed, index_entry))
+            # self.remote_exec_worker.finished_signal.connect(lambda _: self.terminal.appendPlainText("\n[远程执行结束]\n"))
+            self.remote_exec_worker.error_signal.connect(lambda e: self.terminal.appendPlainText(f"[远程执行错误] {e}"))
+            self.remote_exec_worker.start()
+        else:
+            self.local_exec_worker = LocalExecWorker(command, session_key=self.session_id, cache=cache, refresh=refresh,
+                                                     sandbox=self.chk_sandbox.isChecked())
+            self.local_exec_worker.line_signal.connect(lambda ln: self.terminal.appendPlainText(ln))
+            self.local_exec_worker.finished_signal.connect(lambda _: self.terminal.appendPlainText("\n[本地执行结束]\n"))
+            worker = self.local_exec_worker
+            self.local_exec_worker.finished_signal.connect(lambda _: self._show_cache_age(worker))
+            self.local_exec_worker.finished_signal.connect(
+                lambda out: self._on_exec_finished(turn_id, command, out, worker.returncode, worker.elapsed, index_entry))
+            self.local_exec_worker.error_signal.connect(lambda e: self.terminal.appendPlainText(f"[本地执行错误] {e}"))
+            self.local_exec_worker.start()
+
+    def _show_cache_age(self, worker):
+        """结果来自缓存时提示缓存年龄，并允许强制刷新"""
+        if worker.cached_age is None:
+            return
+        format_age = _lazy_attr("utils.result_cache", "format_age")
+        age = format_age(worker.cached_age) if format_age else f"{worker.cached_age:.0f} 秒前"
+        self.terminal.appendPlainText(f"♻️ 以上结果来自缓存（{age}执行），点击“强制刷新”可重新执行。\n")
+        self._show_status(f"命令结果来自缓存（{age}）", 5000)
+        self.btn_cache_refresh.setEnabled(True)
+
+    def on_cache_refresh_clicked(self):
+        if self.is_busy() or not getattr(self, "last_exec", None):
+            return
+        turn_id, command, index_entry = self.last_exec
+        self._start_exec(turn_id, command, index_entry, refresh=True)
+
+    def _record_decision(self, turn_id, command: str, approved: bool):
+        store = self._history()
+        if store is not None and turn_id:
+            store.record_decision(turn_id, command, "approved" if approved else "rejected")
+        self._audit("decision", action="execute", command=command, decision="approved" if approved else "rejected")
+
+    def _feed_back_output(self, command: str, output: str, exit_code=None):
+        """将执行结果压缩后写回本轮对话上下文"""
+        turn = getattr(self, "last_turn", None)
+        if not turn:
+            return
+        provider, system_type = turn
+        try:
+            if provider == "local":
+                fn = _lazy_attr("llm_vllm", "append_execution_result")
+                if fn:
+                    fn(command, output or "", session_id=self.session_id, exit_code=exit_code)
+            else:
+                fn = _lazy_attr("llm_api", "append_execution_result")
+                if fn:
+                    fn(command, output or "", system_type=system_type, exit_code=exit_code,
+                       session_id=self.session_id)
+        except Exception as e:
+            print(f"⚠️ 执行结果回写上下文失败：{e}")
+
     def append_model_error(self, e):
         self.btn_send.setEnabled(True)
         self.model_resp.appendPlainText(f"[模型调用错误] {e}")
 
-    
+    @profiled("on_model_response")
     def on_model_response(self, response: str):
         self.btn_send.setEnabled(True)
+        t_dispatch = time.perf_counter()
+        turn_id = self.current_turn_id
+        model_seconds = t_dispatch - getattr(self, "turn_started_at", t_dispatch)
+
+        def mark_parsed(action: str, command: str = None):
+            # 只统计解析耗时，不含后续模态对话框的等待时间
+            metrics.observe("response_dispatch_seconds", time.perf_counter() - t_dispatch, action=action)
+            self._audit("generated", action=action, command=command, model_seconds=round(model_seconds, 3))
+            store = self._history()
+            if store is not None and turn_id:
+                store.record_response(turn_id, response, action, model_seconds)
+
+        try:
+            action = action_schema.parse_action(response)
+            parse_error = None
+        except action_schema.ActionParseError as e:
+            action, parse_error = None, e
 
         # ========== 执行命令 ==========
-        if "EXECUTE:" in response:
-            cmd = response.split("EXECUTE:")[1].strip()
-            lines = cmd.splitlines()
-            desc = lines[0] if lines else "执行命令"
+        if action is not None and action.kind == "execute":
+            desc = action.description or "执行命令"
             self.model_resp.appendPlainText(f"言道将为您做：{desc}\n")
 
-            command = "\n".join(lines[1:]) if len(lines) > 1 else ""
+            command = action.command
+            mark_parsed("execute", action.command)
+            index_entry = (getattr(self, "last_prompt", ""), (getattr(self, "last_turn", None) or (None, None))[1])
             r = QMessageBox.question(
                 self, "确认执行",
                 f"是否执行以下命令？\n\n{command}\n\n（在 SSH 模式下，命令将在远程执行）",
                 QMessageBox.Yes | QMessageBox.No
             )
+            self._record_decision(turn_id, command, r == QMessageBox.Yes)
             if r != QMessageBox.Yes:
                 self.terminal.appendPlainText("🌀 已取消执行命令。\n")
                 return
 
-            self.terminal.appendPlainText(f"🪶 正在执行: {command}\n")
-
-            if self.rb_ssh.isChecked():
-                self.remote_exec_worker = RemoteExecWorker(command, self.remote_system_type or "Linux", ssh_client=self.ssh_client)
-                self.remote_exec_worker.chunk_signal.connect(lambda s: self.terminal.appendPlainText(s))
-                self.remote_exec_worker.finished_signal.connect(lambda s: self.terminal.appendPlainText("\n[远程执行结束]\n" + (s or "")))
-                # self.remote_exec_worker.finished_signal.connect(lambda _: self.terminal.appendPlainText("\n[远程执行结束]\n"))
-                self.remote_exec_worker.error_signal.connect(lambda e: self.terminal.appendPlainText(f"[远程执行错误] {e}"))
-                self.remote_exec_worker.start()
-            else:
-                self.local_exec_worker = LocalExecWorker(command)
-                self.local_exec_worker.line_signal.connect(lambda ln: self.terminal.appendPlainText(ln))
-                self.local_exec_worker.finished_signal.connect(lambda _: self.terminal.appendPlainText("\n[本地执行结束]\n"))
-                self.local_exec_worker.error_signal.connect(lambda e: self.terminal.appendPlainText(f"[本地执行错误] {e}"))
-                self.local_exec_worker.start()
+            self._start_exec(turn_id, command, index_entry)
 
         # ========== 生成脚本 ==========
-        elif "SCRIPT:" in response:
-            # --- 提取脚本块 ---
-            script_block = response.split("SCRIPT:")[1].strip().splitlines()
-            filename = script_block[0].strip() if len(script_block) > 0 else "script.py"
-            raw_location = script_block[1].strip() if len(script_block) > 1 else ""
-            description = script_block[2].strip() if len(script_block) > 2 else "无描述"
+        elif action is not None and action.kind == "script":
+            filename = action.filename
+            raw_location = action.location
+            description = action.description or "无描述"
 
             # --- 自动路径识别（本地默认；SSH 模式下仅作绝对性判断用） ---
             if raw_location in ["当前路径", "当前目录", "当前文件夹", "."]:
@@ -528,14 +1252,8 @@ class MainWindow(QMainWindow):
             else:
                 location = os.getcwd()
 
-            # --- 提取代码内容 ---
-            match = re.search(r"```(?:python|bash)?\n([\s\S]*?)```", response)
-            if match:
-                script_content = match.group(1).strip()
-            else:
-                # 清理 <script> 标签
-                script_content = "\n".join(script_block[3:])
-                script_content = re.sub(r"</?script>", "", script_content).strip()
+            script_content = action.content
+            mark_parsed("script", action.filename)
 
             # --- 展示信息 ---
             self.model_resp.appendPlainText(f"即将生成脚本文件：{filename}")
@@ -545,6 +1263,8 @@ class MainWindow(QMainWindow):
 
             # --- 确认保存 ---
             r = QMessageBox.question(self, "保存脚本", f"是否保存脚本文件 '{filename}'？", QMessageBox.Yes | QMessageBox.No)
+            self._audit("decision", action="script", command=filename,
+                        decision="approved" if r == QMessageBox.Yes else "rejected")
             if r != QMessageBox.Yes:
                 self.terminal.appendPlainText("❎ 已取消脚本生成。\n")
                 return
@@ -568,6 +1288,11 @@ class MainWindow(QMainWindow):
                 def is_abs_posix(p: str) -> bool:
                     return p.startswith("/")
 
+                # 未指定绝对位置时走远端脚本缓存：内容相同的脚本不重复上传
+                script_cache = _lazy_import("script_cache")
+                cache = script_cache is not None and script_cache.enabled() and not (
+                    raw_loc and (is_abs_win(raw_loc) if "win" in remote_os else is_abs_posix(raw_loc)))
+
                 if "win" in remote_os:
                     if raw_loc and is_abs_win(raw_loc):
                         remote_dir = raw_loc
@@ -581,79 +1306,195 @@ class MainWindow(QMainWindow):
                         remote_dir = "/tmp/yandao_os"
                     remote_path = posixpath.join(remote_dir, filename)
 
-                try:
-                    # 用 SFTP 在远端创建文件
-                    sftp_write_text(self.ssh_client, remote_path, script_content)
-                    self.terminal.appendPlainText(f"✅ 已在远端生成脚本: {remote_path}\n")
-                except Exception as e:
-                    self.terminal.appendPlainText(f"❌ 远程保存失败: {e}\n")
-                    return
-
-                # --- 执行脚本（远端） ---
-                run_now = QMessageBox.question(self, "执行脚本", "是否立即执行该脚本？", QMessageBox.Yes | QMessageBox.No)
-                if run_now == QMessageBox.Yes:
-                    if filename.endswith(".py"):
-                        command = f'python "{remote_path}"' if "win" in remote_os else f"python3 {shlex.quote(remote_path)}"
-                    elif filename.endswith(".sh"):
-                        command = f'pwsh -File "{remote_path}"' if "win" in remote_os else f"bash {shlex.quote(remote_path)}"
-                    else:
-                        if "win" in remote_os:
-                            command = f'"{remote_path}"'
-                        else:
-                            command = f"chmod +x {shlex.quote(remote_path)} && {shlex.quote(remote_path)}"
-
-                    self.terminal.appendPlainText(f"🪶 正在远程执行脚本: {command}\n")
-                    self.remote_exec_worker = RemoteExecWorker(command, self.remote_system_type or "Linux", ssh_client=self.ssh_client)
-                    self.remote_exec_worker.chunk_signal.connect(lambda s: self.terminal.appendPlainText(s))
-                    self.remote_exec_worker.finished_signal.connect(lambda s: self.terminal.appendPlainText("\n[远程执行结束]\n" + (s or "")))
-                    self.remote_exec_worker.error_signal.connect(lambda e: self.terminal.appendPlainText(f"[远程脚本执行错误] {e}"))
-                    self.remote_exec_worker.start()
-                else:
-                    self.terminal.appendPlainText("✅ 已在远端保存脚本，但未执行。\n")
+                self._save_script(turn_id, filename, remote_path, script_content, remote_os=remote_os, cache=cache)
 
             else:
                 # ========== 本地模式：保存到本地 ==========
-                os.makedirs(location, exist_ok=True)
-                save_path = os.path.join(location, filename)
-                try:
-                    with open(save_path, "w", encoding="utf-8") as f:
-                        f.write(script_content)
-                    self.terminal.appendPlainText(f"✅ 已生成脚本文件: {save_path}\n")
-                except Exception as e:
-                    self.terminal.appendPlainText(f"❌ 保存失败: {e}\n")
-                    return
+                self._save_script(turn_id, filename, os.path.join(location, filename), script_content)
 
-                # --- 执行脚本（本地） ---
-                run_now = QMessageBox.question(self, "执行脚本", "是否立即执行该脚本？", QMessageBox.Yes | QMessageBox.No)
-                if run_now == QMessageBox.Yes:
-                    if filename.endswith(".py"):
-                        command = f"python3 {save_path}"
-                    elif filename.endswith(".sh"):
-                        command = f"bash {save_path}"
-                    else:
-                        command = f"./{save_path}"
-
-                    self.terminal.appendPlainText(f"🪶 正在执行脚本: {command}\n")
-                    self.local_exec_worker = LocalExecWorker(command)
-                    self.local_exec_worker.line_signal.connect(lambda ln: self.terminal.appendPlainText(ln))
-                    self.local_exec_worker.finished_signal.connect(lambda _: self.terminal.appendPlainText("\n[脚本执行结束]\n"))
-                    self.local_exec_worker.start()
-                else:
-                    self.terminal.appendPlainText("✅ 已保存脚本，但未执行。\n")
+        # ========== 修改上一次生成的脚本 ==========
+        elif action is not None and action.kind == "patch":
+            mark_parsed("patch", action.filename)
+            self._apply_script_patch(turn_id, action)
 
         # ========== 普通回复 ==========
-        elif "REPLY:" in response:
-            reply_content = response.split("REPLY:")[1].strip()
+        elif action is not None and action.kind == "reply":
+            reply_content = action.reply
+            mark_parsed("reply")
             self.model_resp.appendPlainText(reply_content)
 
         # ========== 其他情况 ==========
         else:
-            self.model_resp.appendPlainText(f"❌ 未检测到可识别内容，请重试。\n")
+            mark_parsed("unknown")
+            if response.startswith("❌"):
+                self.model_resp.appendPlainText(response + "\n")   # 请求本身失败
+            else:
+                self.model_resp.appendPlainText(f"❌ 未检测到可识别内容（{parse_error}），请重试。\n")
             print("=== RAW RESPONSE START ===")
             print(response)
             print("=== RAW RESPONSE END ===")
 
 
+    # ---------- 脚本保存（后台）与执行 ----------
+    def _apply_script_patch(self, turn_id, action):
+        """把模型给出的统一 diff 应用到上一次生成的脚本，确认后保存（远端只发送差量）"""
+        last = self.last_script
+        script_patch = _lazy_import("utils.script_patch")
+        if script_patch is None:
+            self.model_resp.appendPlainText("❌ 未找到 utils.script_patch，无法应用修改。\n")
+            return
+        if last is None or os.path.basename(action.filename) != last["filename"]:
+            self.model_resp.appendPlainText(
+                f"❌ 没有可修改的脚本 '{action.filename}'（只能修改本会话中最近生成的脚本），请让模型重新生成完整脚本。\n")
+            return
+        if last["remote_os"] is not None and not (self.rb_ssh.isChecked() and self.ssh_client):
+            self.model_resp.appendPlainText("❌ 上一次的脚本保存在远端，但当前未连接 SSH，无法应用修改。\n")
+            return
+
+        try:
+            new_content = script_patch.apply_patch(last["content"], action.diff)
+        except script_patch.PatchError as e:
+            self.model_resp.appendPlainText(f"❌ 修改无法应用：{e}\n请让模型重新生成完整脚本。\n")
+            return
+        added, removed = script_patch.diff_stats(action.diff)
+
+        self.model_resp.appendPlainText(f"即将修改脚本：{last['filename']}（+{added} / -{removed} 行）")
+        self.model_resp.appendPlainText(f"修改说明：{action.description or '无描述'}")
+        self.model_resp.appendPlainText("改动：\n" + "─" * 40 + f"\n{action.diff}" + "─" * 40 + "\n")
+
+        r = QMessageBox.question(self, "修改脚本", f"是否将以上修改应用到 '{last['filename']}'？",
+                                 QMessageBox.Yes | QMessageBox.No)
+        self._audit("decision", action="patch", command=last["filename"],
+                    decision="approved" if r == QMessageBox.Yes else "rejected")
+        if r != QMessageBox.Yes:
+            self.terminal.appendPlainText("❎ 已取消修改脚本。\n")
+            return
+        if new_content == last["content"]:
+            self.terminal.appendPlainText("ℹ️ 修改后内容与原脚本相同，无需保存。\n")
+            return
+
+        remote_os = last["remote_os"]
+        script_cache = _lazy_import("script_cache") if remote_os is not None else None
+        # 旧脚本在远端脚本缓存中时，新脚本同样按内容哈希存入缓存；否则原地更新
+        cache = script_cache is not None and script_cache.enabled() and \
+            script_cache.in_cache(self.ssh_client, last["path"], remote_os)
+        self._save_script(turn_id, last["filename"], last["path"], new_content, remote_os=remote_os, cache=cache,
+                          base=(last["path"], last["content"]))
+
+    def _save_script(self, turn_id, filename: str, path: str, content: str, remote_os: str = None,
+                     cache: bool = False, base=None):
+        """
+        在后台线程写入脚本（remote_os 非空时经 SFTP 写入远端），写完后询问是否执行。
+        cache=True 时写入远端脚本缓存，实际路径由内容哈希决定。
+        base=(旧路径, 旧内容) 时为修改已有脚本：远端只发送差量。
+        """
+        where = "远端" if remote_os is not None else "本地"
+        self.script_save_worker = ScriptSaveWorker(path, content,
+                                                   ssh_client=self.ssh_client if remote_os is not None else None,
+                                                   cache_os=remote_os if cache else None, base=base)
+        worker = self.script_save_worker
+        self.script_save_worker.progress_signal.connect(
+            lambda done, total: self._show_status(
+                f"正在保存脚本到{where}：{done / 1024:.0f} / {total / 1024:.0f} KB" + (f"（{done * 100 // total}%）" if total else "")))
+        self.script_save_worker.finished_signal.connect(
+            lambda saved: self._on_script_saved(turn_id, filename, saved, remote_os, reused=not worker.uploaded,
+                                                worker=worker))
+        self.script_save_worker.error_signal.connect(
+            lambda e: (self.terminal.appendPlainText(f"❌ {'远程' if remote_os is not None else ''}保存失败: {e}\n"),
+                       self._show_status("脚本保存失败", 5000)))
+        if base is not None:
+            self.terminal.appendPlainText(f"🩹 正在修改{where}脚本: {filename}\n")
+        elif cache:
+            self.terminal.appendPlainText(f"💾 正在保存脚本到{where}脚本缓存: {filename}\n")
+        else:
+            self.terminal.appendPlainText(f"💾 正在保存脚本到{where}: {path}\n")
+        self.script_save_worker.start()
+
+    def _on_script_saved(self, turn_id, filename: str, path: str, remote_os: str = None, reused: bool = False,
+                         worker=None):
+        if worker is not None:
+            self.last_script = {"filename": filename, "path": path, "content": worker.content, "remote_os": remote_os}
+            if worker.transfer is not None:
+                mode, sent = worker.transfer
+                total = len(worker.content.encode("utf-8"))
+                if mode == "delta":
+                    self.terminal.appendPlainText(f"🩹 已按差量更新远端脚本（发送 {sent} 字节 / 全文 {total} 字节）\n")
+                elif mode == "full":
+                    self.terminal.appendPlainText(f"🩹 差量更新不可用，已重新上传全文（{sent} 字节）\n")
+                metrics.inc("script_patch_bytes_sent", sent)
+                metrics.inc("script_patch_bytes_total", total)
+        if remote_os is None:
+            self._run_saved_local_script(turn_id, filename, path)
+        else:
+            cached = worker is not None and worker.cache_os is not None
+            self._run_saved_remote_script(turn_id, filename, path, remote_os, reused=reused,
+                                          content=worker.content if cached else None)
+
+    def _run_saved_remote_script(self, turn_id, filename: str, remote_path: str, remote_os: str,
+                                 reused: bool = False, content: str = None):
+        """content 非空表示脚本在远端缓存中，执行前先在远端校验其 sha256"""
+        if reused:
+            self.terminal.appendPlainText(f"♻️ 远端已有相同内容的脚本，跳过上传: {remote_path}\n")
+            self._show_status("远端脚本缓存命中，未重新上传", 3000)
+        else:
+            self.terminal.appendPlainText(f"✅ 已在远端生成脚本: {remote_path}\n")
+            self._show_status("脚本已保存到远端", 3000)
+
+        # --- 执行脚本（远端） ---
+        run_now = QMessageBox.question(self, "执行脚本", "是否立即执行该脚本？", QMessageBox.Yes | QMessageBox.No)
+        if run_now == QMessageBox.Yes:
+            if filename.endswith(".py"):
+                command = f'python "{remote_path}"' if "win" in remote_os else f"python3 {shlex.quote(remote_path)}"
+            elif filename.endswith(".sh"):
+                command = f'pwsh -File "{remote_path}"' if "win" in remote_os else f"bash {shlex.quote(remote_path)}"
+            else:
+                if "win" in remote_os:
+                    command = f'"{remote_path}"'
+                else:
+                    command = f"chmod +x {shlex.quote(remote_path)} && {shlex.quote(remote_path)}"
+
+            self._record_decision(turn_id, command, True)
+            self.terminal.appendPlainText(f"🪶 正在远程执行脚本: {command}\n")
+            if content is not None:
+                command = _lazy_attr("script_cache", "guard_command")(remote_path, content, command, remote_os)
+            self.remote_exec_worker = RemoteExecWorker(command, self.remote_system_type or "Linux", ssh_client=self.ssh_client)
+            worker = self.remote_exec_worker
+            self.remote_exec_worker.chunk_signal.connect(lambda s: self.terminal.appendPlainText(s))
+            self.remote_exec_worker.finished_signal.connect(
+                lambda s: self.terminal.appendPlainText("\n[远程执行结束]\n" + (worker.summary or s or "")))
+            self.remote_exec_worker.finished_signal.connect(
+                lambda out: self._on_exec_finished(turn_id, command, out, worker.returncode, worker.elapsed))
+            self.remote_exec_worker.error_signal.connect(lambda e: self.terminal.appendPlainText(f"[远程脚本执行错误] {e}"))
+            self.remote_exec_worker.start()
+        else:
+            self.terminal.appendPlainText("✅ 已在远端保存脚本，但未执行。\n")
+
+    def _run_saved_local_script(self, turn_id, filename: str, save_path: str):
+        self.terminal.appendPlainText(f"✅ 已生成脚本文件: {save_path}\n")
+        self._show_status("脚本已保存", 3000)
+
+        # --- 执行脚本（本地） ---
+        run_now = QMessageBox.question(self, "执行脚本", "是否立即执行该脚本？", QMessageBox.Yes | QMessageBox.No)
+        if run_now == QMessageBox.Yes:
+            if filename.endswith(".py"):
+                command = f"python3 {save_path}"
+            elif filename.endswith(".sh"):
+                command = f"bash {save_path}"
+            else:
+                command = f"./{save_path}"
+
+            self._record_decision(turn_id, command, True)
+            self.terminal.appendPlainText(f"🪶 正在执行脚本: {command}\n")
+            self.local_exec_worker = LocalExecWorker(command, sandbox=self.chk_sandbox.isChecked())
+            self.local_exec_worker.line_signal.connect(lambda ln: self.terminal.appendPlainText(ln))
+            self.local_exec_worker.finished_signal.connect(lambda _: self.terminal.appendPlainText("\n[脚本执行结束]\n"))
+            worker = self.local_exec_worker
+            self.local_exec_worker.finished_signal.connect(
+                lambda out: self._on_exec_finished(turn_id, command, out, worker.returncode, worker.elapsed))
+            self.local_exec_worker.start()
+        else:
+            self.terminal.appendPlainText("✅ 已保存脚本，但未执行。\n")
+
     def _apply_voice_text(self, text: str):
         if text:
             cur = self.input_text.text()
@@ -673,7 +1514,7 @@ class MainWindow(QMainWindow):
         self.is_recording = True
         self.btn_voice.setText("录音中...")
         self.btn_voice.setEnabled(False)
-        self.model_resp.appendPlainText("🎧 正在录音，请说话...\n")
+        self.model_resp.appendPlainText("🎧 正在录音，请说话（停顿片刻自动结束）...\n")
 
         def worker():
             try:
@@ -699,10 +1540,101 @@ class MainWindow(QMainWindow):
 
         threading.Thread(target=worker, daemon=True).start()
 
+def _history_store():
+    """首次使用时才打开历史库（不拖慢启动）；不可用时返回 None"""
+    mod = _lazy_import("utils.history_store")
+    return mod.get_store() if mod is not None else None
+
+
+# ----------------- 主窗口（多会话标签页） -----------------
+class MainWindow(QMainWindow):
+
+    def __init__(self):
+        super().__init__()
+        self.setWindowTitle("言道 OS 前端 — PyQt5")
+        self.resize(1000, 720)
+        self._tab_seq = 0
+
+        # 顶部工具行：新建会话 / 历史记录 / 性能分析
+        tool_row = QHBoxLayout()
+        self.btn_new_tab = QPushButton("新建会话")
+        self.btn_history = QPushButton("历史记录")
+        self.chk_profile = QCheckBox("性能分析")
+        self.chk_profile.setChecked(profiler.is_enabled())
+        self.chk_profile.setToolTip(f"对模型调用与命令执行做 cProfile/tracemalloc 采样，结果写入 {profiler.PROFILE_DIR}")
+        tool_row.addWidget(self.btn_new_tab)
+        tool_row.addWidget(self.btn_history)
+        tool_row.addWidget(self.chk_profile)
+        tool_row.addStretch()
+
+        self.tabs = QTabWidget()
+        self.tabs.setTabsClosable(True)
+        self.tabs.setMovable(True)
+
+        main_widget = QWidget()
+        main_layout = QVBoxLayout()
+        main_widget.setLayout(main_layout)
+        main_layout.addLayout(tool_row)
+        main_layout.addWidget(self.tabs)
+        self.setCentralWidget(main_widget)
+
+        self.btn_new_tab.clicked.connect(self.new_session)
+        self.btn_history.clicked.connect(self.open_history_dialog)
+        self.chk_profile.toggled.connect(profiler.set_enabled)
+        self.tabs.tabCloseRequested.connect(self.close_session)
+
+        # 状态栏：实时延迟读数
+        self.lbl_latency = QLabel(metrics.latency_summary())
+        self.statusBar().addPermanentWidget(self.lbl_latency)
+        self.latency_timer = QTimer(self)
+        self.latency_timer.timeout.connect(lambda: self.lbl_latency.setText(metrics.latency_summary()))
+        self.latency_timer.start(1000)
+
+        self.new_session()
+
+    def new_session(self) -> SessionTab:
+        self._tab_seq += 1
+        tab = SessionTab(f"会话 {self._tab_seq}")
+        index = self.tabs.addTab(tab, tab.title)
+        tab.title_changed.connect(lambda text, t=tab: self.tabs.setTabText(self.tabs.indexOf(t), text))
+        self.tabs.setCurrentIndex(index)
+        return tab
+
+    def close_session(self, index: int):
+        tab = self.tabs.widget(index)
+        if tab is None:
+            return
+        if tab.is_busy():
+            QMessageBox.information(self, "会话忙碌", "该会话仍有模型调用或命令在执行，请稍后再关闭。")
+            return
+        tab.shutdown()
+        self.tabs.removeTab(index)
+        tab.deleteLater()
+        if self.tabs.count() == 0:
+            self.new_session()
+
+    def open_history_dialog(self):
+        store = _history_store()
+        if store is None:
+            QMessageBox.warning(self, "历史记录", "历史记录模块不可用。")
+            return
+        HistoryDialog(store, self).exec_()
+
+
 def main():
+    # 若设置了 METRICS_PORT / METRICS_FILE，则导出 Prometheus 指标
+    metrics.start_exporter()
     app = QApplication(sys.argv)
     win = MainWindow()
     win.show()
+    startup = time.perf_counter() - _T_START
+    metrics.observe("startup_seconds", startup)
+    print(f"⏱️ 窗口已显示，启动耗时 {startup * 1000:.0f} ms")
+    if os.getenv("YANDAO_EXIT_AFTER_SHOW"):
+        # 启动基准测试使用：窗口显示后立即退出
+        QTimer.singleShot(0, app.quit)
+    else:
+        QTimer.singleShot(0, lambda: threading.Thread(target=_preload_providers, daemon=True).start())
     sys.exit(app.exec_())
 
 
@@ -0,0 +1,410 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+sandbox_exec.py
+资源受限的本地命令执行：防止一条失控的命令（find / 、死循环脚本、内存泄漏）拖垮同时运行界面的工作站。
+
+功能说明：
+- 每条命令在新的进程组中执行，由命令行包装设置 rlimit（有 prlimit 时用 prlimit，否则用 shell 的 ulimit）：
+  CPU 时间（RLIMIT_CPU，先 SIGXCPU 后 SIGKILL）、地址空间（RLIMIT_AS）、打开文件数（RLIMIT_NOFILE），
+  并用 nice 按 SANDBOX_NICE 降低调度优先级；有 ionice 时按 SANDBOX_IONICE 设置 IO 优先级；
+  不使用 preexec_fn：界面进程是多线程的，fork 之后、exec 之前执行 Python 代码可能死锁；
+- 可用 cgroup v2 且能启用 memory / pids 控制器时，每条命令一个子 cgroup（包装 shell 先把自己写入 cgroup.procs）：
+  memory.max 限制整棵进程树的内存（此时不再设 RLIMIT_AS），pids.max 限制进程数，结束后读取峰值并删除该 cgroup；
+  没有 cgroup 时进程数退回 RLIMIT_NPROC（按用户计数，故在当前进程数基础上放宽；无 prlimit 时需要 bash 的 ulimit -u）；
+- 输出超过 SANDBOX_OUTPUT_BYTES 时终止整个进程组（或 cgroup）；
+- 结束后返回资源占用：CPU 时间、峰值内存、峰值进程数、输出字节数，以及触发的限制。
+仅支持 POSIX；默认关闭，环境变量 SANDBOX_EXEC=1 开启（界面上也可按会话勾选）。
+"""
+
+import itertools
+import os
+import re
+import shutil
+import signal
+import subprocess
+import sys
+import threading
+from typing import NamedTuple, Optional
+
+try:
+    import resource
+except ImportError:   # Windows
+    resource = None
+
+from utils import metrics
+
+SANDBOX_EXEC = os.getenv("SANDBOX_EXEC", "0").lower() in ("1", "true", "yes", "on")
+CPU_SECONDS = int(os.getenv("SANDBOX_CPU_SECONDS", "60"))
+MEMORY_MB = int(os.getenv("SANDBOX_MEMORY_MB", "2048"))
+MAX_FILES = int(os.getenv("SANDBOX_MAX_FILES", "1024"))
+MAX_PROCS = int(os.getenv("SANDBOX_MAX_PROCS", "256"))
+OUTPUT_BYTES = int(os.getenv("SANDBOX_OUTPUT_BYTES", str(8 * 1024 * 1024)))
+NICE = int(os.getenv("SANDBOX_NICE", "10"))
+IONICE = os.getenv("SANDBOX_IONICE", "2:7")            # 类别:级别（2 为 best-effort，3 为 idle），留空不设置
+CGROUP = os.getenv("SANDBOX_CGROUP", "1").lower() not in ("0", "false", "no", "off")
+CGROUP_ROOT = os.getenv("SANDBOX_CGROUP_ROOT", "")   # 留空时在本进程所在 cgroup 及其上一级中查找可用位置
+
+_CGROUP_PREFIX = "yandao-exec-"
+# 没有 cgroup 时，RLIMIT_AS 触发的分配失败表现为普通的非零退出，只能从输出判断
+_OOM_OUTPUT = re.compile(r"MemoryError|Cannot allocate memory|std::bad_alloc|out of memory|"
+                         r"memory exhausted|无法分配内存", re.I)
+_READ_CHUNK = 64 * 1024
+_counter = itertools.count(1)
+_cgroup_root = None   # None：尚未探测；""：不可用
+
+
+class Limits(NamedTuple):
+    cpu_seconds: int = CPU_SECONDS   # 0 表示不限制（下同）
+    memory_mb: int = MEMORY_MB
+    max_files: int = MAX_FILES
+    max_procs: int = MAX_PROCS
+    output_bytes: int = OUTPUT_BYTES
+    nice: int = NICE
+    ionice: str = IONICE
+
+
+class Usage(NamedTuple):
+    cpu_seconds: float
+    peak_memory_mb: float            # cgroup 时为整棵进程树的峰值，否则为单个进程的最大 RSS
+    peak_procs: Optional[int]        # 仅 cgroup 可用
+    output_bytes: int
+    limit_hit: Optional[str]         # "cpu" / "memory" / "procs" / "output" / "timeout" / None
+    cgroup: bool
+
+
+def supported() -> bool:
+    return os.name == "posix" and resource is not None
+
+
+def enabled() -> bool:
+    return SANDBOX_EXEC and supported()
+
+
+# ---------- cgroup v2 ----------
+def _cgroup2_mount() -> Optional[str]:
+    try:
+        with open("/proc/self/mountinfo", "r", encoding="utf-8") as f:
+            for line in f:
+                fields = line.split()
+                sep = fields.index("-")
+                if fields[sep + 1] == "cgroup2":
+                    return fields[4]
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+
+def _own_cgroup(mount: str) -> Optional[str]:
+    try:
+        with open("/proc/self/cgroup", "r", encoding="utf-8") as f:
+            for line in f:
+                if line.startswith("0::"):
+                    return os.path.join(mount, line[3:].strip().lstrip("/"))
+    except OSError:
+        pass
+    return None
+
+
+def _read(path: str) -> str:
+    with open(path, "r", encoding="utf-8") as f:
+        return f.read()
+
+
+def _write(path: str, value: str):
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(value)
+
+
+def _delegates(root: str) -> bool:
+    """root 下新建的子 cgroup 能否使用 memory / pids 控制器（必要时尝试开启）"""
+    try:
+        enabled_ = _read(os.path.join(root, "cgroup.subtree_control")).split()
+        if "memory" in enabled_ and "pids" in enabled_:
+            return os.access(root, os.W_OK)
+        # 有进程的非根 cgroup 不能开启子树控制器（EBUSY），由调用方换一个位置
+        _write(os.path.join(root, "cgroup.subtree_control"), "+memory +pids")
+        return True
+    except OSError:
+        return False
+
+
+def cgroup_root() -> str:
+    """可用于创建每条命令子 cgroup 的目录；不可用时返回空串（结果会缓存）"""
+    global _cgroup_root
+    if _cgroup_root is None:
+        _cgroup_root = ""
+        mount = _cgroup2_mount() if CGROUP and supported() else None
+        if mount:
+            own = _own_cgroup(mount)
+            candidates = [CGROUP_ROOT] if CGROUP_ROOT else [own, os.path.dirname(own) if own else None]
+            for root in candidates:
+                if root and os.path.realpath(root).startswith(os.path.realpath(mount)) and _delegates(root):
+                    _cgroup_root = root
+                    break
+    return _cgroup_root
+
+
+def _cleanup_stale(root: str):
+    # 之前命令留下的后台进程退出后，其 cgroup 已空，顺手删掉（非空目录 rmdir 会失败，不影响）
+    try:
+        for name in os.listdir(root):
+            if name.startswith(_CGROUP_PREFIX):
+                try:
+                    os.rmdir(os.path.join(root, name))
+                except OSError:
+                    pass
+    except OSError:
+        pass
+
+
+def _create_cgroup(limits: Limits) -> Optional[str]:
+    root = cgroup_root()
+    if not root:
+        return None
+    _cleanup_stale(root)
+    path = os.path.join(root, f"{_CGROUP_PREFIX}{os.getpid()}-{next(_counter)}")
+    try:
+        os.mkdir(path)
+        if limits.memory_mb:
+            _write(os.path.join(path, "memory.max"), str(limits.memory_mb * 1024 * 1024))
+            try:
+                _write(os.path.join(path, "memory.swap.max"), "0")   # 不允许换出到 swap 绕过内存上限
+            except OSError:
+                pass
+        if limits.max_procs:
+            _write(os.path.join(path, "pids.max"), str(limits.max_procs))
+        return path
+    except OSError as e:
+        print(f"⚠️ 创建 cgroup 失败，仅使用 rlimit：{e}")
+        try:
+            os.rmdir(path)
+        except OSError:
+            pass
+        return None
+
+
+def _cgroup_stat(path: str, name: str, key: str) -> Optional[int]:
+    try:
+        for line in _read(os.path.join(path, name)).splitlines():
+            k, _, v = line.partition(" ")
+            if k == key:
+                return int(v)
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+def _cgroup_value(path: str, name: str) -> Optional[int]:
+    try:
+        return int(_read(os.path.join(path, name)).strip())
+    except (OSError, ValueError):
+        return None
+
+
+# ---------- rlimit ----------
+def _user_process_count() -> int:
+    """当前用户的进程数（RLIMIT_NPROC 按用户计数，需在此基础上放宽）"""
+    uid, count = os.getuid(), 0
+    try:
+        for pid in os.listdir("/proc"):
+            if pid.isdigit():
+                try:
+                    if os.stat(f"/proc/{pid}").st_uid == uid:
+                        count += 1
+                except OSError:
+                    pass
+    except OSError:
+        return 0
+    return count
+
+
+def _clamp(value: int, hard: int) -> int:
+    return value if hard == resource.RLIM_INFINITY else min(value, hard)
+
+
+def _rlimits(limits: Limits, use_cgroup: bool):
+    """算好要设置的 rlimit：[(名称, 软限制, 硬限制)]，名称同 prlimit 的选项"""
+    wanted = []
+    if limits.cpu_seconds:
+        wanted.append(("cpu", resource.RLIMIT_CPU, limits.cpu_seconds, limits.cpu_seconds + 5))
+    if limits.memory_mb and not use_cgroup:   # cgroup 的 memory.max 按实际占用计，RLIMIT_AS 会误伤预留大地址空间的程序
+        wanted.append(("as", resource.RLIMIT_AS, limits.memory_mb * 1024 * 1024, limits.memory_mb * 1024 * 1024))
+    if limits.max_files:
+        wanted.append(("nofile", resource.RLIMIT_NOFILE, limits.max_files, limits.max_files))
+    if limits.max_procs and not use_cgroup and hasattr(resource, "RLIMIT_NPROC"):
+        n = limits.max_procs + _user_process_count()
+        wanted.append(("nproc", resource.RLIMIT_NPROC, n, n))
+    result = []
+    for name, res, soft, hard in wanted:
+        _, cur_hard = resource.getrlimit(res)
+        hard = _clamp(hard, cur_hard)
+        result.append((name, min(soft, hard), hard))
+    return result
+
+
+# ulimit 选项与单位（as 为 KB）；nproc 只有 bash 支持 -u
+_ULIMIT = {"cpu": ("-t", 1), "as": ("-v", 1024), "nofile": ("-n", 1), "nproc": ("-u", 1)}
+# 包装脚本：$1 为 cgroup.procs 路径（可为空），$2 为要执行的命令
+_WRAPPER = '[ -z "$1" ] || echo 0 > "$1" || exit 125\n{limits}exec /bin/sh -c "$2"'
+
+
+def _argv(command: str, limits: Limits, rlimits, cgroup_procs: Optional[str]):
+    """
+    组装命令行：[ionice] [nice] [prlimit] shell -c 包装脚本。
+    包装 shell 先进入 cgroup（echo 为内建命令，写入的是 shell 自己），之后派生的进程都在其中。
+    """
+    prlimit = shutil.which("prlimit") if rlimits else None
+    shell = "/bin/sh"
+    ulimits = ""
+    if rlimits and not prlimit:
+        bash = shutil.which("bash")
+        shell = bash or shell
+        lines = []
+        for name, soft, hard in rlimits:
+            if name == "nproc" and not bash:
+                continue
+            flag, unit = _ULIMIT[name]
+            lines.append(f"ulimit -S {flag} {soft // unit} && ulimit -H {flag} {hard // unit}")
+        ulimits = "".join(f"{ln} || {{ echo '❌ 设置资源限制失败' >&2; exit 125; }}\n" for ln in lines)
+    argv = [shell, "-c", _WRAPPER.format(limits=ulimits), "yandao-sandbox", cgroup_procs or "", command]
+    if prlimit:
+        argv = [prlimit] + [f"--{name}={soft}:{hard}" for name, soft, hard in rlimits] + ["--"] + argv
+    nice = shutil.which("nice") if limits.nice else None
+    if nice:
+        argv = [nice, "-n", str(limits.nice)] + argv
+    ionice = shutil.which("ionice") if limits.ionice else None
+    if ionice:
+        cls, _, level = limits.ionice.partition(":")
+        argv = [ionice, "-c", cls] + (["-n", level] if level and cls != "3" else []) + argv
+    return argv
+
+
+# ---------- 执行 ----------
+def run(command: str, limits: Limits = None, cwd: str = None, on_line=None, timeout: float = None):
+    """
+    在资源限制下执行命令，返回 (returncode, 完整输出, Usage)。
+    on_line(行) 在每读到一行输出时回调（stdout 与 stderr 合并）；timeout 为墙钟时间上限（秒）。
+    """
+    if not supported():
+        raise RuntimeError("当前系统不支持资源受限执行")
+    limits = limits or Limits()
+    cgroup = _create_cgroup(limits) if CGROUP else None
+    rlimits = _rlimits(limits, cgroup is not None)
+    try:
+        proc = subprocess.Popen(
+            _argv(command, limits, rlimits, os.path.join(cgroup, "cgroup.procs") if cgroup else None),
+            cwd=cwd,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            stdin=subprocess.DEVNULL,
+            start_new_session=True,   # 独立进程组，超限时整组终止
+        )
+    except Exception:
+        if cgroup:
+            os.rmdir(cgroup)
+        raise
+    metrics.inc("sandbox_exec_total", cgroup="yes" if cgroup else "no")
+
+    output, total, limit_hit = [], 0, None
+    timed_out = threading.Event()
+    timer = None
+    if timeout:
+        timer = threading.Timer(timeout, lambda: (timed_out.set(), _kill(proc, cgroup)))
+        timer.daemon = True
+        timer.start()
+    try:
+        while True:
+            budget = limits.output_bytes - total if limits.output_bytes else _READ_CHUNK
+            line = proc.stdout.readline(max(1, min(budget, _READ_CHUNK)) + 1)
+            if not line:
+                break
+            total += len(line)
+            text = line.decode("utf-8", errors="replace")
+            output.append(text)
+            if on_line is not None:
+                on_line(text.rstrip("\n"))
+            if limits.output_bytes and total > limits.output_bytes:
+                limit_hit = "output"
+                _kill(proc, cgroup)
+                break
+    finally:
+        if timer is not None:
+            timer.cancel()
+        proc.stdout.close()
+        _, status, ru = os.wait4(proc.pid, 0)
+        proc.returncode = os.waitstatus_to_exitcode(status)
+
+    if limit_hit is None and timed_out.is_set():
+        limit_hit = "timeout"
+    cpu = ru.ru_utime + ru.ru_stime
+    # Linux 上 ru_maxrss 单位为 KB，macOS 为字节
+    peak_mb = ru.ru_maxrss / (1024 * 1024 if sys.platform == "darwin" else 1024)
+    peak_procs = None
+    if cgroup:
+        cg_cpu = _cgroup_stat(cgroup, "cpu.stat", "usage_usec")
+        cpu = max(cpu, cg_cpu / 1e6) if cg_cpu is not None else cpu
+        cg_peak = _cgroup_value(cgroup, "memory.peak")
+        peak_mb = max(peak_mb, cg_peak / (1024 * 1024)) if cg_peak is not None else peak_mb
+        peak_procs = _cgroup_value(cgroup, "pids.peak")
+        if limit_hit is None:
+            if (_cgroup_stat(cgroup, "memory.events", "oom_kill") or 0) > 0:
+                limit_hit = "memory"
+            elif (_cgroup_stat(cgroup, "pids.events", "max") or 0) > 0:
+                limit_hit = "procs"
+        try:
+            os.rmdir(cgroup)
+        except OSError:
+            pass   # 仍有后台进程，留给下次 _cleanup_stale
+    # 经 sh -c 执行时被信号终止的子进程表现为 128+sig，后面还有命令时退出码甚至为 0，故只看 CPU 用量
+    if limit_hit is None and limits.cpu_seconds and cpu >= limits.cpu_seconds * 0.95:
+        limit_hit = "cpu"
+    if limit_hit is None and limits.memory_mb and not cgroup and proc.returncode != 0:
+        if peak_mb >= limits.memory_mb * 0.9 or _OOM_OUTPUT.search("".join(output)[-_READ_CHUNK:]):
+            limit_hit = "memory"
+
+    if limit_hit:
+        metrics.inc("sandbox_limit_hits_total", limit=limit_hit)
+    usage = Usage(round(cpu, 3), round(peak_mb, 1), peak_procs, total, limit_hit, cgroup is not None)
+    return proc.returncode, "".join(output), usage
+
+
+def _kill(proc, cgroup: Optional[str]):
+    if cgroup:
+        try:
+            _write(os.path.join(cgroup, "cgroup.kill"), "1")   # 连同已脱离进程组的后台进程一起结束
+            return
+        except OSError:
+            pass
+    try:
+        os.killpg(proc.pid, signal.SIGKILL)
+    except OSError:
+        pass
+
+
+_LIMIT_TEXT = {
+    "cpu": "CPU 时间超限",
+    "memory": "内存超限",
+    "procs": "进程数超限",
+    "output": "输出超限",
+    "timeout": "执行超时",
+}
+
+
+def format_usage(usage: Usage, limits: Limits = None, timeout: float = None) -> str:
+    limits = limits or Limits()
+    parts = [f"CPU {usage.cpu_seconds:.2f}s", f"峰值内存 {usage.peak_memory_mb:.1f} MB"]
+    if usage.peak_procs is not None:
+        parts.append(f"峰值进程 {usage.peak_procs} 个")
+    parts.append(f"输出 {usage.output_bytes / 1024:.1f} KB")
+    text = "📊 资源占用：" + "，".join(parts)
+    if usage.limit_hit:
+        detail = {
+            "cpu": f"{limits.cpu_seconds}s",
+            "memory": f"{limits.memory_mb} MB",
+            "procs": f"{limits.max_procs} 个",
+            "output": f"{limits.output_bytes / 1024:.0f} KB",
+            "timeout": f"{timeout or 0:g}s",
+        }[usage.limit_hit]
+        text += f"\n⚠️ {_LIMIT_TEXT[usage.limit_hit]}（上限 {detail}），命令已被终止。"
+    return text
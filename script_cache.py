@@ -0,0 +1,363 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+script_cache.py
+远端脚本的内容寻址缓存：同一台主机上内容相同的脚本只上传一次。
+
+流程：
+1. 脚本按内容 sha256 命名，存放在远端用户私有的缓存目录（~/.cache/yandao_os/scripts，
+   Windows 为 %USERPROFILE%\\AppData\\Local\\yandao_os\\scripts），文件名为 <sha256 前 16 位><原扩展名>；
+   目录按 0700 创建，使用前检查属主与权限（POSIX），不是当前用户私有时停用缓存（抛 CacheUnavailable）；
+2. 本地按主机（user@host:port）维护清单（~/.yandao_os/script_cache.json），只记录上传过的脚本
+   与上次清理时间，用于安排清理，不用于判断命中：每次命中都在远端计算完整 sha256 确认
+   （POSIX 一次 exec，同时刷新使用时间），文件缺失或内容不符时重新上传覆盖；
+3. 需要上传时先写临时文件再改名，缓存目录中不会出现写了一半的脚本；
+   执行缓存中的脚本时用 guard_command 在远端再校验一次哈希，不符则拒绝执行；
+4. 每台主机每隔 SCRIPT_CACHE_PRUNE_INTERVAL 秒清理一次：按最近使用时间保留，
+   总大小超过 SCRIPT_CACHE_MAX_BYTES 或超过 SCRIPT_CACHE_MAX_AGE 未使用的脚本被删除。
+环境变量：SCRIPT_CACHE（0 关闭）、SCRIPT_CACHE_MANIFEST、SCRIPT_CACHE_MAX_BYTES、
+SCRIPT_CACHE_MAX_AGE、SCRIPT_CACHE_PRUNE_INTERVAL。
+"""
+
+import hashlib
+import json
+import ntpath
+import os
+import posixpath
+import re
+import shlex
+import stat
+import threading
+import time
+
+import ssh_executor
+from utils import metrics
+
+SCRIPT_CACHE = os.getenv("SCRIPT_CACHE", "1").lower() not in ("0", "false", "no", "off")
+MANIFEST_PATH = os.getenv("SCRIPT_CACHE_MANIFEST",
+                          os.path.join(os.path.expanduser("~"), ".yandao_os", "script_cache.json"))
+MAX_BYTES = int(os.getenv("SCRIPT_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+MAX_AGE = float(os.getenv("SCRIPT_CACHE_MAX_AGE", str(7 * 24 * 3600)))
+PRUNE_INTERVAL = float(os.getenv("SCRIPT_CACHE_PRUNE_INTERVAL", "3600"))
+
+_POSIX_SUBDIRS = (".cache", ".cache/yandao_os", ".cache/yandao_os/scripts")
+_WINDOWS_SUBDIR = r"AppData\Local\yandao_os\scripts"
+_PART = ".part-"
+_STALE_PART_SECONDS = 3600
+
+_lock = threading.Lock()
+_manifest = None
+
+
+class CacheUnavailable(RuntimeError):
+    """远端缓存目录不是当前用户私有（或无法创建），调用方应改为普通上传"""
+
+
+def enabled() -> bool:
+    return SCRIPT_CACHE
+
+
+def _is_windows(remote_os: str) -> bool:
+    return "win" in (remote_os or "").lower()
+
+
+def _join(remote_os: str, *parts) -> str:
+    return (ntpath if _is_windows(remote_os) else posixpath).join(*parts)
+
+
+def _private_posix_dir(sftp) -> str:
+    """在远端家目录下逐层以 0700 创建缓存目录，并确认其属于当前用户、组和其他人无权限"""
+    home = sftp.normalize(".")
+    for sub in _POSIX_SUBDIRS:
+        try:
+            sftp.mkdir(posixpath.join(home, sub), mode=0o700)
+        except IOError:
+            pass   # 已存在；下面统一检查
+    uid = sftp.stat(home).st_uid
+    for sub in _POSIX_SUBDIRS[1:]:
+        path = posixpath.join(home, sub)
+        attr = sftp.lstat(path)   # lstat：符号链接不算目录，防止被指向别处
+        if not stat.S_ISDIR(attr.st_mode):
+            raise CacheUnavailable(f"{path} 不是目录")
+        if attr.st_uid != uid:
+            raise CacheUnavailable(f"{path} 的属主不是当前用户（uid {attr.st_uid} != {uid}）")
+        if attr.st_mode & 0o077:
+            raise CacheUnavailable(f"{path} 权限为 {stat.S_IMODE(attr.st_mode):o}，应为 700（chmod 700 后重试）")
+    return posixpath.join(home, _POSIX_SUBDIRS[-1])
+
+
+def _private_windows_dir(client, sftp) -> str:
+    # Windows 的 SFTP 不反映 ACL，只能依赖用户配置文件目录默认仅本人可访问
+    home = sftp.normalize(".")
+    if re.match(r"^/[A-Za-z]:", home):
+        home = home[1:]
+    directory = ntpath.join(home.replace("/", "\\"), _WINDOWS_SUBDIR)
+    ssh_executor.sftp_mkdirs(directory, client)
+    return directory
+
+
+def cache_dir(client, remote_os: str) -> str:
+    """
+    该连接上的远端缓存目录（首次调用时创建并检查，结果缓存在 client 上，同 _sftp 的做法）。
+    目录不安全时抛 CacheUnavailable，同一连接之后的调用直接抛出，不再重复检查。
+    """
+    cached = getattr(client, "_script_cache_dir", None)
+    if cached is not None:
+        if isinstance(cached, CacheUnavailable):
+            raise cached
+        return cached
+    sftp = ssh_executor.get_sftp(client)
+    try:
+        directory = _private_windows_dir(client, sftp) if _is_windows(remote_os) else _private_posix_dir(sftp)
+    except (IOError, CacheUnavailable) as e:
+        err = e if isinstance(e, CacheUnavailable) else CacheUnavailable(f"无法创建远端缓存目录：{e}")
+        print(f"⚠️ 远端脚本缓存已停用：{err}")
+        metrics.inc("script_cache_total", result="refused")
+        client._script_cache_dir = err
+        raise err
+    client._script_cache_dir = directory
+    return directory
+
+
+def in_cache(client, path: str, remote_os: str) -> bool:
+    """path 是否位于该连接的远端缓存目录中（缓存不可用时为 False）"""
+    cached = getattr(client, "_script_cache_dir", None)
+    if not isinstance(cached, str):
+        return False
+    return (ntpath if _is_windows(remote_os) else posixpath).dirname(path) == cached
+
+
+_GUARD = ('if command -v sha256sum >/dev/null 2>&1; then h=$(sha256sum "$1"); else h=$(shasum -a 256 "$1"); fi; '
+          'if [ "${h%% *}" = "$(printf %s "$2" | tr -d :)" ]; then eval "$3"; '
+          'else echo "❌ 缓存脚本校验失败（内容与生成的脚本不一致），已拒绝执行" >&2; exit 1; fi')
+
+
+def guard_command(remote_path: str, content: str, command: str, remote_os: str = "linux") -> str:
+    """
+    执行前在远端校验缓存脚本的 sha256，不符时不执行并以 1 退出（Windows 原样返回）。
+    校验逻辑整体放在 sh -c 的引号内，可通过 is_safe_command 的串联 / 管道检查；
+    哈希逐字符以 ':' 分隔传入，避免十六进制串碰上黑名单关键字（如 "dd"）。
+    """
+    if _is_windows(remote_os):
+        return command
+    digest = ":".join(hashlib.sha256(content.encode("utf-8")).hexdigest())
+    return f"sh -c {shlex.quote(_GUARD)} yandao-guard {shlex.quote(remote_path)} {digest} {shlex.quote(command)}"
+
+
+def cache_name(filename: str, data: bytes) -> str:
+    """缓存文件名：内容哈希 + 原扩展名（保留 .py / .sh 以便按类型执行）"""
+    ext = os.path.splitext(filename)[1]
+    return hashlib.sha256(data).hexdigest()[:16] + ext
+
+
+def host_key(client) -> str:
+    info = getattr(client, "_connection_info", None)
+    if info:
+        host, port, user = info
+        return f"{user}@{host}:{port}"
+    transport = client.get_transport()
+    host, port = transport.getpeername()[:2]
+    return f"{transport.get_username()}@{host}:{port}"
+
+
+# ---------- 本地清单 ----------
+def _load():
+    global _manifest
+    if _manifest is None:
+        try:
+            with open(MANIFEST_PATH, "r", encoding="utf-8") as f:
+                _manifest = json.load(f)
+        except (OSError, ValueError):
+            _manifest = {}
+        _manifest.setdefault("hosts", {})
+    return _manifest
+
+
+def _save():
+    # 先写临时文件再替换，进程中途退出也不会留下损坏的清单
+    os.makedirs(os.path.dirname(os.path.abspath(MANIFEST_PATH)), exist_ok=True)
+    tmp = f"{MANIFEST_PATH}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(_manifest, f, ensure_ascii=False, separators=(",", ":"))
+    os.replace(tmp, MANIFEST_PATH)
+
+
+def _host_entry(key: str) -> dict:
+    host = _load()["hosts"].setdefault(key, {})
+    host.setdefault("scripts", {})
+    host.setdefault("pruned", 0)
+    return host
+
+
+def _remember(key: str, name: str, size: int):
+    with _lock:
+        _host_entry(key)["scripts"][name] = {"size": size, "used": round(time.time(), 3)}
+        _save()
+
+
+def _forget(key: str, names):
+    with _lock:
+        scripts = _host_entry(key)["scripts"]
+        for name in names:
+            scripts.pop(name, None)
+        _save()
+
+
+# ---------- 对外接口 ----------
+def _remote_sha256(client, remote_path: str, remote_os: str) -> str:
+    """远端计算文件 sha256（POSIX 同时 touch 刷新使用时间）；文件不存在或计算失败返回空串"""
+    if _is_windows(remote_os):
+        path = remote_path.replace("'", "''")
+        cmd = f"powershell -NoProfile -Command \"(Get-FileHash -Algorithm SHA256 -LiteralPath '{path}').Hash\""
+    else:
+        q = shlex.quote(remote_path)
+        cmd = f"touch -c {q} 2>/dev/null; (sha256sum {q} 2>/dev/null || shasum -a 256 {q}) 2>/dev/null"
+    _, stdout, _ = client.exec_command(cmd, timeout=15)
+    out = stdout.read().decode("utf-8", "replace")
+    m = re.search(r"\b[0-9a-fA-F]{64}\b", out)
+    return m.group(0).lower() if m else ""
+
+
+def _lookup(client, sftp, remote_path: str, data: bytes, remote_os: str) -> bool:
+    """远端缓存中是否已有内容完全相同的脚本（以远端计算的完整 sha256 为准，命中时刷新使用时间）"""
+    if _is_windows(remote_os):
+        try:
+            if sftp.stat(remote_path).st_size != len(data):
+                return False
+        except IOError:
+            return False
+    hit = _remote_sha256(client, remote_path, remote_os) == hashlib.sha256(data).hexdigest()
+    if hit and _is_windows(remote_os):
+        try:
+            sftp.utime(remote_path, None)
+        except IOError:
+            pass
+    return hit
+
+
+def _publish(sftp, tmp_path: str, remote_path: str):
+    try:
+        sftp.posix_rename(tmp_path, remote_path)
+    except IOError:
+        # 服务端不支持 posix-rename（如部分 Windows SFTP）：目标已存在说明内容相同，删掉临时文件即可
+        try:
+            sftp.rename(tmp_path, remote_path)
+        except IOError:
+            sftp.remove(tmp_path)
+
+
+def _tmp_path(remote_path: str) -> str:
+    return f"{remote_path}{_PART}{os.getpid()}-{threading.get_ident()}"
+
+
+def ensure_script(client, filename: str, content: str, remote_os: str = "linux", progress=None):
+    """
+    确保远端缓存目录中存在该脚本，返回 (远端路径, 是否实际上传)。
+    progress(done_bytes, total_bytes) 仅在需要上传时回调；缓存目录不安全时抛 CacheUnavailable。
+    """
+    data = content.encode("utf-8")
+    name = cache_name(filename, data)
+    remote_path = _join(remote_os, cache_dir(client, remote_os), name)
+    sftp = ssh_executor.get_sftp(client)
+
+    hit = _lookup(client, sftp, remote_path, data, remote_os)
+    if hit:
+        metrics.inc("script_cache_total", result="hit")
+        metrics.inc("script_cache_bytes_saved", len(data))
+    else:
+        metrics.inc("script_cache_total", result="miss")
+        tmp_path = _tmp_path(remote_path)
+        ssh_executor.sftp_write_text(client, tmp_path, content, progress=progress)
+        _publish(sftp, tmp_path, remote_path)
+
+    _remember(host_key(client), name, len(data))
+    maybe_prune(client, remote_os)
+    return remote_path, not hit
+
+
+def ensure_patched(client, filename: str, base_path: str, base_content: str, content: str,
+                   remote_os: str = "linux"):
+    """
+    修改后的脚本写入远端缓存：远端已有 base_path（内容为 base_content）时只发送差量，
+    由远端从旧脚本合成新脚本并校验。返回 (远端路径, 方式 "cached" / "delta" / "full", 发送字节数)。
+    """
+    if _is_windows(remote_os):
+        path, uploaded = ensure_script(client, filename, content, remote_os)
+        return path, "full" if uploaded else "cached", len(content.encode("utf-8")) if uploaded else 0
+
+    import ssh_sync
+    data = content.encode("utf-8")
+    name = cache_name(filename, data)
+    remote_path = _join(remote_os, cache_dir(client, remote_os), name)
+    sftp = ssh_executor.get_sftp(client)
+    if _lookup(client, sftp, remote_path, data, remote_os):
+        metrics.inc("script_cache_total", result="hit")
+        mode, sent = "cached", 0
+    else:
+        metrics.inc("script_cache_total", result="patch")
+        tmp_path = _tmp_path(remote_path)
+        mode, sent = ssh_sync.patch_remote_file(client, base_path, base_content.encode("utf-8"), data,
+                                                dest_path=tmp_path)
+        _publish(sftp, tmp_path, remote_path)
+    _remember(host_key(client), name, len(data))
+    return remote_path, mode, sent
+
+
+def maybe_prune(client, remote_os: str = "linux", force: bool = False):
+    """距上次清理超过 PRUNE_INTERVAL 时清理该主机的远端缓存，返回删除的文件数"""
+    key = host_key(client)
+    now = time.time()
+    with _lock:
+        host = _host_entry(key)
+        if not force and now - host["pruned"] < PRUNE_INTERVAL:
+            return 0
+        host["pruned"] = round(now, 3)
+        _save()
+    try:
+        return prune(client, remote_os)
+    except IOError as e:
+        print(f"⚠️ 远端脚本缓存清理失败：{e}")
+        return 0
+
+
+def prune(client, remote_os: str = "linux", max_bytes: int = None, max_age: float = None) -> int:
+    """按最近使用时间（mtime）保留远端缓存，删除超出大小上限或过期的脚本，返回删除的文件数"""
+    max_bytes = MAX_BYTES if max_bytes is None else max_bytes
+    max_age = MAX_AGE if max_age is None else max_age
+    try:
+        directory = cache_dir(client, remote_os)
+    except CacheUnavailable:
+        return 0
+    sftp = ssh_executor.get_sftp(client)
+    try:
+        entries = sftp.listdir_attr(directory)
+    except IOError:
+        return 0
+
+    now = time.time()
+    doomed, total, kept = [], 0, 0
+    for attr in sorted(entries, key=lambda a: a.st_mtime or 0, reverse=True):
+        age = now - (attr.st_mtime or 0)
+        if _PART in attr.filename:
+            if age > _STALE_PART_SECONDS:
+                doomed.append(attr.filename)   # 中断上传留下的临时文件
+            continue
+        total += attr.st_size or 0
+        # 至少保留最近使用的一个
+        if kept and (total > max_bytes or age > max_age):
+            doomed.append(attr.filename)
+        else:
+            kept += 1
+
+    removed = []
+    for name in doomed:
+        try:
+            sftp.remove(_join(remote_os, directory, name))
+            removed.append(name)
+        except IOError:
+            pass
+    if removed:
+        _forget(host_key(client), removed)
+        metrics.inc("script_cache_pruned_total", len(removed))
+        print(f"🧹 远端脚本缓存清理：删除 {len(removed)} 个，保留 {kept} 个")
+    return len(removed)
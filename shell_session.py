@@ -0,0 +1,301 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+shell_session.py
+常驻 shell 会话（本地管道驱动的 bash / 远端 paramiko 会话通道上的 shell）。
+
+功能说明：
+- 每个会话一个长期存活的 shell，cd / export 等状态在命令之间保留，也省去每条命令的进程或通道开销；
+- 每条命令前后各打印一个唯一的哨兵行，据此切分输出并取回退出码与当前目录；
+- shell 意外退出（或命令超时被终止）后，下次执行时自动重启并切回上次所在目录。
+仅支持 POSIX shell；Windows 目标仍走一次性执行。
+"""
+
+import codecs
+import os
+import select
+import shlex
+import signal
+import socket
+import subprocess
+import threading
+import time
+import uuid
+
+from utils import metrics
+
+PERSISTENT_SHELL = os.getenv("PERSISTENT_SHELL", "1").lower() not in ("0", "false", "no", "off")
+
+# 远端登录 shell 可能是 csh / fish，直接以 exec 请求启动 POSIX shell（优先 bash）。
+# 不在 invoke_shell 里再 exec：旧 shell 可能预读并丢弃之后写入的命令。
+_POSIX_BOOTSTRAP = "/bin/sh -c 'if [ -x /bin/bash ]; then exec /bin/bash --norc --noprofile; fi; exec /bin/sh'"
+
+
+class ShellTimeout(Exception):
+    pass
+
+
+def supported() -> bool:
+    """本机是否可用常驻 shell"""
+    return PERSISTENT_SHELL and os.name == "posix"
+
+
+class _SentinelShell:
+    """哨兵分帧的公共逻辑；子类实现 _start / _write / _read / alive / _terminate"""
+
+    kind = "shell"
+
+    def __init__(self):
+        self.cwd = None
+        self._lock = threading.Lock()   # 同一会话内命令串行执行
+        self._started = False
+
+    # ----- 子类接口 -----
+    def _start(self):
+        raise NotImplementedError
+
+    def _write(self, data: bytes):
+        raise NotImplementedError
+
+    def _read(self, timeout: float):
+        """返回读到的字节；超时返回 None；EOF 返回 b\"\" """
+        raise NotImplementedError
+
+    def alive(self) -> bool:
+        raise NotImplementedError
+
+    def _terminate(self):
+        raise NotImplementedError
+
+    # ----- 公共逻辑 -----
+    def _ensure_started(self):
+        if self._started and self.alive():
+            return
+        if self._started:
+            metrics.inc("shell_restarts_total", kind=self.kind)
+        self._terminate()
+        with metrics.timer("shell_start_seconds", kind=self.kind):
+            self._start()
+        self._started = True
+        if self.cwd:
+            # 重启后回到上次的目录（环境变量无法恢复）
+            self._write(f"cd {shlex.quote(self.cwd)} 2>/dev/null\n".encode())
+
+    def run(self, command: str, timeout: float = None, on_line=None):
+        """
+        执行一条命令，返回 (exit_code, output)。
+        on_line(line) 在每读到一整行输出时回调（用于实时显示）。
+        timeout 为空闲超时：连续 timeout 秒没有任何输出时终止整个 shell（下次自动重启）并抛出 ShellTimeout。
+        """
+        with self._lock:
+            self._ensure_started()
+            tag = uuid.uuid4().hex
+            begin, end = f"__YANDAO_BEGIN_{tag}__", f"__YANDAO_END_{tag}__"
+            # eval 在当前 shell 中执行，cd / export 得以保留；语法错误也只影响本条命令
+            script = (f"printf '%s\\n' '{begin}'\n"
+                      f"eval {shlex.quote(command)} </dev/null 2>&1\n"
+                      f"__yandao_rc=$?; printf '\\n%s %d %s\\n' '{end}' \"$__yandao_rc\" \"$PWD\"\n")
+            self._write(script.encode("utf-8"))
+            return self._collect(begin, end, timeout, on_line)
+
+    def _collect(self, begin, end, timeout, on_line):
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="ignore")
+        deadline = None if timeout is None else time.monotonic() + timeout
+        buf, lines, held = "", [], None
+        seen_begin = False
+        while True:
+            wait = 0.5 if deadline is None else deadline - time.monotonic()
+            if wait <= 0:
+                self._terminate()
+                raise ShellTimeout(f"命令执行超时（{timeout}s 内无输出），shell 已重置")
+            chunk = self._read(min(wait, 0.5))
+            if chunk is None:
+                continue
+            if deadline is not None:
+                deadline = time.monotonic() + timeout   # 有输出即视为仍在进行，同 exec_on_channel
+            if chunk == b"":
+                # shell 退出（例如命令本身是 exit）：返回已有输出，下次自动重启
+                if held:
+                    lines.append(held)
+                return self._exit_status(), "\n".join(lines)
+            buf += decoder.decode(chunk).replace("\r\n", "\n")
+            *complete, buf = buf.split("\n")
+            for line in complete:
+                if not seen_begin:
+                    seen_begin = line == begin   # 之前的杂散输出（如 motd）丢弃
+                    continue
+                if line.startswith(end + " "):
+                    _, rc, cwd = (line.split(" ", 2) + [""])[:3]
+                    self.cwd = cwd or self.cwd
+                    # held 是哨兵前补的换行产生的行：为空说明原输出以换行结尾
+                    if held:
+                        lines.append(held)
+                        if on_line:
+                            on_line(held)
+                    return int(rc), "\n".join(lines)
+                if held is not None:
+                    lines.append(held)
+                    if on_line:
+                        on_line(held)
+                held = line
+
+    def _exit_status(self) -> int:
+        return -1
+
+    def _wait_ready(self, attempts: int = 3, timeout: float = 3.0):
+        """
+        等待 shell 就绪：发送一个探测哨兵并等它回显。
+        远端通道建立后 shell 可能尚未开始读输入，超时后重发探测。
+        """
+        for _ in range(attempts):
+            tag = f"__YANDAO_READY_{uuid.uuid4().hex}__"
+            self._write(f"printf '%s\\n' '{tag}'\n".encode())
+            buf, deadline = b"", time.monotonic() + timeout
+            while time.monotonic() < deadline:
+                chunk = self._read(0.2)
+                if chunk == b"":
+                    raise RuntimeError("shell 启动后立即退出")
+                if chunk:
+                    buf += chunk
+                    if tag.encode() + b"\n" in buf:
+                        return
+        raise RuntimeError("shell 未响应")
+
+    def close(self):
+        with self._lock:
+            self._terminate()
+            self._started = False
+
+
+class LocalShell(_SentinelShell):
+    """本地管道驱动的 bash（不分配 pty，输出不含回显与提示符）"""
+
+    kind = "local"
+
+    def __init__(self, cwd: str = None):
+        super().__init__()
+        self.cwd = cwd
+        self.proc = None
+
+    def _start(self):
+        shell = "/bin/bash" if os.path.exists("/bin/bash") else "/bin/sh"
+        argv = [shell, "--norc", "--noprofile"] if shell.endswith("bash") else [shell]
+        if self.cwd and not os.path.isdir(self.cwd):
+            # 上次所在目录已被删除：回到主目录，否则每次重启都会失败
+            self.cwd = os.path.expanduser("~")
+        self.proc = subprocess.Popen(argv, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                     stderr=subprocess.STDOUT, cwd=self.cwd, start_new_session=True)
+
+    def _write(self, data: bytes):
+        self.proc.stdin.write(data)
+        self.proc.stdin.flush()
+
+    def _read(self, timeout: float):
+        fd = self.proc.stdout.fileno()
+        ready, _, _ = select.select([fd], [], [], timeout)
+        if not ready:
+            return None
+        return os.read(fd, 65536)
+
+    def alive(self) -> bool:
+        return self.proc is not None and self.proc.poll() is None
+
+    def _exit_status(self) -> int:
+        return self.proc.wait() if self.proc else -1
+
+    def _terminate(self):
+        if self.proc is None:
+            return
+        if self.proc.poll() is None:
+            try:
+                # 连同后台子进程一起结束
+                os.killpg(self.proc.pid, signal.SIGKILL)
+            except Exception:
+                self.proc.kill()
+        try:
+            self.proc.wait(timeout=2)
+        except Exception:
+            pass
+        for f in (self.proc.stdin, self.proc.stdout):
+            try:
+                f.close()
+            except Exception:
+                pass
+
+
+class RemoteShell(_SentinelShell):
+    """远端会话通道上的常驻 shell（不申请 pty，stderr 合并到 stdout）"""
+
+    kind = "remote"
+
+    def __init__(self, client):
+        super().__init__()
+        self.client = client
+        self.chan = None
+
+    def _start(self):
+        chan = self.client.get_transport().open_session()
+        chan.set_combine_stderr(True)
+        chan.exec_command(_POSIX_BOOTSTRAP)
+        self.chan = chan
+        self._wait_ready()
+
+    def _write(self, data: bytes):
+        self.chan.sendall(data)
+
+    def _read(self, timeout: float):
+        self.chan.settimeout(timeout)
+        try:
+            return self.chan.recv(65536)
+        except socket.timeout:
+            return None
+
+    def alive(self) -> bool:
+        transport = self.client.get_transport()
+        return (self.chan is not None and not self.chan.closed and not self.chan.exit_status_ready()
+                and transport is not None and transport.is_active())
+
+    def _exit_status(self) -> int:
+        return self.chan.recv_exit_status() if self.chan is not None else -1
+
+    def _terminate(self):
+        if self.chan is not None:
+            try:
+                self.chan.close()
+            except Exception:
+                pass
+            self.chan = None
+
+
+# ========= 会话注册表（按 GUI 会话区分） =========
+_shells = {}
+_shells_lock = threading.Lock()
+
+
+def get_local_shell(session_key: str) -> LocalShell:
+    with _shells_lock:
+        sh = _shells.get(("local", session_key))
+        if sh is None:
+            sh = _shells[("local", session_key)] = LocalShell()
+        return sh
+
+
+def get_remote_shell(client, session_key: str) -> RemoteShell:
+    key = ("remote", session_key, id(client))
+    with _shells_lock:
+        sh = _shells.get(key)
+        if sh is None or sh.client is not client:
+            sh = _shells[key] = RemoteShell(client)
+        return sh
+
+
+def close_sessions(session_key: str):
+    """关闭某个会话名下的全部 shell"""
+    with _shells_lock:
+        keys = [k for k in _shells if k[1] == session_key]
+        shells = [_shells.pop(k) for k in keys]
+    for sh in shells:
+        try:
+            sh.close()
+        except Exception:
+            pass
@@ -3,10 +3,17 @@ import paramiko
 import socket
 import os
 import shlex
+import hashlib
 from dotenv import load_dotenv
 import re
+import threading
+import time
 
 from utils.blacklist_loader import load_blacklist
+from utils import metrics
+import shell_session
+from utils import cassette
+from utils import result_cache
 
 load_dotenv()
 
@@ -16,8 +23,10 @@ SSH_PORT = int(os.getenv("SSH_PORT", "22"))
 SSH_USER = os.getenv("SSH_USER", "zhangsan")
 SSH_PASS = os.getenv("SSH_PASS", "")
 
-_ssh_client = None
+_ssh_client = None          # 最近一次建立 / 复用的连接（无参调用时使用）
 _remote_system = "Unknown"
+_ssh_pool = {}              # (host, port, username) -> client
+_pool_lock = threading.Lock()
 
 # 防止多个命令串联执行（简单策略）
 DANGEROUS_INJECTION_PATTERNS = [";", "&&", "||", "`", "$(", ">${", "> /dev", "2>&1"]
@@ -89,36 +98,19 @@ def is_safe_command(command: str, system_type: str = None) -> bool:
 
     return True
 
-def _close_existing_if_diff(host, port, username):
-    """
-    如果已有连接但目标不同，关闭旧连接以便建立新连接。
-    """
-    global _ssh_client
+def _is_active(client) -> bool:
     try:
-        if _ssh_client and _ssh_client.get_transport() and _ssh_client.get_transport().is_active():
-            # 试图从 transport 获取远程地址信息（部分实现可能缺失）
-            # 为简单判断仅比较用户名/host/port存储到 client 的一个属性 (we store attributes on client)
-            existing = getattr(_ssh_client, "_connection_info", None)
-            if existing:
-                old_host, old_port, old_user = existing
-                if (old_host, int(old_port), old_user) != (host, int(port), username):
-                    try:
-                        _ssh_client.close()
-                    except Exception:
-                        pass
-                    _ssh_client = None
-            # 如果没有 existing 信息，则保守不关闭（会重用）
+        return bool(client and client.get_transport() and client.get_transport().is_active())
     except Exception:
-        try:
-            _ssh_client.close()
-        except Exception:
-            pass
-        _ssh_client = None
+        return False
+
 
 def connect_ssh(host: str = None, port: int = None, username: str = None, password: str = None, timeout: int = 10):
     """
     建立或复用 SSH 长连接。
     接受可选参数：host, port, username, password（若不传则使用 .env 中的配置）。
+    连接按 (host, port, username) 放入连接池：相同目标复用同一连接（引用计数 +1），
+    不同目标各自保持连接，多个会话可以同时操作不同服务器。
     返回 (ssh_client, remote_system)
     """
     global _ssh_client, _remote_system, SSH_HOST, SSH_PORT, SSH_USER, SSH_PASS
@@ -128,17 +120,22 @@ def connect_ssh(host: str = None, port: int = None, username: str = None, passwo
     port = int(port or SSH_PORT)
     username = username or SSH_USER
     password = password or SSH_PASS
+    key = (host, port, username)
 
-    # 如果已有连接但目标不同，则关闭它
-    _close_existing_if_diff(host, port, username)
-
-    # 若已有活跃连接，直接复用
-    if _ssh_client and _ssh_client.get_transport() and _ssh_client.get_transport().is_active():
-        return _ssh_client, _remote_system
+    # 若该目标已有活跃连接，直接复用
+    with _pool_lock:
+        existing = _ssh_pool.get(key)
+        if _is_active(existing):
+            existing._refs += 1
+            _ssh_client = existing
+            _remote_system = existing._remote_system
+            return existing, existing._remote_system
+        _ssh_pool.pop(key, None)
 
     client = paramiko.SSHClient()
     client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
 
+    t0 = time.perf_counter()
     try:
         client.connect(
             hostname=host,
@@ -153,15 +150,20 @@ def connect_ssh(host: str = None, port: int = None, username: str = None, passwo
         )
         # 存储一些信息以便复用判断
         client._connection_info = (host, port, username)
+        client._refs = 1
 
         # 检测远程系统
-        _remote_system = detect_remote_system(client)
+        client._remote_system = detect_remote_system(client)
         # 更新全局默认（下一次无参调用使用）
         SSH_HOST, SSH_PORT, SSH_USER, SSH_PASS = host, port, username, password
 
-        _ssh_client = client
+        with _pool_lock:
+            _ssh_pool[key] = client
+            _ssh_client = client
+            _remote_system = client._remote_system
+        metrics.observe("ssh_connect_seconds", time.perf_counter() - t0)
         print(f"🌐 Connected to {host}:{port} ({_remote_system})")
-        return client, _remote_system
+        return client, client._remote_system
 
     except socket.timeout:
         raise RuntimeError("连接超时（可能网络不通、防火墙或 IP 填写错误）。")
@@ -172,15 +174,31 @@ def connect_ssh(host: str = None, port: int = None, username: str = None, passwo
     except Exception as e:
         raise RuntimeError(f"SSH 连接失败：{e}")
 
-def close_ssh():
+def close_ssh(client=None):
+    """
+    关闭连接。
+    - 不传 client：关闭当前全局连接（原有行为）；
+    - 传入 client：引用计数减一，最后一个使用者释放时才真正关闭。
+    """
     global _ssh_client
-    if _ssh_client:
-        try:
-            _ssh_client.close()
-        except Exception:
-            pass
-        _ssh_client = None
-        print("🔌 SSH connection closed.")
+    with _pool_lock:
+        target = client or _ssh_client
+        if target is None:
+            return
+        if client is not None:
+            target._refs = getattr(target, "_refs", 1) - 1
+            if target._refs > 0:
+                return
+        for key, c in list(_ssh_pool.items()):
+            if c is target:
+                _ssh_pool.pop(key, None)
+        if _ssh_client is target:
+            _ssh_client = None
+    try:
+        target.close()
+    except Exception:
+        pass
+    print("🔌 SSH connection closed.")
 
 def detect_remote_system(ssh_client):
     try:
@@ -199,16 +217,28 @@ def detect_remote_system(ssh_client):
     except Exception:
         return "Unknown"
 
-def execute_remote_command(command, system_type: str = None, timeout: int = 15, client=None):
+def execute_remote_command(command, system_type: str = None, timeout: int = 15, client=None,
+                           session_key: str = None, with_status: bool = False,
+                           cache: bool = None, refresh: bool = False):
     """
     在远程主机上执行命令并返回字符串结果。
     如果 client 提供则使用该连接，否则尝试复用全局连接或自动连接（使用 .env / 上次保存的信息）。
+    session_key 不为空且远端为 POSIX 时，在该会话的常驻 shell 中执行（保留 cwd / 环境变量）。
+    with_status=True 时返回 (exit_code, text)，退出码未知时为 None。
+    cache 为 None 时按 RESULT_CACHE 决定是否经只读命令结果缓存；refresh=True 时忽略已缓存的结果。
     """
-    if not is_safe_command(command, system_type):
-        return f"⚠️ 检测到危险命令：{command}\n已阻止执行。"
+    def _result(code, text):
+        return (code, text) if with_status else text
+
+    with metrics.timer("safety_check_seconds", target="remote"):
+        safe = is_safe_command(command, system_type)
+    if not safe:
+        metrics.inc("commands_blocked_total", target="remote")
+        return _result(None, f"⚠️ 检测到危险命令：{command}\n已阻止执行。")
 
     ssh_client = client
-    if ssh_client is None:
+    tape = cassette.active()
+    if ssh_client is None and not (tape and tape.replaying):   # 回放时不需要真实连接
         # 如果全局可用复用它
         global _ssh_client
         if _ssh_client and _ssh_client.get_transport() and _ssh_client.get_transport().is_active():
@@ -218,15 +248,465 @@ def execute_remote_command(command, system_type: str = None, timeout: int = 15,
             try:
                 ssh_client, _ = connect_ssh(timeout=10)
             except Exception as e:
-                return f"❌ SSH 连接建立失败：{e}"
+                return _result(None, f"❌ SSH 连接建立失败：{e}")
+
+    remote_system = (system_type or getattr(ssh_client, "_remote_system", "") or "").lower()
+    in_shell = bool(session_key and shell_session.PERSISTENT_SHELL and "windows" not in remote_system)
+
+    def run():
+        if in_shell:
+            return _execute_in_shell(ssh_client, command, timeout, session_key)
+        return _execute_on_channel(ssh_client, command, timeout)
 
+    host, cwd = remote_cache_scope(ssh_client, session_key if in_shell else None)
+    if cache is None:
+        cache = result_cache.enabled()
+    if cache:
+        code, text = result_cache.run_cached(host, cwd, command, run, refresh=refresh,
+                                             ok=lambda res: res[0] == 0 and not res[1].startswith("❌"))[0]
+        return _result(code, text)
+    result_cache.note_executed(host, command)
+    return _result(*run())
+
+
+def remote_cache_scope(ssh_client, session_key: str = None):
+    """
+    结果缓存的 (主机, 工作目录)：一次性 exec 通道总在登录目录执行；
+    常驻 shell 的目录可能被 cd 改变，按会话区分（cd 属于不可缓存命令，执行后该主机缓存即被清空）。
+    """
+    host = result_cache.host_of(ssh_client) if ssh_client is not None else "remote"
+    return host, f"session:{session_key}" if session_key else "~"
+
+
+def _execute_on_channel(ssh_client, command, timeout):
     try:
-        print("命令*", command,"*")
-        stdin, stdout, stderr = ssh_client.exec_command(command, timeout=timeout)
-        out = stdout.read().decode("utf-8", errors="ignore").strip()
-        err = stderr.read().decode("utf-8", errors="ignore").strip()
+        metrics.inc("commands_total", target="remote")
+        with metrics.timer("ssh_exec_seconds"):
+            res = exec_on_channel(ssh_client, command, timeout=timeout)
+        out, err, code = res["stdout"].strip(), res["stderr"].strip(), res["exit_status"]
         if err:
-            return f"❌ Remote error:\n{err}\n---\n{out}"
-        return out or "✅ 命令执行成功，无输出。"
+            return code, f"❌ Remote error:\n{err}\n---\n{out}"
+        return code, out or "✅ 命令执行成功，无输出。"
     except Exception as e:
-        return f"❌ SSH 执行失败：{e}"
+        return None, f"❌ SSH 执行失败：{e}"
+
+
+# ========= 同一连接上的多通道并发执行 =========
+SSH_MAX_CHANNELS = int(os.getenv("SSH_MAX_CHANNELS", "8"))          # 每个连接同时打开的 exec 通道上限
+SSH_WINDOW_BUDGET = int(os.getenv("SSH_WINDOW_BUDGET", str(16 * 1024 * 1024)))   # 每个连接的接收窗口总预算
+_MIN_WINDOW = 256 * 1024
+_MAX_PACKET = 32768
+
+
+def _channel_slots(client):
+    """与连接绑定的通道信号量（同 _sftp 一样缓存在 client 上）"""
+    sem = getattr(client, "_chan_slots", None)
+    if sem is None:
+        with _pool_lock:
+            sem = getattr(client, "_chan_slots", None)
+            if sem is None:
+                sem = client._chan_slots = threading.BoundedSemaphore(max(SSH_MAX_CHANNELS, 1))
+    return sem
+
+
+def _channel_window() -> int:
+    """把窗口预算平分给并发通道：单个大输出不会占满内存，多个通道也不会互相饿死"""
+    return max(SSH_WINDOW_BUDGET // max(SSH_MAX_CHANNELS, 1), _MIN_WINDOW)
+
+
+def exec_on_channel(client, command: str, timeout: float = 15) -> dict:
+    """
+    在连接上新开一个 exec 通道执行命令（占用一个通道名额）。
+    stdout / stderr 交替读取，任何一边写满窗口都不会卡住另一边。
+    timeout 为空闲超时：连续 timeout 秒没有任何输出才中止，持续有输出的长命令不受影响。
+    返回 {"command", "exit_status", "stdout", "stderr", "seconds"}；超时时 exit_status 为 None。
+    """
+    tape = cassette.active()
+    if tape and tape.replaying:
+        return tape.replay_ssh("exec", command)
+    client = _resolve_client(client)
+    t0 = time.perf_counter()
+    with _channel_slots(client):
+        metrics.observe("ssh_channel_wait_seconds", time.perf_counter() - t0)
+        chan = client.get_transport().open_session(window_size=_channel_window(), max_packet_size=_MAX_PACKET)
+        try:
+            chan.settimeout(0.2)
+            chan.exec_command(command)
+            out, err = bytearray(), bytearray()
+            deadline = None if timeout is None else time.monotonic() + timeout
+            while True:
+                progressed = False
+                while chan.recv_ready():
+                    out += chan.recv(_MAX_PACKET)
+                    progressed = True
+                while chan.recv_stderr_ready():
+                    err += chan.recv_stderr(_MAX_PACKET)
+                    progressed = True
+                if chan.exit_status_ready() and not chan.recv_ready() and not chan.recv_stderr_ready():
+                    status = chan.recv_exit_status()
+                    break
+                if progressed and timeout is not None:
+                    deadline = time.monotonic() + timeout
+                elif deadline is not None and time.monotonic() > deadline:
+                    status = None
+                    err += f"\n命令执行超时（{timeout}s 内无输出）".encode()
+                    break
+                if not progressed:
+                    chan.status_event.wait(0.01)
+        finally:
+            chan.close()
+    result = {
+        "command": command,
+        "exit_status": status,
+        "stdout": out.decode("utf-8", errors="ignore"),
+        "stderr": err.decode("utf-8", errors="ignore"),
+        "seconds": time.perf_counter() - t0,
+    }
+    if tape and tape.recording:
+        tape.record_ssh("exec", command, result, result["seconds"])
+    return result
+
+
+def _blocked_result(command: str) -> dict:
+    metrics.inc("commands_blocked_total", target="remote")
+    return {"command": command, "exit_status": None, "stdout": "",
+            "stderr": f"❌ 检测到危险命令：{command}\n已阻止执行。", "seconds": 0.0}
+
+
+def execute_remote_commands(commands, system_type: str = None, timeout: float = 15, client=None,
+                            max_parallel: int = None, on_result=None):
+    """
+    在同一个 SSH 连接上并发执行多条相互独立的命令（不额外登录）。
+    并发度不超过 max_parallel 与每连接通道上限；on_result(index, result) 每完成一条回调一次。
+    返回与 commands 顺序一致的结果 dict 列表；被安全检查拦截的命令 exit_status 为 None。
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    tape = cassette.active()
+    if not (tape and tape.replaying):
+        client = _resolve_client(client)
+    commands = list(commands)
+    results = [None] * len(commands)
+
+    def run(i, command):
+        if not is_safe_command(command, system_type):
+            res = _blocked_result(command)
+        else:
+            metrics.inc("commands_total", target="remote")
+            result_cache.note_executed(remote_cache_scope(client)[0], command)
+            try:
+                res = exec_on_channel(client, command, timeout=timeout)
+            except Exception as e:
+                res = {"command": command, "exit_status": None, "stdout": "",
+                       "stderr": f"❌ SSH 执行失败：{e}", "seconds": 0.0}
+            metrics.observe("ssh_exec_seconds", res["seconds"])
+        results[i] = res
+        if on_result:
+            on_result(i, res)
+
+    workers = max(1, min(max_parallel or SSH_MAX_CHANNELS, SSH_MAX_CHANNELS, len(commands) or 1))
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        list(pool.map(lambda args: run(*args), enumerate(commands)))
+    return results
+
+
+# ========= 多条命令合并为一次 exec（一个往返） =========
+def _batch_boundary(commands) -> str:
+    # 由命令内容决定分隔符：磁带录制 / 回放时同一批命令生成的脚本相同
+    digest = hashlib.sha256("\0".join(commands).encode("utf-8")).hexdigest()[:16]
+    return f"__YANDAO_BATCH_{digest}__"
+
+
+def _batch_script(commands, boundary: str, stop_on_error: bool) -> str:
+    """
+    生成批量执行脚本：每条命令前后在 stdout / stderr 上各输出一行分隔标记，
+    结束标记带退出码，stdout 标记带远端时间戳（date +%s%N，不支持 %N 的系统退化为秒）。
+    结束标记前多输出一个换行，保证命令输出不以换行结尾时标记仍独占一行。
+    """
+    lines = [f"__b={shlex.quote(boundary)}", "__t() { date +%s%N 2>/dev/null; }"]
+    for i, command in enumerate(commands):
+        lines.append(f'printf \'%s %d S %s\\n\' "$__b" {i} "$(__t)"; printf \'%s %d S\\n\' "$__b" {i} >&2')
+        lines.append(f"eval {shlex.quote(command)} </dev/null")
+        lines.append("__rc=$?")
+        lines.append(f'printf \'\\n%s %d E %d %s\\n\' "$__b" {i} "$__rc" "$(__t)"; '
+                     f'printf \'\\n%s %d E\\n\' "$__b" {i} >&2')
+        if stop_on_error:
+            lines.append('[ "$__rc" -eq 0 ] || exit "$__rc"')
+    return "\n".join(lines) + "\n"
+
+
+def _remote_seconds(start: str, end: str):
+    def parse(ts):
+        digits = re.sub(r"\D", "", ts or "")
+        if not digits:
+            return None
+        return int(digits) / 1e9 if len(digits) > 10 else float(digits)
+    a, b = parse(start), parse(end)
+    return None if a is None or b is None else max(b - a, 0.0)
+
+
+def _split_batch_output(stdout: str, stderr: str, boundary: str, count: int):
+    """按分隔标记把合并输出拆回每条命令：返回 [(退出码或 partial / skipped, stdout, stderr, 秒数)]"""
+    b = re.escape(boundary)
+    parts = [["skipped", "", "", None] for _ in range(count)]
+    for m in re.finditer(rf"^{b} (\d+) S (\S*)\n(.*?)\n{b} \1 E (\d+) (\S*)$", stdout, re.M | re.S):
+        i = int(m.group(1))
+        parts[i] = [int(m.group(4)), m.group(3), "", _remote_seconds(m.group(2), m.group(5))]
+    # 开始了但没有结束标记：超时或命令中途退出了 shell
+    for m in re.finditer(rf"^{b} (\d+) S \S*\n", stdout, re.M):
+        i = int(m.group(1))
+        if parts[i][0] == "skipped":
+            tail = stdout[m.end():]
+            nxt = re.search(rf"^{b} ", tail, re.M)
+            parts[i] = ["partial", tail[:nxt.start()] if nxt else tail, "", None]
+    for m in re.finditer(rf"^{b} (\d+) S\n(.*?)(?:\n{b} \1 E$|\Z)", stderr, re.M | re.S):
+        parts[int(m.group(1))][2] = m.group(2)
+    return parts
+
+
+def execute_remote_batch(commands, system_type: str = None, timeout: float = None, client=None,
+                         stop_on_error: bool = False, on_result=None):
+    """
+    把多条命令合成一个带分隔标记的脚本，在一次 exec 中依次执行（同一个 shell，cd / export 对后续命令有效），
+    再按标记拆回每条命令的输出、退出码与远端耗时。高延迟链路上 N 条命令只付一次往返。
+    stop_on_error=True 时某条失败后不再执行后续命令。timeout 为空闲超时（默认 15 秒无输出；
+    每条命令开始和结束时都会输出标记，相当于按条计时）。
+    返回与 commands 顺序一致的结果 dict 列表（同 execute_remote_commands）：
+    被安全检查拦截或未执行的命令 exit_status 为 None。Windows 远端退化为逐条通道执行。
+    on_result(index, result) 在整批结束后按顺序对每条命令回调一次（包括被拦截和未执行的）。
+    """
+    commands = list(commands)
+    results = [None] * len(commands)
+    runnable = []
+    for i, command in enumerate(commands):
+        if is_safe_command(command, system_type):
+            runnable.append(i)
+        else:
+            results[i] = _blocked_result(command)
+    to_run = [commands[i] for i in runnable]
+    if to_run:
+        _run_batch(commands, runnable, results, system_type, timeout, client, stop_on_error)
+    if on_result:
+        for i, res in enumerate(results):
+            on_result(i, res)
+    return results
+
+
+def _run_batch(commands, runnable, results, system_type, timeout, client, stop_on_error):
+    """执行 runnable 中的命令（一次 exec），结果按下标写回 results"""
+    to_run = [commands[i] for i in runnable]
+
+    tape = cassette.active()
+    if not (tape and tape.replaying):
+        client = _resolve_client(client)
+    remote_system = (system_type or getattr(client, "_remote_system", "") or "").lower()
+    if "windows" in remote_system:
+        for i, res in zip(runnable, execute_remote_commands(to_run, system_type, client=client, max_parallel=1)):
+            results[i] = res
+    else:
+        host = remote_cache_scope(client)[0]
+        for command in to_run:
+            result_cache.note_executed(host, command)
+        boundary = _batch_boundary(to_run)
+        script = _batch_script(to_run, boundary, stop_on_error)
+        metrics.inc("commands_total", len(to_run), target="remote")
+        metrics.inc("ssh_batches_total")
+        try:
+            res = exec_on_channel(client, f"sh -c {shlex.quote(script)}",
+                                  timeout=timeout if timeout is not None else 15)
+        except Exception as e:
+            res = {"exit_status": None, "stdout": "", "stderr": f"❌ SSH 执行失败：{e}", "seconds": 0.0}
+        metrics.observe("ssh_exec_seconds", res["seconds"])
+        stderr = res["stderr"]
+        if res["exit_status"] is None:   # 整批超时或连接失败：exec_on_channel 把原因写在 stderr 最后一行
+            stderr, _, reason = stderr.rstrip().rpartition("\n")
+            reason = reason or "批量执行失败"
+        else:
+            reason = "批量脚本提前结束"
+        parts = _split_batch_output(res["stdout"], stderr, boundary, len(to_run))
+        for i, (status, out, err, seconds) in zip(runnable, parts):
+            if status == "skipped":
+                err, status = f"未执行（{reason}）", None
+            elif status == "partial":
+                err, status = (err + "\n" if err else "") + reason, None
+            results[i] = {"command": commands[i], "exit_status": status, "stdout": out, "stderr": err,
+                          "seconds": seconds if seconds is not None else 0.0}
+
+
+def _execute_in_shell(ssh_client, command, timeout, session_key):
+    """在会话的常驻远端 shell 中执行，返回 (exit_code, text)"""
+    tape = cassette.active()
+    try:
+        metrics.inc("commands_total", target="remote")
+        if tape and tape.replaying:
+            code, out = tape.replay_ssh("shell", command)
+        else:
+            t0 = time.perf_counter()
+            with metrics.timer("ssh_exec_seconds"):
+                code, out = shell_session.get_remote_shell(ssh_client, session_key).run(command, timeout=timeout)
+            if tape and tape.recording:
+                tape.record_ssh("shell", command, [code, out], time.perf_counter() - t0)
+    except Exception as e:   # 包括 ShellTimeout：shell 已重置，下次自动重启
+        return None, f"❌ SSH 执行失败：{e}"
+    out = out.strip()
+    if code != 0:
+        return code, f"❌ Remote error（exit={code}）:\n{out}"
+    return code, out or "✅ 命令执行成功，无输出。"
+
+# ========= SFTP：按连接缓存会话 + 流水线传输 =========
+SFTP_CHUNK_SIZE = int(os.getenv("SFTP_CHUNK_SIZE", str(256 * 1024)))
+
+
+def _resolve_client(client=None):
+    """优先使用传入的连接，否则复用全局连接"""
+    if client is not None:
+        return client
+    if _ssh_client and _ssh_client.get_transport() and _ssh_client.get_transport().is_active():
+        return _ssh_client
+    raise RuntimeError("SSH 未连接")
+
+
+def get_sftp(client=None):
+    """
+    获取（或打开）与该 SSH 连接绑定的 SFTP 会话。
+    会话缓存在 client 的 _sftp 属性上（同 _connection_info 的做法），连接关闭时随之失效。
+    """
+    client = _resolve_client(client)
+    sftp = getattr(client, "_sftp", None)
+    if sftp is not None:
+        chan = sftp.get_channel()
+        if chan is not None and not chan.closed:
+            return sftp
+    t0 = time.perf_counter()
+    sftp = client.open_sftp()
+    metrics.observe("sftp_open_seconds", time.perf_counter() - t0)
+    client._sftp = sftp
+    return sftp
+
+
+def close_sftp(client=None):
+    client = client or _ssh_client
+    sftp = getattr(client, "_sftp", None) if client else None
+    if sftp is not None:
+        try:
+            sftp.close()
+        except Exception:
+            pass
+        client._sftp = None
+
+
+def _remote_dirname(remote_path: str) -> str:
+    # 统一用 POSIX 切分拿目录
+    path = remote_path.replace("\\", "/")
+    return path.rsplit("/", 1)[0] if "/" in path else ""
+
+
+def _sftp_mkdirs_slow(sftp, remote_dir: str):
+    # 逐层 stat/mkdir（Windows 远端或无 shell 时的回退方案）
+    path = remote_dir.replace("\\", "/")
+    parts = [p for p in path.split("/") if p]
+    cur = "/" if path.startswith("/") else ""
+    for p in parts:
+        nextp = (cur + "/" + p) if cur else ("/" + p if path.startswith("/") else p)
+        try:
+            sftp.stat(nextp)
+        except IOError:
+            sftp.mkdir(nextp)
+        cur = nextp
+
+
+def sftp_mkdirs(remote_dir: str, client=None):
+    """
+    递归创建远端目录。
+    目录已存在时只需一次 stat；POSIX 路径不存在时用一次 `mkdir -p` 完成，
+    其余情况回退到逐层创建。
+    """
+    if not remote_dir:
+        return
+    client = _resolve_client(client)
+    sftp = get_sftp(client)
+    try:
+        sftp.stat(remote_dir)
+        return
+    except IOError:
+        pass
+    if remote_dir.startswith("/"):
+        _, stdout, stderr = client.exec_command(f"mkdir -p {shlex.quote(remote_dir)}", timeout=15)
+        if stdout.channel.recv_exit_status() == 0:
+            return
+    _sftp_mkdirs_slow(sftp, remote_dir)
+
+
+def sftp_write_text(ssh_client, remote_path: str, content: str, progress=None):
+    """
+    在远端写入文本文件（自动创建目录，复用 SFTP 会话，缓冲 + 流水线写入）。
+    progress(done_bytes, total_bytes) 每写完一块回调一次。
+    """
+    data = content.encode("utf-8")
+    sftp = get_sftp(ssh_client)
+    sftp_mkdirs(_remote_dirname(remote_path), ssh_client)
+    with metrics.timer("sftp_write_seconds"):
+        with sftp.open(remote_path, "w", bufsize=SFTP_CHUNK_SIZE) as f:
+            f.set_pipelined(True)
+            for start in range(0, len(data), SFTP_CHUNK_SIZE):
+                f.write(data[start:start + SFTP_CHUNK_SIZE])
+                if progress:
+                    progress(min(start + SFTP_CHUNK_SIZE, len(data)), len(data))
+    if progress and not data:
+        progress(0, 0)
+
+
+def sftp_upload(local_path: str, remote_path: str, client=None, progress=None, chunk_size: int = None):
+    """
+    分块上传本地文件；写请求流水线发送，不逐块等待服务端确认。
+    progress(transferred, total) 每块回调一次。返回写入字节数。
+    """
+    chunk_size = chunk_size or SFTP_CHUNK_SIZE
+    client = _resolve_client(client)
+    sftp = get_sftp(client)
+    total = os.path.getsize(local_path)
+    sftp_mkdirs(_remote_dirname(remote_path), client)
+
+    sent = 0
+    t0 = time.perf_counter()
+    with open(local_path, "rb") as src, sftp.open(remote_path, "wb", bufsize=chunk_size) as dst:
+        dst.set_pipelined(True)
+        while True:
+            data = src.read(chunk_size)
+            if not data:
+                break
+            dst.write(data)
+            sent += len(data)
+            if progress:
+                progress(sent, total)
+    metrics.observe("sftp_upload_seconds", time.perf_counter() - t0)
+    metrics.inc("sftp_bytes_total", sent, direction="upload")
+    return sent
+
+
+def sftp_download(remote_path: str, local_path: str, client=None, progress=None, chunk_size: int = None):
+    """
+    分块下载远端文件；通过 prefetch 预先发出全部读请求，避免逐块往返。
+    progress(transferred, total) 每块回调一次。返回读取字节数。
+    """
+    chunk_size = chunk_size or SFTP_CHUNK_SIZE
+    sftp = get_sftp(client)
+    total = sftp.stat(remote_path).st_size or 0
+    local_dir = os.path.dirname(os.path.abspath(local_path))
+    os.makedirs(local_dir, exist_ok=True)
+
+    received = 0
+    t0 = time.perf_counter()
+    with sftp.open(remote_path, "rb", bufsize=chunk_size) as src, open(local_path, "wb") as dst:
+        src.prefetch(total)
+        while True:
+            data = src.read(chunk_size)
+            if not data:
+                break
+            dst.write(data)
+            received += len(data)
+            if progress:
+                progress(received, total)
+    metrics.observe("sftp_download_seconds", time.perf_counter() - t0)
+    metrics.inc("sftp_bytes_total", received, direction="download")
+    return received
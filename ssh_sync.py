@@ -0,0 +1,347 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+ssh_sync.py
+基于块校验和的目录增量同步（rsync 思路），复用 ssh_executor 的 SSH 长连接。
+
+流程：
+1. 一次远端调用列出目标目录下每个文件的大小与 MD5，完全一致的文件直接跳过；
+2. 对有差异的文件，远端计算分块签名（弱校验 + MD5），本地用滚动校验和找出可复用的块；
+3. 只把“复用块编号 + 新增字节”发给远端，由远端拼出新文件并校验 MD5；
+4. 远端没有该文件（或没有 Python）时退化为整文件 SFTP 上传。
+多个文件在同一个 transport 上并行处理。
+"""
+
+import fnmatch
+import hashlib
+import json
+import os
+import shlex
+import struct
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from itertools import accumulate
+
+import ssh_executor
+from utils import metrics
+
+SYNC_BLOCK_SIZE = int(os.getenv("SYNC_BLOCK_SIZE", "4096"))
+SYNC_WORKERS = int(os.getenv("SYNC_WORKERS", "4"))
+SCRIPT_PATCH_BLOCK_SIZE = int(os.getenv("SCRIPT_PATCH_BLOCK_SIZE", "64"))   # 脚本较小，用小块让差量更细
+DEFAULT_EXCLUDES = ("__pycache__", "*.pyc", ".git", ".DS_Store")
+
+_MASK = 0xFFFF
+
+# 远端辅助脚本：list / sig / patch 三种模式（兼容较老的 python3）
+_REMOTE_HELPER = r'''
+import sys, os, json, hashlib, struct
+from itertools import accumulate
+def weak(b):
+    n = len(b)
+    return (sum(b) & 0xFFFF) | ((sum(accumulate(b)) & 0xFFFF) << 16) if n else 0
+def md5_file(p):
+    h = hashlib.md5()
+    with open(p, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+mode = sys.argv[1]
+if mode == "list":
+    root = sys.argv[2]; out = {}
+    for d, dirs, files in os.walk(root):
+        for name in files:
+            p = os.path.join(d, name)
+            try:
+                out[os.path.relpath(p, root)] = [os.path.getsize(p), md5_file(p)]
+            except OSError:
+                pass
+    sys.stdout.write(json.dumps(out))
+elif mode == "sig":
+    path, bs = sys.argv[2], int(sys.argv[3]); blocks = []
+    with open(path, "rb") as f:
+        for b in iter(lambda: f.read(bs), b""):
+            blocks.append([weak(b), hashlib.md5(b).hexdigest()])
+    sys.stdout.write(json.dumps(blocks))
+elif mode == "patch":
+    path, bs = sys.argv[2], int(sys.argv[3]); inp = sys.stdin.buffer
+    dst = sys.argv[4] if len(sys.argv) > 4 else path
+    tmp = dst + ".yandao-sync.tmp"
+    d = os.path.dirname(dst)
+    if d and not os.path.isdir(d):
+        os.makedirs(d)
+    old = open(path, "rb") if os.path.exists(path) else None
+    h = hashlib.md5()
+    with open(tmp, "wb") as out:
+        while True:
+            op = inp.read(1)
+            if not op or op == b"E":
+                break
+            if op == b"C":
+                start, count = struct.unpack(">II", inp.read(8))
+                old.seek(start * bs)
+                data = old.read(count * bs)
+            else:
+                (n,) = struct.unpack(">I", inp.read(4))
+                data = inp.read(n)
+            out.write(data); h.update(data)
+    if old:
+        try:
+            os.chmod(tmp, os.stat(path).st_mode & 0o7777)
+        except OSError:
+            pass
+        old.close()
+    os.replace(tmp, dst)
+    sys.stdout.write(json.dumps({"md5": h.hexdigest()}))
+'''
+
+
+# ========= 校验和与差量计算 =========
+def weak_checksum(block: bytes):
+    """返回 (a, b) 两个 16 位分量；a = Σx，b = Σ(n-i)·x_i（用前缀和求得）"""
+    if not block:
+        return 0, 0
+    return sum(block) & _MASK, sum(accumulate(block)) & _MASK
+
+
+def compute_delta(data: bytes, signatures, block_size: int):
+    """
+    根据远端块签名计算差量。
+    signatures: [[weak, md5hex], ...]（按块序号）
+    返回 ops 列表：("C", start_block, count) 复用连续块；("D", bytes) 新增数据。
+    """
+    table = {}
+    for idx, (w, strong) in enumerate(signatures):
+        table.setdefault(w, []).append((idx, strong))
+
+    ops, literal = [], bytearray()
+
+    def flush():
+        if literal:
+            ops.append(("D", bytes(literal)))
+            literal.clear()
+
+    def emit_copy(idx):
+        if ops and ops[-1][0] == "C" and not literal and ops[-1][1] + ops[-1][2] == idx:
+            ops[-1] = ("C", ops[-1][1], ops[-1][2] + 1)
+        else:
+            flush()
+            ops.append(("C", idx, 1))
+
+    n, i, bs = len(data), 0, block_size
+    a = b = 0
+    recompute = True
+    while i + bs <= n:
+        if recompute:
+            a, b = weak_checksum(data[i:i + bs])
+            recompute = False
+        matched = None
+        cands = table.get(a | (b << 16))
+        if cands:
+            strong = hashlib.md5(data[i:i + bs]).hexdigest()
+            for idx, st in cands:
+                if st == strong:
+                    matched = idx
+                    break
+        if matched is not None:
+            emit_copy(matched)
+            i += bs
+            recompute = True
+            continue
+        literal.append(data[i])
+        if i + bs < n:
+            x_out, x_in = data[i], data[i + bs]
+            a = (a - x_out + x_in) & _MASK
+            b = (b - bs * x_out + a) & _MASK
+        i += 1
+
+    # 末尾不足一块：若与远端最后一个（短）块相同也可复用
+    tail = data[i:]
+    if tail and signatures:
+        last_idx = len(signatures) - 1
+        tw, ts = signatures[last_idx]
+        ta, tb = weak_checksum(tail)
+        if (ta | (tb << 16)) == tw and hashlib.md5(tail).hexdigest() == ts:
+            emit_copy(last_idx)
+            tail = b""
+    literal.extend(tail)
+    flush()
+    return ops
+
+
+def block_signatures(data: bytes, block_size: int):
+    """本地计算块签名（与远端 sig 模式结果相同），远端内容已知时可省去一次往返"""
+    sigs = []
+    for start in range(0, len(data), block_size):
+        block = data[start:start + block_size]
+        a, b = weak_checksum(block)
+        sigs.append([a | (b << 16), hashlib.md5(block).hexdigest()])
+    return sigs
+
+
+def encode_delta(ops) -> bytes:
+    parts = []
+    for op in ops:
+        if op[0] == "C":
+            parts.append(b"C" + struct.pack(">II", op[1], op[2]))
+        else:
+            parts.append(b"D" + struct.pack(">I", len(op[1])) + op[1])
+    parts.append(b"E")
+    return b"".join(parts)
+
+
+# ========= 远端调用 =========
+def _exec(client, command: str, stdin_data: bytes = None, timeout: int = 300):
+    """在独立 channel 上执行命令，返回 (exit_status, stdout_bytes, stderr_text)"""
+    chan = client.get_transport().open_session()
+    chan.settimeout(timeout)
+    try:
+        chan.exec_command(command)
+        if stdin_data is not None:
+            chan.sendall(stdin_data)
+            chan.shutdown_write()
+        out = chan.makefile("rb").read()
+        err = chan.makefile_stderr("rb").read().decode("utf-8", errors="ignore")
+        return chan.recv_exit_status(), out, err
+    finally:
+        chan.close()
+
+
+def _find_remote_python(client):
+    status, out, _ = _exec(client, "command -v python3 || command -v python", timeout=15)
+    path = out.decode("utf-8", errors="ignore").strip().splitlines()
+    return path[0] if status == 0 and path else None
+
+
+def remote_python(client):
+    """远端 Python 路径（缓存在 client 上，同 _sftp 的做法）；没有时返回 None"""
+    python = getattr(client, "_remote_python", None)
+    if python is None:
+        python = client._remote_python = _find_remote_python(client) or ""
+    return python or None
+
+
+def _helper_cmd(python: str, *args) -> str:
+    return " ".join([shlex.quote(python), "-c", shlex.quote(_REMOTE_HELPER)] + [shlex.quote(str(a)) for a in args])
+
+
+def _iter_local_files(local_dir: str, excludes):
+    for d, dirs, files in os.walk(local_dir):
+        dirs[:] = [x for x in dirs if not any(fnmatch.fnmatch(x, pat) for pat in excludes)]
+        for name in files:
+            if any(fnmatch.fnmatch(name, pat) for pat in excludes):
+                continue
+            full = os.path.join(d, name)
+            yield os.path.relpath(full, local_dir).replace(os.sep, "/"), full
+
+
+def _sync_one(client, python, local_path, remote_path, remote_exists, block_size):
+    """同步单个文件，返回 (方式, 发送字节数)"""
+    with open(local_path, "rb") as f:
+        data = f.read()
+    local_md5 = hashlib.md5(data).hexdigest()
+
+    if python is None or not remote_exists:
+        ssh_executor.sftp_upload(local_path, remote_path, client=client)
+        return "full", len(data)
+
+    status, out, err = _exec(client, _helper_cmd(python, "sig", remote_path, block_size))
+    if status != 0:
+        raise RuntimeError(f"远端签名计算失败：{err.strip()}")
+    signatures = json.loads(out.decode("utf-8"))
+    payload = encode_delta(compute_delta(data, signatures, block_size))
+
+    status, out, err = _exec(client, _helper_cmd(python, "patch", remote_path, block_size), stdin_data=payload)
+    if status != 0:
+        raise RuntimeError(f"远端合并失败：{err.strip()}")
+    if json.loads(out.decode("utf-8")).get("md5") != local_md5:
+        # 校验不一致（例如期间远端文件被修改），整文件重传兜底
+        ssh_executor.sftp_upload(local_path, remote_path, client=client)
+        return "full", len(data)
+    return "delta", len(payload)
+
+
+def patch_remote_file(client, remote_path: str, base: bytes, data: bytes, dest_path: str = None,
+                      block_size: int = None):
+    """
+    远端 remote_path 的内容已知为 base 时，把它更新为 data（写到 dest_path，默认原地）。
+    签名在本地由 base 计算，只需一次远端调用发送差量；远端合成后校验 MD5，
+    不一致（远端文件已被改动）或远端没有 Python 时整文件写入。
+    返回 (方式 "delta" / "full", 发送字节数)。
+    """
+    block_size = block_size or SCRIPT_PATCH_BLOCK_SIZE
+    client = ssh_executor._resolve_client(client)
+    dest_path = dest_path or remote_path
+    python = remote_python(client)
+    if python is not None:
+        payload = encode_delta(compute_delta(data, block_signatures(base, block_size), block_size))
+        status, out, err = _exec(client, _helper_cmd(python, "patch", remote_path, block_size, dest_path),
+                                 stdin_data=payload, timeout=60)
+        if status == 0 and json.loads(out.decode("utf-8") or "{}").get("md5") == hashlib.md5(data).hexdigest():
+            metrics.inc("sftp_bytes_total", len(payload), direction="patch")
+            return "delta", len(payload)
+        print(f"⚠️ 远端差量合成未通过校验，改为整文件写入：{err.strip()}")
+    ssh_executor.sftp_write_text(client, dest_path, data.decode("utf-8"))
+    return "full", len(data)
+
+
+def sync_directory(local_dir: str, remote_dir: str, client=None, block_size: int = None,
+                   workers: int = None, excludes=DEFAULT_EXCLUDES, progress=None) -> dict:
+    """
+    将本地目录增量同步到远端 POSIX 目录（不删除远端多余文件）。
+    progress(done_files, total_files) 每完成一个文件回调一次。
+    返回统计信息 dict。
+    """
+    if not remote_dir.startswith("/"):
+        raise RuntimeError("目录同步仅支持 POSIX 远端的绝对路径")
+    block_size = block_size or SYNC_BLOCK_SIZE
+    workers = workers or SYNC_WORKERS
+    client = ssh_executor._resolve_client(client)
+    t0 = time.perf_counter()
+
+    local_files = list(_iter_local_files(local_dir, excludes))
+    python = _find_remote_python(client)
+    remote_index = {}
+    if python:
+        status, out, _ = _exec(client, _helper_cmd(python, "list", remote_dir))
+        if status == 0 and out:
+            remote_index = json.loads(out.decode("utf-8"))
+    ssh_executor.sftp_mkdirs(remote_dir, client)
+
+    stats = {"files": len(local_files), "skipped": 0, "delta": 0, "full": 0,
+             "bytes_sent": 0, "bytes_total": 0, "errors": []}
+    todo = []
+    for rel, full in local_files:
+        size = os.path.getsize(full)
+        stats["bytes_total"] += size
+        known = remote_index.get(rel)
+        if known and known[0] == size:
+            with open(full, "rb") as f:
+                if hashlib.md5(f.read()).hexdigest() == known[1]:
+                    stats["skipped"] += 1
+                    continue
+        todo.append((rel, full, known is not None))
+
+    done = stats["skipped"]
+    if progress:
+        progress(done, len(local_files))
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        futures = {
+            pool.submit(_sync_one, client, python, full, remote_dir.rstrip("/") + "/" + rel, exists, block_size): rel
+            for rel, full, exists in todo
+        }
+        for fut in as_completed(futures):
+            rel = futures[fut]
+            try:
+                kind, sent = fut.result()
+                stats[kind] += 1
+                stats["bytes_sent"] += sent
+            except Exception as e:
+                stats["errors"].append(f"{rel}: {e}")
+            done += 1
+            if progress:
+                progress(done, len(local_files))
+
+    stats["seconds"] = time.perf_counter() - t0
+    metrics.observe("sync_seconds", stats["seconds"])
+    metrics.inc("sftp_bytes_total", stats["bytes_sent"], direction="sync")
+    return stats
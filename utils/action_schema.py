@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+action_schema.py
+模型回复的结构化约束与严格校验。
+
+功能说明：
+- 后端支持约束解码时（vLLM guided_json）直接要求模型按 JSON Schema 输出动作；
+- 其余后端沿用 EXECUTE / SCRIPT / REPLY（修改已有脚本时还有 PATCH）文本协议，按路由档位设置 max_tokens；
+  simple 档位且模型不会输出 <think> 推理块时设置停止词（出现第二个动作头即停止），避免冗长输出；
+  推理模型的思考内容里也可能出现动作头，脚本正文里也可能有以动作头开头的行，这两种情况不设停止词，
+  改为解析时在第二个动作头处截断（脚本 / diff 正文中的行不算动作头）；
+- parse_action 对两种格式做严格校验，不合格时抛出 ActionParseError，由调用方决定是否自动重试。
+模式由环境变量 ACTION_OUTPUT 控制：auto（默认，本地走 JSON、API 走文本）/ json / text。
+"""
+
+import json
+import os
+import re
+from typing import NamedTuple
+
+ACTION_OUTPUT = os.getenv("ACTION_OUTPUT", "auto").lower()
+MAX_TOKENS = {
+    "simple": int(os.getenv("ACTION_MAX_TOKENS_SIMPLE", "384")),
+    "script": int(os.getenv("ACTION_MAX_TOKENS_SCRIPT", "2048")),
+}
+REPAIR_RETRIES = int(os.getenv("ACTION_REPAIR_RETRIES", "1"))   # 格式不合格时自动重答的次数
+ACTION_STOP = os.getenv("ACTION_STOP", "auto").lower()            # auto / on / off：是否向服务端发送停止词
+ACTIONS = ("execute", "script", "reply", "patch")
+STOP_SEQUENCES = ["\nEXECUTE:", "\nSCRIPT:", "\nREPLY:", "\nPATCH:"]
+
+_STR = {"type": "string"}
+ACTION_SCHEMA = {
+    "anyOf": [
+        {"type": "object", "additionalProperties": False, "required": ["action", "description", "command"],
+         "properties": {"action": {"enum": ["execute"]}, "description": _STR, "command": _STR}},
+        {"type": "object", "additionalProperties": False,
+         "required": ["action", "filename", "location", "description", "content"],
+         "properties": {"action": {"enum": ["script"]}, "filename": _STR, "location": _STR,
+                        "description": _STR, "content": _STR}},
+        {"type": "object", "additionalProperties": False, "required": ["action", "reply"],
+         "properties": {"action": {"enum": ["reply"]}, "reply": _STR}},
+        {"type": "object", "additionalProperties": False, "required": ["action", "filename", "description", "diff"],
+         "properties": {"action": {"enum": ["patch"]}, "filename": _STR, "description": _STR, "diff": _STR}},
+    ]
+}
+
+JSON_INSTRUCTION = (
+    "输出格式要求（覆盖上文的文本格式）：只输出一个 JSON 对象，不要输出其他任何内容。\n"
+    '- 执行命令：{"action": "execute", "description": "<简短任务说明>", "command": "<命令>"}\n'
+    '- 生成脚本：{"action": "script", "filename": "<文件名>", "location": "<生成位置>", '
+    '"description": "<脚本说明>", "content": "<脚本内容>"}\n'
+    '- 直接回答：{"action": "reply", "reply": "<自然语言回答>"}'
+)
+
+# 每种动作必须非空的字段
+_REQUIRED = {
+    "execute": ("command",),
+    "script": ("filename", "content"),
+    "reply": ("reply",),
+    "patch": ("filename", "diff"),
+}
+_ALLOWED = {
+    "execute": {"action", "description", "command"},
+    "script": {"action", "filename", "location", "description", "content"},
+    "reply": {"action", "reply"},
+    "patch": {"action", "filename", "description", "diff"},
+}
+
+_THINK = re.compile(r"<think>[\s\S]*?</think>", re.I)
+_REASONING_MODEL = re.compile(r"r1|reason|think|qwq|deepseek", re.I)   # 可能在正文中输出 <think> 的模型
+_HEADER = re.compile(r"^[ \t]*(EXECUTE|SCRIPT|REPLY|PATCH)[ \t]*:", re.M)
+_FENCE = re.compile(r"```[\w+-]*\n([\s\S]*?)```")
+_ANY_FENCE = re.compile(r"```[\s\S]*?(?:```|$)")
+_JSON_FENCE = re.compile(r"^```(?:json)?\s*\n([\s\S]*?)\n?```$")
+
+
+class ActionParseError(ValueError):
+    pass
+
+
+class Action(NamedTuple):
+    kind: str
+    description: str = ""
+    command: str = ""
+    filename: str = ""
+    location: str = ""
+    content: str = ""
+    reply: str = ""
+    diff: str = ""
+    fmt: str = "text"
+
+
+class RequestOptions(NamedTuple):
+    max_tokens: int
+    payload: dict        # 合并进请求体的额外字段（stop / guided_json / response_format）
+    instruction: str     # 追加到系统提示的格式说明（文本协议时为空）
+
+
+def mode_for(provider: str) -> str:
+    if ACTION_OUTPUT in ("json", "text"):
+        return ACTION_OUTPUT
+    return "json" if provider == "local" else "text"
+
+
+def use_stops(tier: str, model: str = None) -> bool:
+    """是否向服务端发送停止词：脚本档位与推理模型不发（见模块说明）"""
+    if ACTION_STOP in ("on", "off"):
+        return ACTION_STOP == "on"
+    return tier == "simple" and not _REASONING_MODEL.search(model or "")
+
+
+def request_options(provider: str, tier: str = "simple", model: str = None) -> RequestOptions:
+    """按提供方、路由档位与模型名生成请求约束"""
+    max_tokens = MAX_TOKENS.get(tier, MAX_TOKENS["simple"])
+    if mode_for(provider) == "json":
+        if provider == "local":
+            payload = {"guided_json": ACTION_SCHEMA}          # vLLM 约束解码
+        else:
+            payload = {"response_format": {"type": "json_object"}}
+        return RequestOptions(max_tokens, payload, JSON_INSTRUCTION)
+    return RequestOptions(max_tokens, {"stop": list(STOP_SEQUENCES)} if use_stops(tier, model) else {}, "")
+
+
+# ========= 严格校验 =========
+def _parse_json(text: str) -> Action:
+    m = _JSON_FENCE.match(text)
+    if m:
+        text = m.group(1).strip()
+    try:
+        obj = json.loads(text)
+    except ValueError as e:
+        raise ActionParseError(f"JSON 无法解析：{e}")
+    if not isinstance(obj, dict):
+        raise ActionParseError("JSON 顶层必须是对象")
+    kind = obj.get("action")
+    if kind not in ACTIONS:
+        raise ActionParseError(f"未知动作：{kind!r}")
+    extra = set(obj) - _ALLOWED[kind]
+    if extra:
+        raise ActionParseError(f"{kind} 动作包含多余字段：{', '.join(sorted(extra))}")
+    for key, value in obj.items():
+        if not isinstance(value, str):
+            raise ActionParseError(f"字段 {key} 必须是字符串")
+    for key in _REQUIRED[kind]:
+        if not obj.get(key, "").strip():
+            raise ActionParseError(f"{kind} 动作缺少 {key}")
+    fields = {k: v.strip() for k, v in obj.items() if k != "action"}
+    if kind == "execute":
+        fields["command"] = _strip_fence(fields["command"])
+    if kind == "patch":
+        fields["diff"] = _check_diff(_strip_fence(obj["diff"]))
+    return Action(kind=kind, fmt="json", **fields)
+
+
+def _strip_fence(text: str) -> str:
+    m = _FENCE.search(text)
+    return m.group(1).strip() if m else text.strip()
+
+
+def _check_diff(diff: str) -> str:
+    if "@@" not in diff:
+        raise ActionParseError("PATCH 内容不是统一 diff（缺少 @@ 块）")
+    return diff if diff.endswith("\n") else diff + "\n"
+
+
+def _mask_fences(text: str) -> str:
+    # 代码块内（脚本内容 / diff 上下文）出现的动作头不算数
+    return _ANY_FENCE.sub(lambda m: re.sub(r"[^\n]", " ", m.group(0)), text)
+
+
+def _parse_text(text: str) -> Action:
+    headers = list(_HEADER.finditer(_mask_fences(text)))
+    if not headers:
+        raise ActionParseError("缺少 EXECUTE / SCRIPT / REPLY 动作头")
+    # 动作头之前的寒暄 / 说明直接丢弃，不为此再请求一次
+    kind = headers[0].group(1).lower()
+    body = text[headers[0].end():]
+    if kind in ("execute", "reply") and len(headers) > 1:
+        # 相当于客户端的停止词：只取第一个动作（SCRIPT / PATCH 之后的内容都是正文，其中以动作头开头的行不算）
+        body = text[headers[0].end():headers[1].start()]
+
+    if kind == "reply":
+        reply = body.strip()
+        if not reply:
+            raise ActionParseError("REPLY 内容为空")
+        return Action(kind="reply", reply=reply)
+
+    if kind == "patch":
+        lines = body.strip().splitlines()
+        filename = lines[0].strip() if lines else ""
+        m = re.search(r"```(?:diff|patch)?\n([\s\S]*?)```", body)
+        if m:
+            head = body[:m.start()].strip().splitlines()
+            diff = m.group(1)
+        else:
+            start = next((i for i, ln in enumerate(lines) if ln.startswith(("--- ", "@@"))), len(lines))
+            head, diff = lines[:start], "\n".join(lines[start:])
+        description = head[1].strip() if len(head) > 1 else ""
+        if not filename or filename.startswith(("---", "@@", "```")):
+            raise ActionParseError("PATCH 缺少文件名")
+        return Action(kind="patch", filename=filename, description=description, diff=_check_diff(diff))
+
+    if kind == "execute":
+        lines = body.strip().splitlines()
+        desc = lines[0].strip() if lines else ""
+        command = _strip_fence("\n".join(lines[1:]))
+        if not command:
+            raise ActionParseError("EXECUTE 缺少命令")
+        return Action(kind="execute", description=desc, command=command)
+
+    lines = body.strip().splitlines()
+    if len(lines) < 2:
+        raise ActionParseError("SCRIPT 缺少文件名或生成位置")
+    filename, location = lines[0].strip(), lines[1].strip()
+    description = lines[2].strip() if len(lines) > 2 else ""
+    m = _FENCE.search(body)
+    if m:
+        content = m.group(1).strip()
+    else:
+        content = re.sub(r"</?script>", "", "\n".join(lines[3:])).strip()
+    if not filename or not content:
+        raise ActionParseError("SCRIPT 缺少文件名或脚本内容")
+    return Action(kind="script", filename=filename, location=location, description=description, content=content)
+
+
+def parse_action(response: str) -> Action:
+    """严格解析模型回复（JSON 或文本协议），不合格时抛出 ActionParseError"""
+    text = _THINK.sub("", response or "").strip()
+    low = text.lower()
+    if "</think>" in low and "<think>" not in low:
+        text = text[low.rindex("</think>") + len("</think>"):].strip()   # 部分服务端会去掉开头的 <think>
+    elif "<think>" in low:
+        raise ActionParseError("回复在思考阶段被截断（缺少 </think>）")
+    if not text:
+        raise ActionParseError("回复为空")
+    if text.startswith("{") or text.startswith("```json") or (text.startswith("```") and '"action"' in text[:200]):
+        return _parse_json(text)
+    return _parse_text(text)
+
+
+def repair_prompt(error: Exception, mode: str) -> str:
+    """校验失败后自动重试时随原请求附带的纠正提示（无效回答本身不再发送）"""
+    expected = "只输出一个符合要求的 JSON 对象" if mode == "json" else "以 EXECUTE: / SCRIPT: / REPLY: / PATCH: 之一开头，且只包含一个动作"
+    return f"你对本次请求的上一次回答格式无效（{error}）。请重新回答，{expected}，不要附加任何其他内容。"
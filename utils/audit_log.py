@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+audit_log.py
+命令审计日志：记录模型生成了什么、用户是否批准、在哪台主机上执行、结果如何。
+
+功能说明：
+- 每条记录为一行 JSON（JSONL）：时间、会话、事件、提示词摘要、动作、命令、主机、
+  用户决定、退出码、耗时、输出大小；只记录提示词与输出的 sha256 / 大小，不落原文；
+- 调用方只把记录放入队列立即返回，由后台线程批量写入，每批一次 fsync，
+  审计不会给执行路径增加延迟；
+- 文件超过 AUDIT_MAX_BYTES 时按 audit.jsonl -> audit.jsonl.1 -> … 轮转，保留 AUDIT_BACKUPS 份；
+- 进程退出时（atexit）写完队列中剩余的记录。
+日志路径：环境变量 AUDIT_LOG，默认 ~/.yandao_os/audit.jsonl；设为 off 关闭审计。
+"""
+
+import atexit
+import hashlib
+import json
+import os
+import queue
+import threading
+import time
+
+from utils import metrics
+
+AUDIT_LOG = os.getenv("AUDIT_LOG", os.path.join(os.path.expanduser("~"), ".yandao_os", "audit.jsonl"))
+FLUSH_INTERVAL = float(os.getenv("AUDIT_FLUSH_INTERVAL", "1.0"))
+MAX_BYTES = int(os.getenv("AUDIT_MAX_BYTES", str(10 * 1024 * 1024)))
+BACKUPS = int(os.getenv("AUDIT_BACKUPS", "5"))
+BATCH_SIZE = 500
+
+_STOP = object()
+
+
+def digest(text: str) -> str:
+    """提示词 / 输出的摘要（sha256 前 16 位），审计中不保存原文"""
+    return hashlib.sha256((text or "").encode("utf-8", errors="ignore")).hexdigest()[:16]
+
+
+class AuditLog:
+    """异步批量写入的 JSONL 审计日志"""
+
+    def __init__(self, path: str = None):
+        self.path = path or AUDIT_LOG
+        self._queue = queue.Queue()
+        self._started = False
+        self._closed = False
+        self._start_lock = threading.Lock()
+        self._thread = None
+
+    # ---------- 后台写入 ----------
+    def _ensure_started(self):
+        if self._started:
+            return
+        with self._start_lock:
+            if self._started:
+                return
+            self._thread = threading.Thread(target=self._writer_loop, name="audit-writer", daemon=True)
+            self._thread.start()
+            self._started = True
+
+    def _open(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        return open(self.path, "ab")
+
+    def _rotate(self, f):
+        """
+        当前文件超过上限时依次后移：.N-1 -> .N，…，当前 -> .1。
+        改名失败（权限、文件被占用等）只告警，重新打开当前文件继续追加，不让写线程退出。
+        """
+        f.close()
+        try:
+            if BACKUPS > 0:
+                for i in range(BACKUPS - 1, 0, -1):
+                    src = f"{self.path}.{i}"
+                    if os.path.exists(src):
+                        os.replace(src, f"{self.path}.{i + 1}")
+                os.replace(self.path, f"{self.path}.1")
+            else:
+                os.remove(self.path)
+        except OSError as e:
+            print(f"⚠️ 审计日志轮转失败，继续写入当前文件：{e}")
+            metrics.inc("audit_rotation_errors_total")
+        else:
+            metrics.inc("audit_rotations_total")
+        return self._open()
+
+    def _writer_loop(self):
+        # 打开失败时线程不退出：照常取出队列（flush 不会空等），每批重试打开，打不开的那批记录丢弃
+        f, open_error = None, None
+        stop = False
+        while not stop:
+            item = self._queue.get()
+            batch = [item]
+            deadline = time.monotonic() + FLUSH_INTERVAL
+            while len(batch) < BATCH_SIZE and item is not _STOP:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                batch.append(item)
+            flush_events = [x for x in batch if isinstance(x, threading.Event)]
+            records = [x for x in batch if isinstance(x, dict)]
+            stop = any(x is _STOP for x in batch)
+            try:
+                if f is None or f.closed:
+                    f = self._open()   # 启动时或上次轮转后打开失败，这里再试
+                    open_error = None
+            except OSError as e:
+                if open_error is None:   # 同一原因只提示一次
+                    print(f"⚠️ 审计日志无法打开，记录将被丢弃：{e}")
+                open_error = str(e)
+                metrics.inc("audit_dropped_total", len(records))
+                records = []
+            try:
+                if records:
+                    t0 = time.perf_counter()
+                    f.write(b"".join(json.dumps(r, ensure_ascii=False, default=str).encode("utf-8") + b"\n" for r in records))
+                    f.flush()
+                    os.fsync(f.fileno())
+                    metrics.observe("audit_flush_seconds", time.perf_counter() - t0)
+                    metrics.inc("audit_records_total", len(records))
+                    if MAX_BYTES > 0 and f.tell() >= MAX_BYTES:
+                        f = self._rotate(f)
+            except Exception as e:   # 任何异常都不能让写线程退出，否则之后的记录全部丢失
+                print(f"⚠️ 审计日志写入失败：{e}")
+            for ev in flush_events:
+                ev.set()
+        if f is not None:
+            f.close()
+
+    # ---------- 对外接口 ----------
+    def record(self, event: str, **fields):
+        """追加一条审计记录（只入队，不等待写盘）"""
+        if self._closed:
+            return
+        self._ensure_started()
+        entry = {"ts": round(time.time(), 3), "event": event}
+        entry.update((k, v) for k, v in fields.items() if v is not None)
+        self._queue.put(entry)
+
+    def flush(self, timeout: float = 5.0) -> bool:
+        """等待队列中已有的记录落盘"""
+        if not self._started:
+            return True
+        ev = threading.Event()
+        self._queue.put(ev)
+        return ev.wait(timeout)
+
+    def close(self, timeout: float = 5.0):
+        """写完剩余记录并停止后台线程"""
+        if self._closed:
+            return
+        self._closed = True
+        if self._started:
+            self._queue.put(_STOP)
+            self._thread.join(timeout)
+
+
+class _NullAuditLog:
+    """AUDIT_LOG=off 时使用"""
+
+    def record(self, event: str, **fields):
+        pass
+
+    def flush(self, timeout: float = 5.0) -> bool:
+        return True
+
+    def close(self, timeout: float = 5.0):
+        pass
+
+
+_default_log = None
+_default_lock = threading.Lock()
+
+
+def get_audit_log():
+    """进程内共享的审计日志"""
+    global _default_log
+    with _default_lock:
+        if _default_log is None:
+            if AUDIT_LOG.lower() in ("", "0", "off", "false", "no"):
+                _default_log = _NullAuditLog()
+            else:
+                _default_log = AuditLog()
+                atexit.register(_default_log.close)
+        return _default_log
@@ -0,0 +1,294 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+cassette.py
+模型请求与 SSH 执行的录制 / 回放（“磁带”），用于离线复现慢请求或错误回复。
+
+功能说明：
+- record：透明转发真实请求，同时把每次模型 HTTP 请求 / 响应（含流式分块及其时间点）
+  和每次 SSH 执行（输出、退出码、耗时）追加写入磁带文件；
+- replay：不联网、不连主机，按请求内容匹配磁带中的记录依次返回；
+  CASSETTE_SPEED=1 按原始耗时回放，2 为两倍速，0 为不等待（尽快返回）；
+- 同一请求出现多次时按录制顺序依次返回；找不到匹配时抛出 CassetteMiss。
+磁带为 JSON Lines（路径以 .gz 结尾时 gzip 压缩）；请求头（含 API key）不写入磁带。
+环境变量：CASSETTE_MODE（off / record / replay）、CASSETTE_PATH、CASSETTE_SPEED。
+"""
+
+import base64
+import contextlib
+import datetime
+import gzip
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import defaultdict, deque
+from urllib.parse import urlsplit
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+from utils import metrics
+
+CASSETTE_MODE = os.getenv("CASSETTE_MODE", "off").lower()
+CASSETTE_PATH = os.getenv("CASSETTE_PATH", os.path.join(os.path.expanduser("~"), ".yandao_os", "cassette.jsonl.gz"))
+CASSETTE_SPEED = float(os.getenv("CASSETTE_SPEED", "1"))
+FORMAT_VERSION = 1
+
+
+class CassetteMiss(LookupError):
+    """回放时磁带中没有对应的记录"""
+
+
+def _key(*parts) -> str:
+    raw = json.dumps(parts, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()[:24]
+
+
+def http_key(url: str, body) -> str:
+    """只按路径与请求体匹配（API 地址换成本地模拟服务时仍能回放）"""
+    return _key("http", urlsplit(url).path.rstrip("/"), body)
+
+
+def ssh_key(kind: str, command: str) -> str:
+    return _key("ssh", kind, command)
+
+
+def _encode_body(data: bytes) -> dict:
+    try:
+        return {"text": data.decode("utf-8")}
+    except UnicodeDecodeError:
+        return {"b64": base64.b64encode(data).decode("ascii")}
+
+
+def _decode_body(obj: dict) -> bytes:
+    if "b64" in obj:
+        return base64.b64decode(obj["b64"])
+    return obj.get("text", "").encode("utf-8")
+
+
+class TapeResponse:
+    """
+    回放（及录制后）返回给调用方的响应，接口与 requests.Response 常用部分一致。
+    chunks 为 [(相对请求开始的秒数, bytes)]，读取内容时按回放速度等待到对应时间点；
+    录制流式响应时 chunks 为边读边记录的生成器，读完后才写入磁带。
+    """
+
+    def __init__(self, url: str, status: int, reason: str, headers: dict, ttfb: float, chunks, pace=None):
+        self.url = url
+        self.status_code = status
+        self.reason = reason
+        self.headers = CaseInsensitiveDict(headers or {})
+        self.elapsed = datetime.timedelta(seconds=ttfb)
+        self.encoding = "utf-8"
+        self._chunks = chunks
+        self._pace = pace or (lambda offset: None)
+
+    @property
+    def ok(self) -> bool:
+        return self.status_code < 400
+
+    def iter_content(self, chunk_size=None, decode_unicode=False):
+        for offset, data in self._chunks:
+            self._pace(offset)
+            yield data.decode("utf-8", errors="replace") if decode_unicode else data
+
+    def iter_lines(self, chunk_size=None, decode_unicode=False, delimiter=None):
+        pending = b""
+        for data in self.iter_content():
+            pending += data
+            lines = pending.split(delimiter.encode() if delimiter else b"\n")
+            pending = lines.pop()
+            for line in lines:
+                line = line if delimiter else line.rstrip(b"\r")
+                yield line.decode("utf-8", errors="replace") if decode_unicode else line
+        if pending:
+            yield pending.decode("utf-8", errors="replace") if decode_unicode else pending
+
+    @property
+    def content(self) -> bytes:
+        if not hasattr(self, "_content"):
+            self._content = b"".join(self.iter_content())
+        return self._content
+
+    @property
+    def text(self) -> str:
+        return self.content.decode(self.encoding, errors="replace")
+
+    def json(self, **kwargs):
+        return json.loads(self.content, **kwargs)
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            kind = "Client" if self.status_code < 500 else "Server"
+            raise requests.exceptions.HTTPError(
+                f"{self.status_code} {kind} Error: {self.reason} for url: {self.url}", response=self)
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class Cassette:
+    """一盘磁带：record 模式追加写入，replay 模式按 key 顺序取出"""
+
+    def __init__(self, path: str, mode: str, speed: float = 1.0):
+        if mode not in ("record", "replay"):
+            raise ValueError(f"未知的磁带模式：{mode}")
+        self.path = path
+        self.mode = mode
+        self.speed = speed
+        self._lock = threading.Lock()
+        self._entries = defaultdict(deque)
+        if mode == "replay":
+            self._load()
+        else:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            self._file = self._open("at")
+            self._write({"cassette": FORMAT_VERSION, "created": round(time.time(), 3)})
+
+    @property
+    def recording(self) -> bool:
+        return self.mode == "record"
+
+    @property
+    def replaying(self) -> bool:
+        return self.mode == "replay"
+
+    def _open(self, mode: str):
+        if self.path.endswith(".gz"):
+            return gzip.open(self.path, mode, encoding="utf-8")
+        return open(self.path, mode, encoding="utf-8")
+
+    def _load(self):
+        with self._open("rt") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                entry = json.loads(line)
+                if "key" in entry:
+                    self._entries[entry["key"]].append(entry)
+
+    def _write(self, entry: dict):
+        with self._lock:
+            self._file.write(json.dumps(entry, ensure_ascii=False, separators=(",", ":")) + "\n")
+            self._file.flush()
+
+    def _take(self, key: str, what: str) -> dict:
+        with self._lock:
+            queue = self._entries.get(key)
+            if not queue:
+                metrics.inc("cassette_misses_total")
+                raise CassetteMiss(f"回放磁带中没有匹配的记录：{what}")
+            metrics.inc("cassette_hits_total")
+            return queue.popleft()
+
+    def _pacer(self, start: float):
+        """返回 pace(offset)：按回放速度等待到 start + offset"""
+        def pace(offset: float):
+            if self.speed > 0:
+                delay = start + offset / self.speed - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+        return pace
+
+    def close(self):
+        if self.recording:
+            with self._lock:
+                self._file.close()
+
+    # ---------- HTTP ----------
+    def post(self, url: str, stream: bool = False, **kwargs):
+        body = kwargs.get("json")
+        key = http_key(url, body)
+        if self.replaying:
+            entry = self._take(key, f"POST {urlsplit(url).path}")
+            start = time.monotonic()
+            pace = self._pacer(start)
+            pace(entry["ttfb"])   # 响应头到达的时间点
+            chunks = [(offset, _decode_body(data)) for offset, data in entry["chunks"]]
+            return TapeResponse(url, entry["status"], entry.get("reason", ""), entry.get("headers"),
+                                entry["ttfb"], chunks, pace)
+
+        t0 = time.perf_counter()
+        resp = requests.post(url, stream=stream, **kwargs)
+        ttfb = resp.elapsed.total_seconds()
+        entry = {
+            "key": key, "type": "http", "ts": round(time.time(), 3), "url": url, "request": body,
+            "status": resp.status_code, "reason": resp.reason, "ttfb": round(ttfb, 4),
+            "headers": {k: v for k, v in resp.headers.items() if k.lower() in ("content-type", "retry-after")},
+        }
+
+        def live():
+            # 调用方读到每一块的同时记录其时间点，首 token 时间不受录制影响
+            chunks = []
+            try:
+                for data in resp.iter_content(chunk_size=None):
+                    chunks.append((round(time.perf_counter() - t0, 4), data))
+                    yield chunks[-1]
+            finally:
+                resp.close()
+                entry["chunks"] = [(offset, _encode_body(data)) for offset, data in chunks]
+                self._write(entry)
+
+        if stream:
+            return TapeResponse(url, resp.status_code, resp.reason, dict(resp.headers), ttfb, live())
+        chunks = [(round(time.perf_counter() - t0, 4), resp.content)]
+        entry["chunks"] = [(offset, _encode_body(data)) for offset, data in chunks]
+        self._write(entry)
+        return TapeResponse(url, resp.status_code, resp.reason, dict(resp.headers), ttfb, chunks)
+
+    # ---------- SSH ----------
+    def replay_ssh(self, kind: str, command: str) -> dict:
+        entry = self._take(ssh_key(kind, command), f"{kind}: {command}")
+        self._pacer(time.monotonic())(entry.get("seconds", 0.0))
+        return entry["result"]
+
+    def record_ssh(self, kind: str, command: str, result, seconds: float):
+        self._write({"key": ssh_key(kind, command), "type": "ssh", "kind": kind, "ts": round(time.time(), 3),
+                     "command": command, "seconds": round(seconds, 4), "result": result})
+
+
+_active = None
+_active_lock = threading.Lock()
+
+
+def active():
+    """当前生效的磁带；未开启录制 / 回放时返回 None"""
+    global _active
+    if _active is None and CASSETTE_MODE in ("record", "replay"):
+        with _active_lock:
+            if _active is None:
+                _active = Cassette(CASSETTE_PATH, CASSETTE_MODE, CASSETTE_SPEED)
+                print(f"📼 磁带{'录制' if _active.recording else '回放'}：{CASSETTE_PATH}")
+    return _active
+
+
+@contextlib.contextmanager
+def use_cassette(path: str, mode: str, speed: float = 1.0):
+    """在代码块内临时启用一盘磁带（压测 / 回归脚本使用）"""
+    global _active
+    tape = Cassette(path, mode, speed)
+    with _active_lock:
+        previous, _active = _active, tape
+    try:
+        yield tape
+    finally:
+        with _active_lock:
+            _active = previous
+        tape.close()
+
+
+def http_post(url: str, **kwargs):
+    """替代 requests.post：录制 / 回放开启时经过磁带，否则直接发送"""
+    tape = active()
+    if tape is None:
+        return requests.post(url, **kwargs)
+    return tape.post(url, **kwargs)
@@ -0,0 +1,318 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+history_store.py
+持久化的对话 / 执行历史（SQLite，WAL 模式 + FTS 全文索引）。
+
+功能说明：
+- 记录提示词、模型回复、执行的命令、退出码、耗时、目标主机与输出摘要；
+- 所有写操作进入队列，由后台线程批量提交，不阻塞 UI 线程；
+- 读操作（搜索 / 最近记录）使用独立的只读连接，WAL 下与写入互不阻塞；
+- 数据库在第一次使用时才打开，不影响启动速度。
+数据库路径：环境变量 HISTORY_DB，默认 ~/.yandao_os/history.db
+"""
+
+import hashlib
+import os
+import queue
+import re
+import sqlite3
+import threading
+import time
+import uuid
+
+from utils.output_compactor import compact_output
+
+HISTORY_DB = os.getenv("HISTORY_DB", os.path.join(os.path.expanduser("~"), ".yandao_os", "history.db"))
+FLUSH_INTERVAL = float(os.getenv("HISTORY_FLUSH_INTERVAL", "0.5"))
+BATCH_SIZE = 200
+PREVIEW_TOKENS = 120
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    id TEXT PRIMARY KEY,
+    started_at REAL,
+    label TEXT
+);
+CREATE TABLE IF NOT EXISTS turns (
+    id TEXT PRIMARY KEY,
+    session_id TEXT,
+    ts REAL,
+    provider TEXT,
+    system_type TEXT,
+    host TEXT,
+    prompt TEXT,
+    response TEXT,
+    action TEXT,
+    command TEXT,
+    decision TEXT,
+    exit_status INTEGER,
+    model_seconds REAL,
+    exec_seconds REAL,
+    output_sha256 TEXT,
+    output_size INTEGER,
+    output_preview TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_turns_session_ts ON turns(session_id, ts);
+CREATE INDEX IF NOT EXISTS idx_turns_ts ON turns(ts);
+"""
+
+_FTS_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS turns_fts USING fts5(
+    prompt, response, command, output_preview, content='turns', content_rowid='rowid'{tokenize}
+);
+CREATE TRIGGER IF NOT EXISTS turns_ai AFTER INSERT ON turns BEGIN
+    INSERT INTO turns_fts(rowid, prompt, response, command, output_preview)
+    VALUES (new.rowid, new.prompt, new.response, new.command, new.output_preview);
+END;
+CREATE TRIGGER IF NOT EXISTS turns_au AFTER UPDATE ON turns BEGIN
+    INSERT INTO turns_fts(turns_fts, rowid, prompt, response, command, output_preview)
+    VALUES ('delete', old.rowid, old.prompt, old.response, old.command, old.output_preview);
+    INSERT INTO turns_fts(rowid, prompt, response, command, output_preview)
+    VALUES (new.rowid, new.prompt, new.response, new.command, new.output_preview);
+END;
+CREATE TRIGGER IF NOT EXISTS turns_ad AFTER DELETE ON turns BEGIN
+    INSERT INTO turns_fts(turns_fts, rowid, prompt, response, command, output_preview)
+    VALUES ('delete', old.rowid, old.prompt, old.response, old.command, old.output_preview);
+END;
+"""
+
+_DROP_FTS = """
+DROP TRIGGER IF EXISTS turns_ai;
+DROP TRIGGER IF EXISTS turns_au;
+DROP TRIGGER IF EXISTS turns_ad;
+DROP TABLE IF EXISTS turns_fts;
+"""
+_TRIGRAM_MIN = 3   # trigram 分词下短于 3 个字符的词无法用 MATCH 查询
+_LIKE_COLUMNS = ("prompt", "response", "command", "output_preview")
+_CJK = re.compile(r"[\u3040-\u30ff\u3400-\u9fff\uac00-\ud7af]")
+
+
+def _connect(path: str) -> sqlite3.Connection:
+    conn = sqlite3.connect(path, timeout=10, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.row_factory = sqlite3.Row
+    return conn
+
+
+class HistoryStore:
+    """历史记录存储；写入异步批量提交，读取同步执行"""
+
+    def __init__(self, path: str = None):
+        self.path = path or HISTORY_DB
+        self._queue = queue.Queue()
+        self._started = False
+        self._start_lock = threading.Lock()
+        self._read_conn = None
+        self._read_lock = threading.Lock()
+        self.has_fts = False
+        self.fts_trigram = False   # trigram 分词可匹配中文子串；旧版 SQLite 退回默认分词
+        self._ready = threading.Event()
+
+    # ---------- 初始化（惰性） ----------
+    def _ensure_started(self):
+        if self._started:
+            return
+        with self._start_lock:
+            if self._started:
+                return
+            threading.Thread(target=self._writer_loop, name="history-writer", daemon=True).start()
+            self._started = True
+
+    def _init_db(self, conn: sqlite3.Connection):
+        conn.executescript(_SCHEMA)
+        row = conn.execute("SELECT sql FROM sqlite_master WHERE name = 'turns_fts'").fetchone()
+        rebuild = False
+        if row is not None and "trigram" not in row[0]:
+            # 旧库使用默认分词（无法匹配中文子串）：删掉索引，稍后按 trigram 重建
+            conn.executescript(_DROP_FTS)
+            rebuild = True
+        self.has_fts = self.fts_trigram = False
+        for tokenize in (", tokenize='trigram'", ""):
+            try:
+                conn.executescript(_FTS_SCHEMA.replace("{tokenize}", tokenize))
+                self.has_fts, self.fts_trigram = True, bool(tokenize)
+                break
+            except sqlite3.OperationalError:
+                # SQLite < 3.34 没有 trigram；部分编译版本不含 FTS5，退化为 LIKE 搜索
+                conn.executescript(_DROP_FTS)
+        if self.has_fts and (rebuild or row is None):
+            conn.execute("INSERT INTO turns_fts(turns_fts) VALUES ('rebuild')")
+        conn.commit()
+
+    def _writer_loop(self):
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            conn = _connect(self.path)
+            self._init_db(conn)
+        except Exception as e:
+            print(f"⚠️ 历史数据库初始化失败：{e}")
+            self._ready.set()
+            return
+        self._ready.set()
+        while True:
+            item = self._queue.get()
+            batch = [item]
+            deadline = time.monotonic() + FLUSH_INTERVAL
+            while len(batch) < BATCH_SIZE:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            flush_events = [ev for op, ev in batch if op == "flush"]
+            try:
+                # 显式 BEGIN：逐条的保存点嵌套在这一个事务里，整批只提交一次
+                with conn:
+                    conn.execute("BEGIN")
+                    for op, args in batch:
+                        if op != "flush":
+                            self._execute_one(conn, op, args)
+            except Exception as e:
+                print(f"⚠️ 历史记录写入失败：{e}")
+            for ev in flush_events:
+                ev.set()
+
+    @staticmethod
+    def _execute_one(conn: sqlite3.Connection, sql: str, args: tuple):
+        """在保存点内执行一条写入：失败时只回滚这一条，同批其他写入照常提交"""
+        conn.execute("SAVEPOINT history_row")
+        try:
+            conn.execute(sql, args)
+        except sqlite3.Error as e:
+            conn.execute("ROLLBACK TO history_row")
+            print(f"⚠️ 历史记录写入失败（已跳过该条）：{e}")
+        conn.execute("RELEASE history_row")
+
+    def _submit(self, sql: str, args: tuple):
+        self._ensure_started()
+        self._queue.put((sql, args))
+
+    def flush(self, timeout: float = 5.0) -> bool:
+        """等待队列中已有的写入落盘（测试 / 退出时使用）"""
+        self._ensure_started()
+        ev = threading.Event()
+        self._queue.put(("flush", ev))
+        return ev.wait(timeout)
+
+    # ---------- 写入接口（均为异步） ----------
+    def start_session(self, label: str = "", session_id: str = None) -> str:
+        session_id = session_id or uuid.uuid4().hex
+        self._submit("INSERT OR IGNORE INTO sessions(id, started_at, label) VALUES (?, ?, ?)",
+                     (session_id, time.time(), label))
+        return session_id
+
+    def record_prompt(self, session_id: str, prompt: str, provider: str = None,
+                      system_type: str = None, host: str = None) -> str:
+        """记录一次用户提问，返回 turn_id（后续用于补充回复与执行结果）"""
+        turn_id = uuid.uuid4().hex
+        self._submit("INSERT INTO turns(id, session_id, ts, provider, system_type, host, prompt) "
+                     "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                     (turn_id, session_id, time.time(), provider, system_type, host, prompt))
+        return turn_id
+
+    def record_response(self, turn_id: str, response: str, action: str = None, model_seconds: float = None):
+        self._submit("UPDATE turns SET response = ?, action = ?, model_seconds = ? WHERE id = ?",
+                     (response, action, model_seconds, turn_id))
+
+    def record_decision(self, turn_id: str, command: str, decision: str):
+        """记录用户对命令的确认结果（approved / rejected）"""
+        self._submit("UPDATE turns SET command = ?, decision = ? WHERE id = ?", (command, decision, turn_id))
+
+    def record_execution(self, turn_id: str, command: str, output: str, exit_status: int = None,
+                         exec_seconds: float = None):
+        output = output or ""
+        raw = output.encode("utf-8", errors="ignore")
+        self._submit("UPDATE turns SET command = ?, exit_status = ?, exec_seconds = ?, output_sha256 = ?, "
+                     "output_size = ?, output_preview = ? WHERE id = ?",
+                     (command, exit_status, exec_seconds, hashlib.sha256(raw).hexdigest(), len(raw),
+                      compact_output(output, PREVIEW_TOKENS), turn_id))
+
+    # ---------- 读取接口 ----------
+    def _reader(self) -> sqlite3.Connection:
+        self._ensure_started()
+        self._ready.wait(10)
+        if self._read_conn is None:
+            self._read_conn = _connect(self.path)
+        return self._read_conn
+
+    def search(self, text: str, limit: int = 50):
+        """全文搜索历史，按时间倒序返回 dict 列表"""
+        text = (text or "").strip()
+        if not text:
+            return self.recent(limit)
+        terms = text.split()
+        with self._read_lock:
+            conn = self._reader()
+            # trigram 分词下短词（如“日志”）无法 MATCH；默认分词下中文无法匹配子串：这些情况直接走 LIKE
+            use_fts = self.has_fts and (all(len(t) >= _TRIGRAM_MIN for t in terms) if self.fts_trigram
+                                        else not _CJK.search(text))
+            if use_fts:
+                # 每个词作为短语匹配，避免用户输入中的 FTS 语法字符报错
+                query = " ".join('"' + t.replace('"', '""') + '"' for t in terms)
+                try:
+                    rows = conn.execute(
+                        "SELECT t.* FROM turns_fts f JOIN turns t ON t.rowid = f.rowid "
+                        "WHERE turns_fts MATCH ? ORDER BY t.ts DESC LIMIT ?", (query, limit)).fetchall()
+                    if rows:
+                        return [dict(r) for r in rows]
+                except sqlite3.OperationalError:
+                    pass
+            # 每个词都须出现在某一列中（与 FTS 的多词语义一致）
+            where, args = [], []
+            for t in terms:
+                like = "%" + t.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+                where.append("(" + " OR ".join(f"{c} LIKE ? ESCAPE '\\'" for c in _LIKE_COLUMNS) + ")")
+                args.extend([like] * len(_LIKE_COLUMNS))
+            rows = conn.execute(f"SELECT * FROM turns WHERE {' AND '.join(where)} ORDER BY ts DESC LIMIT ?",
+                                (*args, limit)).fetchall()
+            return [dict(r) for r in rows]
+
+    def recent(self, limit: int = 50, session_id: str = None):
+        with self._read_lock:
+            conn = self._reader()
+            if session_id:
+                rows = conn.execute("SELECT * FROM turns WHERE session_id = ? ORDER BY ts DESC LIMIT ?",
+                                    (session_id, limit)).fetchall()
+            else:
+                rows = conn.execute("SELECT * FROM turns ORDER BY ts DESC LIMIT ?", (limit,)).fetchall()
+            return [dict(r) for r in rows]
+
+    def successful_commands(self, limit: int = 5000):
+        """
+        返回已批准且执行成功的 (prompt, command, system_type)，按时间正序。
+        远端执行没有退出码，此时以输出不是错误提示为准。
+        """
+        with self._read_lock:
+            conn = self._reader()
+            rows = conn.execute(
+                "SELECT prompt, command, system_type FROM turns "
+                "WHERE action = 'execute' AND decision = 'approved' AND command IS NOT NULL "
+                "AND (exit_status = 0 OR (exit_status IS NULL AND output_preview NOT LIKE '❌%' "
+                "AND output_preview NOT LIKE '⚠️%')) ORDER BY ts DESC LIMIT ?", (limit,)).fetchall()
+            return [tuple(r) for r in reversed(rows)]
+
+    def recent_sessions(self, limit: int = 20):
+        with self._read_lock:
+            conn = self._reader()
+            rows = conn.execute(
+                "SELECT s.id, s.started_at, s.label, COUNT(t.id) AS turns FROM sessions s "
+                "LEFT JOIN turns t ON t.session_id = s.id GROUP BY s.id ORDER BY s.started_at DESC LIMIT ?",
+                (limit,)).fetchall()
+            return [dict(r) for r in rows]
+
+
+_default_store = None
+_default_lock = threading.Lock()
+
+
+def get_store() -> HistoryStore:
+    """进程内共享的默认历史存储"""
+    global _default_store
+    with _default_lock:
+        if _default_store is None:
+            _default_store = HistoryStore()
+        return _default_store
@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+metrics.py
+轻量级指标采集（计数器 + 直方图），无第三方依赖。
+
+功能说明：
+- 各模块通过 observe()/inc()/timer() 记录耗时与次数；
+- render_prometheus() 输出 Prometheus 文本格式；
+- 无界面运行时可通过环境变量开启导出：
+    METRICS_PORT=9108        在本机启动 /metrics HTTP 端点
+    METRICS_FILE=metrics.prom 定期把指标写入文件
+- GUI 通过 latency_summary() 在状态栏显示实时延迟。
+"""
+
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Tuple
+
+# 默认桶（秒），覆盖从毫秒级安全检查到分钟级模型调用
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_lock = threading.Lock()
+_counters: Dict[Tuple[str, tuple], float] = {}
+_histograms: Dict[Tuple[str, tuple], "Histogram"] = {}
+_help: Dict[str, str] = {}
+_last: Dict[str, float] = {}   # 每个指标最近一次观测值（供 GUI 显示）
+
+
+class Histogram:
+    """累积直方图（与 Prometheus histogram 语义一致）"""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * len(self.buckets)
+        self.total = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.total += 1
+        self.sum += value
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+
+    def quantile(self, q: float) -> float:
+        """按桶上界估算分位数（仅用于展示）"""
+        if not self.total:
+            return 0.0
+        target = q * self.total
+        for bound, cnt in zip(self.buckets, self.counts):
+            if cnt >= target:
+                return bound
+        return float("inf")
+
+
+def _key(name: str, labels: dict) -> Tuple[str, tuple]:
+    return name, tuple(sorted((labels or {}).items()))
+
+
+def describe(name: str, help_text: str):
+    """为指标登记说明文字（可选）"""
+    _help[name] = help_text
+
+
+def inc(name: str, value: float = 1.0, **labels):
+    """计数器加一（或加 value）"""
+    k = _key(name, labels)
+    with _lock:
+        _counters[k] = _counters.get(k, 0.0) + value
+
+
+def observe(name: str, value: float, **labels):
+    """记录一次直方图观测值"""
+    k = _key(name, labels)
+    with _lock:
+        hist = _histograms.get(k)
+        if hist is None:
+            hist = _histograms[k] = Histogram()
+        hist.observe(value)
+        _last[name] = value
+
+
+@contextmanager
+def timer(name: str, **labels):
+    """with timer("xxx_seconds"): ... 记录代码块耗时"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - start, **labels)
+
+
+def last_value(name: str, default: float = None):
+    return _last.get(name, default)
+
+
+def reset():
+    """清空全部指标（测试 / 基准用）"""
+    with _lock:
+        _counters.clear()
+        _histograms.clear()
+        _last.clear()
+
+
+def _fmt_labels(labels: tuple, extra: tuple = ()) -> str:
+    items = list(labels) + list(extra)
+    if not items:
+        return ""
+    inner = ",".join('{}="{}"'.format(k, str(v).replace("\\", "\\\\").replace('"', '\\"')) for k, v in items)
+    return "{" + inner + "}"
+
+
+def render_prometheus() -> str:
+    """导出 Prometheus 文本格式"""
+    lines = []
+    with _lock:
+        counters = sorted(_counters.items())
+        hists = sorted((k, (h.buckets, list(h.counts), h.total, h.sum)) for k, h in _histograms.items())
+
+    seen = set()
+    for (name, labels), value in counters:
+        if name not in seen:
+            seen.add(name)
+            if name in _help:
+                lines.append(f"# HELP {name} {_help[name]}")
+            lines.append(f"# TYPE {name} counter")
+        lines.append(f"{name}{_fmt_labels(labels)} {value:g}")
+
+    for (name, labels), (buckets, counts, total, total_sum) in hists:
+        if name not in seen:
+            seen.add(name)
+            if name in _help:
+                lines.append(f"# HELP {name} {_help[name]}")
+            lines.append(f"# TYPE {name} histogram")
+        for bound, cnt in zip(buckets, counts):
+            lines.append(f"{name}_bucket{_fmt_labels(labels, (('le', f'{bound:g}'),))} {cnt}")
+        lines.append(f"{name}_bucket{_fmt_labels(labels, (('le', '+Inf'),))} {total}")
+        lines.append(f"{name}_sum{_fmt_labels(labels)} {total_sum:.6f}")
+        lines.append(f"{name}_count{_fmt_labels(labels)} {total}")
+    return "\n".join(lines) + "\n"
+
+
+def latency_summary() -> str:
+    """状态栏用的简短延迟摘要"""
+    parts = []
+    for label, name in (("模型", "model_turn_seconds"),
+                        ("首字", "llm_time_to_first_token_seconds"),
+                        ("执行", "command_exec_seconds"),
+                        ("SSH", "ssh_exec_seconds")):
+        v = _last.get(name)
+        if v is not None:
+            parts.append(f"{label} {v * 1000:.0f}ms" if v < 1 else f"{label} {v:.2f}s")
+    tps = _last.get("llm_tokens_per_second")
+    if tps:
+        parts.append(f"{tps:.1f} tok/s")
+    return " | ".join(parts) if parts else "暂无延迟数据"
+
+
+# ========= 导出：HTTP 端点 / 文件 =========
+_exporter_started = False
+
+
+def write_metrics_file(path: str):
+    """原子写入指标文件（先写临时文件再替换）"""
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(render_prometheus())
+    os.replace(tmp, path)
+
+
+def _serve_http(port: int):
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class _Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.rstrip("/") not in ("", "/metrics"):
+                self.send_response(404)
+                self.end_headers()
+                return
+            body = render_prometheus().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", port), _Handler)
+    server.serve_forever()
+
+
+def _file_loop(path: str, interval: float):
+    while True:
+        try:
+            write_metrics_file(path)
+        except Exception:
+            pass
+        time.sleep(interval)
+
+
+def start_exporter(port: int = None, path: str = None, interval: float = 5.0) -> bool:
+    """
+    启动指标导出（幂等）。参数缺省时读取 METRICS_PORT / METRICS_FILE。
+    返回是否启动了任何导出器。
+    """
+    global _exporter_started
+    if _exporter_started:
+        return True
+    port = port or int(os.getenv("METRICS_PORT", "0") or 0)
+    path = path or os.getenv("METRICS_FILE", "")
+    if port:
+        threading.Thread(target=_serve_http, args=(port,), daemon=True).start()
+        _exporter_started = True
+    if path:
+        threading.Thread(target=_file_loop, args=(path, interval), daemon=True).start()
+        _exporter_started = True
+    return _exporter_started
+
+
+describe("llm_prompt_build_seconds", "构造请求消息耗时")
+describe("llm_http_seconds", "模型 HTTP 往返耗时")
+describe("llm_time_to_first_token_seconds", "收到响应头（首字）耗时")
+describe("llm_tokens_per_second", "生成吞吐（completion tokens / 秒）")
+describe("llm_parse_seconds", "模型响应解析耗时")
+describe("llm_requests_total", "模型请求次数")
+describe("model_turn_seconds", "一次模型调用（工作线程内）总耗时")
+describe("response_dispatch_seconds", "on_model_response 解析分发耗时")
+describe("safety_check_seconds", "命令安全检查耗时")
+describe("command_exec_seconds", "本地命令执行耗时")
+describe("commands_total", "执行命令次数")
+describe("ssh_connect_seconds", "SSH 建连耗时")
+describe("ssh_exec_seconds", "远程命令执行耗时")
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+model_router.py
+按请求复杂度自动选择模型：简单的问答 / 单条命令走小而快的模型，脚本生成走大模型。
+
+分类只用本地的廉价特征（长度、关键词、多步骤连接词、代码痕迹），耗时在微秒级；
+路由表见 utils/routes/model_routes.txt（可用 MODEL_ROUTES_FILE 覆盖），
+每次决策连同分类耗时写入日志与指标。
+"""
+
+import os
+import re
+import threading
+import time
+from typing import Dict, NamedTuple
+
+from utils import metrics
+from utils.output_compactor import estimate_tokens
+
+MODEL_ROUTING = os.getenv("MODEL_ROUTING", "1").lower() not in ("0", "false", "no", "off")
+ROUTES_FILE = os.getenv("MODEL_ROUTES_FILE",
+                        os.path.join(os.path.dirname(__file__), "routes", "model_routes.txt"))
+TIERS = ("simple", "script")
+
+_SCRIPT_WORDS = ("脚本", "script", "写一个", "写个", "编写", "程序", "函数", "自动化", "批量", "定时",
+                 "cron", "轮转", "rotate", "监控", "守护", "daemon", ".py", ".sh", ".ps1",
+                 "循环", "遍历")
+_STEP_WORDS = ("然后", "并且", "同时", "如果", "否则", "每隔", "之后", "接着", "最后", "并把",
+               " then ", " and then ", " if ", " every ")
+_QUESTION_WORDS = ("什么", "为什么", "是否", "解释", "区别", "几点", "what", "why", "explain", "difference")
+_CODE_MARK = re.compile(r"```|[{};]\s*$|\bdef |\bfor .+ in |\$\(", re.M)
+
+
+class RouteDecision(NamedTuple):
+    tier: str
+    model: str          # "*" 表示沿用已配置的模型
+    score: float
+    seconds: float
+
+
+def features(prompt: str) -> Dict[str, float]:
+    text = (prompt or "").lower()
+    return {
+        "tokens": estimate_tokens(text),
+        "script_words": sum(1 for w in _SCRIPT_WORDS if w in text),
+        "step_words": sum(1 for w in _STEP_WORDS if w in text),
+        "question_words": sum(1 for w in _QUESTION_WORDS if w in text),
+        "code": 1 if _CODE_MARK.search(prompt or "") else 0,
+        "lines": (prompt or "").count("\n") + 1,
+    }
+
+
+def score(feats: Dict[str, float]) -> float:
+    """越高越可能需要生成脚本；>= 1 判为 script 档"""
+    s = 0.8 * feats["script_words"] + 0.3 * feats["step_words"] + 0.5 * feats["code"]
+    s += min(feats["tokens"] / 120.0, 0.6) + 0.1 * max(feats["lines"] - 1, 0)
+    s -= 0.5 * feats["question_words"]
+    return s
+
+
+def classify(prompt: str) -> str:
+    return "script" if score(features(prompt)) >= 1.0 else "simple"
+
+
+def _load_routes(path: str) -> Dict[tuple, str]:
+    routes = {}
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line or line.startswith("#"):
+                    continue
+                parts = line.split()
+                if len(parts) >= 3 and parts[1] in TIERS:
+                    routes[(parts[0].lower(), parts[1])] = parts[2]
+    except FileNotFoundError:
+        pass
+    return routes
+
+
+_routes = None
+_routes_lock = threading.Lock()
+
+
+def get_routes() -> Dict[tuple, str]:
+    global _routes
+    with _routes_lock:
+        if _routes is None:
+            _routes = _load_routes(ROUTES_FILE)
+        return _routes
+
+
+def route(prompt: str, provider: str) -> RouteDecision:
+    """为一次请求选择模型；未启用或路由表无对应项时 model 为 "*" """
+    t0 = time.perf_counter()
+    s = score(features(prompt))
+    tier = "script" if s >= 1.0 else "simple"
+    model = get_routes().get((provider, tier), "*") if MODEL_ROUTING else "*"
+    elapsed = time.perf_counter() - t0
+    metrics.observe("model_route_seconds", elapsed)
+    metrics.inc("model_routes_total", provider=provider, tier=tier, model=model)
+    print(f"🧭 模型路由：provider={provider} tier={tier} score={s:.2f} model={model} ({elapsed * 1000:.2f} ms)")
+    return RouteDecision(tier, model, s, elapsed)
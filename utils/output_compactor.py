@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+output_compactor.py
+命令输出压缩器：把执行结果压成适合放进对话上下文的短文本。
+
+压缩步骤：
+1. 去掉 ANSI 颜色码与行尾空白，折叠连续重复行；
+2. 识别表格输出（ls -l / df / ps 等），把对齐用的空白压成单个空格，
+   并把所有行取值相同的列提出来只写一次；
+3. 仍超出 token 预算时保留开头和结尾，省略中间部分。
+"""
+
+import re
+
+DEFAULT_MAX_TOKENS = 400
+_ANSI = re.compile(r"\x1b\[[0-9;]*[A-Za-z]")
+_CJK = re.compile(r"[　-鿿가-힯＀-￯]")
+
+
+def estimate_tokens(text: str) -> int:
+    """粗略估算 token 数：中日韩字符按 1 个，其余按 4 字符 1 个"""
+    cjk = len(_CJK.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def collapse_repeats(lines):
+    """折叠连续重复行"""
+    out, prev, count = [], None, 0
+    for line in lines:
+        if line == prev:
+            count += 1
+            continue
+        if count > 1:
+            out.append(f"  …（上一行重复 {count - 1} 次）")
+        out.append(line)
+        prev, count = line, 1
+    if count > 1:
+        out.append(f"  …（上一行重复 {count - 1} 次）")
+    return out
+
+
+def _is_table(lines) -> int:
+    """若多数行字段数不少于同一列数（≥2）则视为表格，返回列数，否则返回 0"""
+    rows = [ln.split() for ln in lines if ln.strip()]
+    if len(rows) < 3:
+        return 0
+    counts = {}
+    for r in rows:
+        counts[len(r)] = counts.get(len(r), 0) + 1
+    # 取出现最多的字段数；最后一列可能含空格，因此字段更多的行也算入
+    ncols = max(counts.items(), key=lambda kv: (kv[1], -kv[0]))[0]
+    covered = sum(1 for r in rows if len(r) >= ncols)
+    return ncols if ncols >= 2 and covered >= 0.7 * len(rows) else 0
+
+
+def compact_table(lines):
+    """压缩表格：单空格分隔，恒定列只保留一次"""
+    ncols = _is_table(lines)
+    if not ncols:
+        return lines
+    # 最后一列允许包含空格（例如文件名）
+    rows = [ln.split(None, ncols - 1) for ln in lines if ln.strip()]
+    data = [r for r in rows if len(r) == ncols]
+    constant = []
+    if len(data) >= 3:
+        for c in range(ncols - 1):
+            values = {r[c] for r in data}
+            if len(values) == 1:
+                constant.append(c)
+    out = []
+    if constant:
+        shared = ", ".join(f"第{c + 1}列={data[0][c]}" for c in constant)
+        out.append(f"[以下各行相同字段已省略：{shared}]")
+    for r in rows:
+        if len(r) == ncols:
+            r = [v for i, v in enumerate(r) if i not in constant]
+        out.append(" ".join(r))
+    return out
+
+
+def clip_line(line: str, max_tokens: int) -> str:
+    """按估算 token 数截断单行（中日韩字符按 1 个计，其余 4 字符 1 个）"""
+    if estimate_tokens(line) <= max_tokens:
+        return line
+    limit = max(max_tokens - 12, 1) * 4   # 为截断说明留出约 12 个 token
+    used = 0
+    for i, ch in enumerate(line):
+        used += 4 if _CJK.match(ch) else 1
+        if used > limit:
+            return line[:i] + f" …（截断，共 {len(line)} 字符）"
+    return line
+
+
+def truncate_middle(lines, max_tokens: int):
+    """保留首尾、省略中间，使总 token 数不超过预算"""
+    total = sum(estimate_tokens(ln) + 1 for ln in lines)
+    if total <= max_tokens:
+        return lines
+    budget = max(max_tokens - 16, 8)
+    # 超长行先按 token 截断，避免一行独占预算而把其他行全部挤掉
+    per_line = budget if len(lines) == 1 else max(budget // 3, 8)
+    lines = [clip_line(ln, per_line) for ln in lines]
+    if sum(estimate_tokens(ln) + 1 for ln in lines) <= max_tokens:
+        return lines
+    head_budget = budget * 2 // 3
+    head, used = [], 0
+    for ln in lines:
+        t = estimate_tokens(ln) + 1
+        if used + t > head_budget:
+            break
+        head.append(ln)
+        used += t
+    tail, used_tail = [], 0
+    for ln in reversed(lines[len(head):]):
+        t = estimate_tokens(ln) + 1
+        if used + used_tail + t > budget:
+            break
+        tail.append(ln)
+        used_tail += t
+    tail.reverse()
+    omitted = len(lines) - len(head) - len(tail)
+    if not head and not tail and lines:
+        return [clip_line(lines[0], budget)]
+    return head + [f"…（省略 {omitted} 行）…"] + tail
+
+
+def compact_output(text: str, max_tokens: int = DEFAULT_MAX_TOKENS) -> str:
+    """压缩命令输出，保证结果的估算 token 数不超过 max_tokens"""
+    if not text:
+        return ""
+    text = _ANSI.sub("", text)
+    lines = [ln.rstrip() for ln in text.replace("\r\n", "\n").split("\n")]
+    while lines and not lines[-1]:
+        lines.pop()
+    lines = collapse_repeats(lines)
+    lines = compact_table(lines)
+    lines = truncate_middle(lines, max_tokens)
+    return "\n".join(lines)
+
+
+def format_execution_feedback(command: str, output: str, exit_code=None,
+                              max_tokens: int = DEFAULT_MAX_TOKENS) -> str:
+    """生成写入对话上下文的执行结果文本"""
+    status = "" if exit_code is None else f"（退出码 {exit_code}）"
+    body = compact_output(output, max_tokens) or "（无输出）"
+    return f"[执行结果]{status}\n$ {command}\n{body}"
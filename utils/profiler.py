@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+profiler.py
+可选的性能分析钩子（cProfile + tracemalloc）。
+
+功能说明：
+- 环境变量 YANDAO_PROFILE=1 或 GUI 勾选“性能分析”时启用；
+- 被 @profiled 装饰的函数每次调用都会写出一个 .prof 文件和内存分配摘要；
+- 同时维护滚动的热点函数汇总 summary.txt（最近 PROFILE_KEEP 次调用）；
+- 未启用时装饰器只多一次布尔判断，开销可忽略。
+"""
+
+import cProfile
+import functools
+import io
+import itertools
+import os
+import pstats
+import threading
+import time
+import tracemalloc
+from collections import deque
+
+PROFILE_DIR = os.getenv("YANDAO_PROFILE_DIR", os.path.join(os.getcwd(), "profiles"))
+PROFILE_TOP_N = int(os.getenv("YANDAO_PROFILE_TOP", "25"))
+PROFILE_KEEP = int(os.getenv("YANDAO_PROFILE_KEEP", "20"))
+
+_enabled = os.getenv("YANDAO_PROFILE", "0").lower() in ("1", "true", "yes", "on")
+_seq = itertools.count(1)
+_recent = deque(maxlen=PROFILE_KEEP)   # 最近若干个 .prof 文件路径
+_summary_lock = threading.Lock()
+
+
+def is_enabled() -> bool:
+    return _enabled
+
+
+def set_enabled(flag: bool):
+    """运行时开关（GUI 使用）；关闭时停止 tracemalloc 以释放开销"""
+    global _enabled
+    _enabled = bool(flag)
+    if not _enabled and tracemalloc.is_tracing():
+        tracemalloc.stop()
+
+
+def _write_memory_report(path: str, before, after):
+    stats = after.compare_to(before, "lineno")
+    with open(path, "w", encoding="utf-8") as f:
+        current, peak = tracemalloc.get_traced_memory()
+        f.write(f"# tracemalloc current={current} peak={peak}\n")
+        for stat in stats[:PROFILE_TOP_N]:
+            f.write(f"{stat}\n")
+
+
+def _update_summary():
+    """将最近若干次 profile 合并，输出按累计耗时排序的热点函数"""
+    with _summary_lock:
+        files = [p for p in _recent if os.path.exists(p)]
+        if not files:
+            return
+        buf = io.StringIO()
+        stats = pstats.Stats(files[0], stream=buf)
+        for p in files[1:]:
+            stats.add(p)
+        buf.write(f"# 最近 {len(files)} 次调用的热点函数（按 cumulative 排序）\n")
+        stats.sort_stats("cumulative").print_stats(PROFILE_TOP_N)
+        tmp = os.path.join(PROFILE_DIR, "summary.txt.tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(buf.getvalue())
+        os.replace(tmp, os.path.join(PROFILE_DIR, "summary.txt"))
+
+
+def _run_profiled(name: str, func, args, kwargs):
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    if not tracemalloc.is_tracing():
+        tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    prof = cProfile.Profile()
+    try:
+        prof.enable()
+    except ValueError:
+        # 其它线程已有活动的 profiler（Python 3.12+ 限制），本次不采样
+        return func(*args, **kwargs)
+    try:
+        return func(*args, **kwargs)
+    finally:
+        prof.disable()
+        stem = f"{name}-{time.strftime('%Y%m%d-%H%M%S')}-{next(_seq)}"
+        prof_path = os.path.join(PROFILE_DIR, stem + ".prof")
+        try:
+            prof.dump_stats(prof_path)
+            if tracemalloc.is_tracing():
+                _write_memory_report(os.path.join(PROFILE_DIR, stem + ".mem.txt"),
+                                     before, tracemalloc.take_snapshot())
+            _recent.append(prof_path)
+            _update_summary()
+        except Exception as e:
+            print(f"⚠️ 写入性能分析结果失败：{e}")
+
+
+def profiled(name: str = None):
+    """装饰器：启用时对被装饰函数做 cProfile + tracemalloc 采样"""
+    def decorator(func):
+        label = name or func.__qualname__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return func(*args, **kwargs)
+            return _run_profiled(label, func, args, kwargs)
+        return wrapper
+    return decorator
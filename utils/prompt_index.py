@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+prompt_index.py
+历史提示词相似度索引（字符 n-gram TF-IDF + 余弦相似度，NumPy 向量化打分）。
+
+功能说明：
+- 收录执行成功的 (提示词, 命令, 系统类型)，增量构建，不需要重建整个索引；
+- 与历史中某条提示词几乎相同、且其中的数字 / 路径 / 文件名 / 引号内容完全一致时，
+  直接给出该命令作为建议（无需调用大模型）；只差一个操作数（PID、路径）时只作 few-shot 示例；
+- 否则返回最相似的 top-k 条，作为 few-shot 示例注入请求消息。
+首次使用时从 history_store 中的成功记录预热。
+"""
+
+import math
+import os
+import re
+import threading
+from collections import Counter
+
+try:
+    import numpy as np
+except Exception:   # numpy 不可用时索引自动停用
+    np = None
+
+PROMPT_INDEX_ENABLED = os.getenv("PROMPT_INDEX", "1").lower() not in ("0", "false", "no", "off")
+SERVE_THRESHOLD = float(os.getenv("PROMPT_INDEX_SERVE", "0.92"))
+HINT_THRESHOLD = float(os.getenv("PROMPT_INDEX_HINT", "0.35"))
+TOP_K = int(os.getenv("PROMPT_INDEX_TOPK", "3"))
+NGRAM_RANGE = (2, 3)
+
+# 操作数：引号内容、路径、带扩展名的文件名、数字（含 IP / 版本号）
+_OPERAND = re.compile(
+    r"\"[^\"]*\"|'[^']*'|“[^”]*”|‘[^’]*’"
+    r"|[A-Za-z]:\\[^\s，。]*|(?:~|\.{1,2})?/[^\s，。]*"
+    r"|[\w-]+(?:\.[A-Za-z][A-Za-z0-9]{0,5})+\b"
+    r"|\d+(?:[.:]\d+)*"
+)
+_PUNCT = re.compile(r"[\s，。！？、,.!?;；:：'\"“”‘’（）()\[\]【】]+")
+
+
+def normalize(text: str) -> str:
+    return _PUNCT.sub(" ", (text or "").lower()).strip()
+
+
+def operands(text: str) -> list:
+    """提示词中的操作数（排序后的列表），用于判断两条相似提示词是否指向同一对象"""
+    return sorted(m.group(0) for m in _OPERAND.finditer(text or ""))
+
+
+def char_ngrams(text: str, ngram_range=NGRAM_RANGE) -> Counter:
+    """字符 n-gram（两端补空格，词边界也能参与匹配）"""
+    s = f" {normalize(text)} "
+    grams = Counter()
+    for n in range(ngram_range[0], ngram_range[1] + 1):
+        for i in range(len(s) - n + 1):
+            grams[s[i:i + n]] += 1
+    return grams
+
+
+class PromptIndex:
+    """
+    以 COO 三元组 (doc, term, tf) 存储稀疏矩阵。新增文档只追加三元组；
+    查询时按当前 IDF 一次性向量化计算所有文档的余弦相似度。
+    """
+
+    def __init__(self):
+        self.entries = []          # [(prompt, command, system_type)]
+        self._keys = set()         # 去重
+        self.vocab = {}            # n-gram -> term id
+        self.df = []               # term id -> 文档频次
+        self._docs, self._terms, self._tfs = [], [], []
+        self._arrays = None        # 缓存的 numpy 数组（新增文档后失效）
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def add(self, prompt: str, command: str, system_type: str = None) -> bool:
+        """收录一条成功记录；重复记录忽略。返回是否新增"""
+        key = (normalize(prompt), command.strip(), (system_type or "").lower())
+        if not key[0] or not key[1]:
+            return False
+        with self._lock:
+            if key in self._keys:
+                return False
+            self._keys.add(key)
+            doc = len(self.entries)
+            self.entries.append((prompt, command.strip(), system_type))
+            for gram, tf in char_ngrams(prompt).items():
+                tid = self.vocab.get(gram)
+                if tid is None:
+                    tid = self.vocab[gram] = len(self.df)
+                    self.df.append(0)
+                self.df[tid] += 1
+                self._docs.append(doc)
+                self._terms.append(tid)
+                self._tfs.append(tf)
+            self._arrays = None
+            return True
+
+    def _matrix(self):
+        if self._arrays is None:
+            self._arrays = (np.asarray(self._docs, dtype=np.int64),
+                            np.asarray(self._terms, dtype=np.int64),
+                            np.asarray(self._tfs, dtype=np.float64))
+        return self._arrays
+
+    def query(self, prompt: str, system_type: str = None, k: int = TOP_K):
+        """返回 [(score, prompt, command, system_type)]，按相似度降序"""
+        if np is None:
+            return []
+        qgrams = char_ngrams(prompt)
+        with self._lock:
+            n_docs = len(self.entries)
+            if not n_docs or not qgrams:
+                return []
+            docs, terms, tfs = self._matrix()
+            df = np.asarray(self.df, dtype=np.float64)
+            idf = np.log((1.0 + n_docs) / (1.0 + df)) + 1.0
+
+            # 文档向量范数（随 IDF 变化，直接向量化重算）
+            weights = tfs * idf[terms]
+            norms = np.sqrt(np.bincount(docs, weights=weights * weights, minlength=n_docs))
+
+            # 查询向量（只保留索引中出现过的 n-gram）
+            q_ids, q_tf = [], []
+            for gram, tf in qgrams.items():
+                tid = self.vocab.get(gram)
+                if tid is not None:
+                    q_ids.append(tid)
+                    q_tf.append(tf)
+            if not q_ids:
+                return []
+            q_ids = np.asarray(q_ids, dtype=np.int64)
+            q_weights = np.zeros(len(df))
+            q_weights[q_ids] = np.asarray(q_tf, dtype=np.float64) * idf[q_ids]
+            # 未登录 n-gram 也计入查询范数（按最大 IDF 计）
+            oov = sum(tf * tf for gram, tf in qgrams.items() if gram not in self.vocab)
+            q_norm = math.sqrt(float(np.dot(q_weights, q_weights)) + oov * (math.log(1.0 + n_docs) + 1.0) ** 2)
+
+            dots = np.bincount(docs, weights=weights * q_weights[terms], minlength=n_docs)
+            scores = dots / np.maximum(norms * q_norm, 1e-12)
+
+            if system_type:
+                wanted = system_type.lower()
+                mask = np.fromiter(((e[2] or "").lower() == wanted for e in self.entries), dtype=bool, count=n_docs)
+                scores = np.where(mask, scores, -1.0)
+
+            k = min(k, n_docs)
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top])]
+            return [(float(scores[i]), *self.entries[i]) for i in top if scores[i] > 0]
+
+
+def format_examples(matches) -> str:
+    """将相似记录格式化为 few-shot 提示"""
+    lines = ["以下是历史上执行成功的相似请求，仅供参考（若不适用请忽略）："]
+    for _, prompt, command, _ in matches:
+        lines.append(f"用户：{prompt}\nEXECUTE: 参考命令\n{command}")
+    return "\n\n".join(lines)
+
+
+# ========= 进程内共享索引 =========
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_index():
+    """获取共享索引；首次调用时从历史库中预热。numpy 不可用或已关闭时返回 None"""
+    global _index
+    if np is None or not PROMPT_INDEX_ENABLED:
+        return None
+    with _index_lock:
+        if _index is None:
+            _index = PromptIndex()
+            try:
+                from utils.history_store import get_store
+                for prompt, command, system_type in get_store().successful_commands():
+                    _index.add(prompt, command, system_type)
+            except Exception as e:
+                print(f"⚠️ 相似度索引预热失败：{e}")
+        return _index
+
+
+def lookup(prompt: str, system_type: str = None):
+    """
+    查询相似历史。返回 (served, examples)：
+    - served：相似度超过 SERVE_THRESHOLD 且操作数完全一致的最佳匹配（可直接建议），否则 None；
+    - examples：相似度超过 HINT_THRESHOLD 的 top-k，用作 few-shot。
+    """
+    index = get_index()
+    if index is None:
+        return None, []
+    matches = index.query(prompt, system_type)
+    if matches and matches[0][0] >= SERVE_THRESHOLD and operands(matches[0][1]) == operands(prompt):
+        return matches[0], matches
+    return None, [m for m in matches if m[0] >= HINT_THRESHOLD]
+
+
+def add_async(prompt: str, command: str, system_type: str = None):
+    """在后台线程收录一条成功记录（首次使用时的预热要读历史库，不能放在界面线程）"""
+    def work():
+        index = get_index()
+        if index is not None:
+            index.add(prompt, command, system_type)
+    threading.Thread(target=work, name="prompt-index-add", daemon=True).start()
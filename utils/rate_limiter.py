@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+rate_limiter.py
+客户端限流：按 (api_base, api_key) 共享的令牌桶，同时限制每分钟请求数与每分钟 token 数。
+
+功能说明：
+- 超出额度的请求不直接发出（避免 429 后所有人一起失败），而是在本进程内排队；
+- 排队按会话公平轮转：每个会话各自先进先出，会话之间轮流放行，
+  一个会话的突发请求不会饿死其他会话；
+- 等待期间回调当前排位与预计等待时间，供界面显示；
+- 请求结束后按实际 usage 多退少补；收到 429 时按 Retry-After 暂停整个 key 的发送。
+额度通过环境变量 API_RPM / API_TPM 配置，0 表示不限制。
+"""
+
+import hashlib
+import itertools
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+
+from utils import metrics
+
+API_RPM = float(os.getenv("API_RPM", "0"))
+API_TPM = float(os.getenv("API_TPM", "0"))
+
+
+class TokenBucket:
+    """容量为每分钟额度、按秒匀速回填的令牌桶；capacity <= 0 表示不限制"""
+
+    def __init__(self, per_minute: float):
+        self.capacity = float(per_minute)
+        self.rate = self.capacity / 60.0
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    @property
+    def unlimited(self) -> bool:
+        return self.capacity <= 0
+
+    def _refill(self, now: float):
+        if self.unlimited:
+            return
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def clamp(self, cost: float) -> float:
+        """单次消耗不超过桶容量，否则永远无法放行"""
+        return cost if self.unlimited else min(cost, self.capacity)
+
+    def wait_time(self, cost: float, now: float) -> float:
+        """还需等待多久才能取出 cost 个令牌"""
+        if self.unlimited:
+            return 0.0
+        self._refill(now)
+        missing = self.clamp(cost) - self.level
+        return max(missing / self.rate, 0.0)
+
+    def take(self, cost: float, now: float):
+        if not self.unlimited:
+            self._refill(now)
+            self.level -= self.clamp(cost)
+
+    def give(self, amount: float):
+        """正数退还、负数补扣（允许透支，之后的请求相应多等）"""
+        if not self.unlimited:
+            self.level = min(self.capacity, self.level + amount)
+
+
+class Ticket:
+    __slots__ = ("session", "cost", "granted", "waited", "seq")
+
+    def __init__(self, session: str, cost: float, seq: int):
+        self.session = session
+        self.cost = cost
+        self.granted = False
+        self.waited = 0.0
+        self.seq = seq
+
+
+class RateLimiter:
+    """一个 API key 的请求 / token 额度与公平排队"""
+
+    def __init__(self, rpm: float = API_RPM, tpm: float = API_TPM):
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self._cond = threading.Condition()
+        self._queues = OrderedDict()   # session -> deque[Ticket]；顺序即轮转顺序
+        self._paused_until = 0.0
+        self._seq = itertools.count()
+
+    @property
+    def unlimited(self) -> bool:
+        return self.requests.unlimited and self.tokens.unlimited
+
+    # ----- 排队顺序 -----
+    def _service_order(self):
+        """按轮转规则展开的放行顺序：各会话队首依次、再各会话第二个……"""
+        queues = [list(q) for q in self._queues.values()]
+        order = []
+        for depth in range(max((len(q) for q in queues), default=0)):
+            order.extend(q[depth] for q in queues if depth < len(q))
+        return order
+
+    def _head(self):
+        return next(iter(self._queues.values()))[0] if self._queues else None
+
+    def _eta(self, ticket: Ticket, now: float) -> float:
+        """预计等待：排在前面的请求（含自身）需要的额度 / 回填速度"""
+        ahead = self._service_order()
+        idx = ahead.index(ticket)
+        need_req = idx + 1
+        need_tok = sum(t.cost for t in ahead[:idx + 1])
+        eta = max(self._paused_until - now, 0.0)
+        if not self.requests.unlimited:
+            self.requests._refill(now)
+            eta = max(eta, (need_req - self.requests.level) / self.requests.rate)
+        if not self.tokens.unlimited:
+            self.tokens._refill(now)
+            eta = max(eta, (need_tok - self.tokens.level) / self.tokens.rate)
+        return max(eta, 0.0)
+
+    def _pop(self, ticket: Ticket):
+        q = self._queues.pop(ticket.session)
+        q.popleft()
+        if q:
+            self._queues[ticket.session] = q   # 放到轮转末尾
+
+    # ----- 对外接口 -----
+    def acquire(self, session: str, cost: float, on_wait=None, timeout: float = None) -> Ticket:
+        """
+        阻塞直到额度允许发送。cost 为预估 token 数（提示词 + max_tokens）。
+        on_wait(position, eta_seconds) 在需要排队时回调（position 从 1 开始）。
+        超时抛出 TimeoutError。
+        """
+        session = session or "default"
+        t0 = time.monotonic()
+        with self._cond:
+            ticket = Ticket(session, self.tokens.clamp(cost), next(self._seq))
+            if self.unlimited and not self._queues and self._paused_until <= t0:
+                ticket.granted = True
+                metrics.inc("rate_limit_granted_total")
+                return ticket
+            self._queues.setdefault(session, deque()).append(ticket)
+            last_report = None
+            try:
+                while True:
+                    now = time.monotonic()
+                    wait = max(self._paused_until - now, 0.0)
+                    if self._head() is ticket:
+                        wait = max(wait, self.requests.wait_time(1, now), self.tokens.wait_time(ticket.cost, now))
+                        if wait <= 0:
+                            self.requests.take(1, now)
+                            self.tokens.take(ticket.cost, now)
+                            self._pop(ticket)
+                            ticket.granted = True
+                            self._cond.notify_all()
+                            break
+                    if on_wait:
+                        position = self._service_order().index(ticket) + 1
+                        report = (position, round(self._eta(ticket, now), 1))
+                        if report != last_report:
+                            on_wait(*report)
+                            last_report = report
+                    if timeout is not None and now - t0 >= timeout:
+                        raise TimeoutError("等待限流额度超时")
+                    self._cond.wait(min(wait, 0.5) if wait > 0 else 0.5)
+            except BaseException:
+                if not ticket.granted:
+                    q = self._queues.get(session)
+                    if q and ticket in q:
+                        q.remove(ticket)
+                        if not q:
+                            del self._queues[session]
+                    self._cond.notify_all()
+                raise
+        ticket.waited = time.monotonic() - t0
+        metrics.inc("rate_limit_granted_total")
+        metrics.observe("rate_limit_wait_seconds", ticket.waited)
+        return ticket
+
+    def settle(self, ticket: Ticket, actual_tokens: int = None):
+        """请求完成后按实际 token 数修正预扣额度"""
+        if ticket is None or actual_tokens is None:
+            return
+        with self._cond:
+            self.tokens.give(ticket.cost - actual_tokens)
+            self._cond.notify_all()
+
+    def penalize(self, seconds: float):
+        """收到 429：在 seconds 秒内暂停该 key 的所有发送"""
+        with self._cond:
+            self._paused_until = max(self._paused_until, time.monotonic() + max(seconds, 0.0))
+            metrics.inc("rate_limit_429_total")
+            self._cond.notify_all()
+
+    def queue_depth(self) -> int:
+        with self._cond:
+            return sum(len(q) for q in self._queues.values())
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def get_limiter(api_base: str, api_key: str) -> RateLimiter:
+    """进程内按 (api_base, api_key) 共享的限流器（key 只保存摘要）"""
+    digest = hashlib.sha256((api_key or "").encode("utf-8")).hexdigest()[:16]
+    key = ((api_base or "").rstrip("/"), digest)
+    with _limiters_lock:
+        limiter = _limiters.get(key)
+        if limiter is None:
+            limiter = _limiters[key] = RateLimiter()
+        return limiter
+
+
+def retry_after_seconds(response, default: float = 5.0) -> float:
+    """解析 429 响应的 Retry-After（秒数形式），缺失时返回默认值"""
+    try:
+        return float(response.headers.get("Retry-After"))
+    except (TypeError, ValueError, AttributeError):
+        return default
@@ -0,0 +1,268 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+result_cache.py
+只读命令的结果缓存（按有效期过期），减少在高延迟 SSH 链路上重复执行 df / free / uname / ls 等探测命令。
+
+功能说明：
+- 缓存键为 (主机, 工作目录, 规范化后的命令)；规范化只合并多余空白，不改变语义；
+- 只有规则文件（utils/cache_rules/result_cache_ttl.txt）中列出的命令可缓存，
+  管道中每一段都必须可缓存，有效期取各段最小值；含重定向、命令替换、变量、多条命令的一律不缓存；
+- 在某台主机上执行了不可缓存的命令（可能改动了文件）时，清空该主机已缓存的结果；
+- 只缓存执行成功的结果；条目数超过 RESULT_CACHE_MAX_ENTRIES 时淘汰最久未用的。
+默认关闭，环境变量 RESULT_CACHE=1 开启（界面上也可按会话勾选）。
+"""
+
+import os
+import shlex
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, NamedTuple, Optional
+
+from utils import metrics
+
+RESULT_CACHE = os.getenv("RESULT_CACHE", "0").lower() in ("1", "true", "yes", "on")
+TTL_FILE = os.getenv("RESULT_CACHE_TTL_FILE",
+                     os.path.join(os.path.dirname(__file__), "cache_rules", "result_cache_ttl.txt"))
+MAX_ENTRIES = int(os.getenv("RESULT_CACHE_MAX_ENTRIES", "256"))
+
+_UNSAFE_CHARS = ("$", "`", "\n", "\r")
+_UNSAFE_TOKENS = (">", ">>", "<", "<<", ";", "&", "&&", "||", "(", ")", "|&")
+
+
+class Rule(NamedTuple):
+    ttl: float
+    forbidden: tuple = ()
+    max_operands: Optional[int] = None
+
+
+class CachedResult(NamedTuple):
+    value: Any
+    stored_at: float
+    ttl: float
+
+    @property
+    def age(self) -> float:
+        return time.time() - self.stored_at
+
+
+def enabled() -> bool:
+    return RESULT_CACHE
+
+
+def _load_rules(path: str) -> Dict[str, Rule]:
+    rules = {}
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line or line.startswith("#"):
+                    continue
+                parts = line.split()
+                if len(parts) < 2:
+                    continue
+                forbidden, max_operands = [], None
+                for p in parts[2:]:
+                    if p.startswith("max-operands="):
+                        max_operands = int(p.split("=", 1)[1])
+                    else:
+                        forbidden.append(p.lower())
+                rules[parts[0].lower()] = Rule(float(parts[1]), tuple(forbidden), max_operands)
+    except FileNotFoundError:
+        pass
+    return rules
+
+
+_rules = None
+_rules_lock = threading.Lock()
+
+
+def get_rules() -> Dict[str, Rule]:
+    global _rules
+    with _rules_lock:
+        if _rules is None:
+            _rules = _load_rules(TTL_FILE)
+        return _rules
+
+
+def _tokens(command: str):
+    # 非 POSIX 模式保留引号：引号内的 | 等字符不会被当成管道
+    lex = shlex.shlex(command, posix=False, punctuation_chars=True)
+    lex.whitespace_split = True
+    return list(lex)
+
+
+def _unquote(tok: str) -> str:
+    if len(tok) >= 2 and tok[0] == tok[-1] and tok[0] in "'\"":
+        return tok[1:-1]
+    return tok
+
+
+def _has_forbidden(args, forbidden) -> bool:
+    for arg in args:
+        low = arg.lower()
+        for flag in forbidden:
+            if low == flag:
+                return True
+            if flag.startswith("--") and low.startswith(flag + "="):
+                return True
+            # 短选项可能与其他选项合写（如 tail -nf）
+            if len(flag) == 2 and flag[0] == "-" and low.startswith("-") and not low.startswith("--") \
+                    and flag[1] in arg[1:]:
+                return True
+    return False
+
+
+def _segment_ttl(argv) -> Optional[float]:
+    if not argv:
+        return None
+    argv = [_unquote(a) for a in argv]
+    name = argv[0].replace("\\", "/").rsplit("/", 1)[-1].lower()
+    if name.endswith(".exe"):
+        name = name[:-4]
+    rule = get_rules().get(name)
+    if rule is None or _has_forbidden(argv[1:], rule.forbidden):
+        return None
+    if rule.max_operands is not None:
+        operands = [a for a in argv[1:] if not a.startswith("-")]
+        if len(operands) > rule.max_operands:
+            return None
+    return rule.ttl
+
+
+def classify(command: str):
+    """
+    判断命令是否可缓存，返回 (规范化命令, 有效期秒数)；不可缓存时返回 None。
+    """
+    command = (command or "").strip()
+    if not command or any(ch in command for ch in _UNSAFE_CHARS):
+        return None
+    try:
+        tokens = _tokens(command)
+    except ValueError:
+        return None
+    segments, current = [], []
+    for tok in tokens:
+        if tok == "|":
+            segments.append(current)
+            current = []
+        elif tok in _UNSAFE_TOKENS or (tok and set(tok) <= set("<>&;|()")):
+            return None
+        else:
+            current.append(tok)
+    segments.append(current)
+    ttls = [_segment_ttl(seg) for seg in segments]
+    if not ttls or None in ttls:
+        return None
+    normalized = " | ".join(" ".join(seg) for seg in segments)
+    return normalized, min(ttls)
+
+
+def host_of(client) -> str:
+    """缓存用的主机标识；client 为空表示本机"""
+    if client is None:
+        return "local"
+    info = getattr(client, "_connection_info", None)
+    if info:
+        host, port, user = info
+        return f"{user}@{host}:{port}"
+    return f"ssh:{id(client):x}"
+
+
+class ResultCache:
+    """进程内共享的结果缓存（线程安全，LRU 淘汰）"""
+
+    def __init__(self, max_entries: int = None):
+        self.max_entries = max_entries or MAX_ENTRIES
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, host: str, cwd: str, command: str) -> Optional[CachedResult]:
+        c = classify(command)
+        if c is None:
+            return None
+        key = (host, cwd or "", c[0])
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry.age > entry.ttl:
+                del self._entries[key]
+                metrics.inc("result_cache_expired_total")
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def put(self, host: str, cwd: str, command: str, value) -> bool:
+        c = classify(command)
+        if c is None:
+            return False
+        normalized, ttl = c
+        with self._lock:
+            self._entries[(host, cwd or "", normalized)] = CachedResult(value, time.time(), ttl)
+            self._entries.move_to_end((host, cwd or "", normalized))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return True
+
+    def invalidate(self, host: str = None) -> int:
+        """清空某台主机（host 为空时全部）的缓存，返回删除条数"""
+        with self._lock:
+            keys = [k for k in self._entries if host is None or k[0] == host]
+            for k in keys:
+                del self._entries[k]
+        return len(keys)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+_default_cache = None
+_default_lock = threading.Lock()
+
+
+def get_result_cache() -> ResultCache:
+    global _default_cache
+    with _default_lock:
+        if _default_cache is None:
+            _default_cache = ResultCache()
+        return _default_cache
+
+
+def note_executed(host: str, command: str):
+    """不经缓存执行命令时调用：命令不可缓存（可能改动了文件）则清空该主机的缓存"""
+    cache = _default_cache
+    if cache is not None and len(cache) and classify(command) is None:
+        if cache.invalidate(host):
+            metrics.inc("result_cache_invalidations_total")
+
+
+def run_cached(host: str, cwd: str, command: str, run, refresh: bool = False, ok=None):
+    """
+    经缓存执行命令：命中时不调用 run；否则调用 run() 并在 ok(结果) 为真时写入缓存。
+    不可缓存的命令照常执行，并清空该主机的缓存。
+    返回 (结果, 缓存年龄秒数)；结果来自实际执行时年龄为 None。
+    """
+    cache = get_result_cache()
+    if classify(command) is None:
+        note_executed(host, command)
+        return run(), None
+    if not refresh:
+        hit = cache.get(host, cwd, command)
+        if hit is not None:
+            metrics.inc("result_cache_total", result="hit")
+            return hit.value, hit.age
+    metrics.inc("result_cache_total", result="refresh" if refresh else "miss")
+    value = run()
+    if ok is None or ok(value):
+        cache.put(host, cwd, command, value)
+    return value, None
+
+
+def format_age(age: float) -> str:
+    if age < 60:
+        return f"{age:.0f} 秒前"
+    if age < 3600:
+        return f"{age / 60:.0f} 分钟前"
+    return f"{age / 3600:.1f} 小时前"
@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+script_patch.py
+基于统一 diff（unified diff）的脚本修改：只让模型输出改动部分，而不是整份脚本。
+
+功能说明：
+- wants_revision 判断用户是否在要求修改上一次生成的脚本（关键词匹配，微秒级）：
+  需同时出现修改词与明确指代（这个 / 上面的脚本、脚本文件名），英文词按整词匹配；
+- revision_context 生成随本次请求发送的上下文：当前脚本全文 + PATCH 动作的输出格式；
+- apply_patch 严格应用 diff：每个 hunk 的上下文行与删除行必须与原文一致
+  （允许行号有偏移，在附近查找），不一致时抛出 PatchError，不做模糊合并。
+"""
+
+import re
+from typing import List, NamedTuple
+
+_EDIT_WORDS = ("修改", "改成", "改为", "改一下", "加上", "加个", "加一", "添加", "增加", "删除", "删掉", "去掉",
+               "替换", "调整", "优化", "修复", "完善", "支持", "换成", "改用")
+_EDIT_WORDS_EN = re.compile(r"\b(?:add|change|modify|fix|update|tweak|remove|replace|rename)(?:s|es|ed|d|ing)?\b")
+# 明确指向上一次的脚本；"写一个备份脚本" 中的 "脚本" 不算
+_SCRIPT_REF = re.compile(
+    r"(?:这个|这|那个|该|此|原|把|给|将|上面的?|上述的?|刚才的?|刚刚的?|之前的?|前面的?)\s*(?:脚本|文件|代码)"
+    r"|上面|上述|刚才"
+    r"|\b(?:this|that|the|your|previous|last|existing|current|same|above)\s+(?:previous\s+|last\s+|above\s+)?"
+    r"(?:script|file|code)\b")
+# 新写一个脚本的请求（即使提到了上面的脚本，也按新脚本处理）
+_NEW_SCRIPT = re.compile(r"(?:写|新建|生成|创建|做)(?:一个|个|一份)|再写|重新写|重写"
+                         r"|\b(?:write|create|generate|make)\s+(?:a|an|another|new)\b|\bnew\s+script\b")
+_HUNK = re.compile(r"^@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@")
+_FUZZ = 50   # 行号偏移时向前后查找的最大行数
+
+PATCH_TEXT_FORMAT = (
+    "如果用户要求修改上面这个脚本，不要重新输出整个脚本，改用 PATCH 动作只输出统一 diff：\n"
+    "PATCH:\n<文件名>\n<修改说明>\n```diff\n--- a/<文件名>\n+++ b/<文件名>\n@@ -起始行,行数 +起始行,行数 @@\n"
+    " 上下文行\n-删除的行\n+新增的行\n```\n"
+    "每个 hunk 保留 3 行上下文，上下文行与删除行必须与当前脚本逐字一致。"
+)
+PATCH_JSON_FORMAT = (
+    "如果用户要求修改上面这个脚本，不要重新输出整个脚本，改为输出：\n"
+    '{"action": "patch", "filename": "<文件名>", "description": "<修改说明>", "diff": "<统一 diff>"}\n'
+    "diff 为统一 diff 格式（--- / +++ / @@ 行号头），每个 hunk 保留 3 行上下文，"
+    "上下文行与删除行必须与当前脚本逐字一致。"
+)
+
+
+class PatchError(ValueError):
+    pass
+
+
+class Hunk(NamedTuple):
+    old_start: int
+    old_lines: List[str]     # 上下文行 + 删除行（原文中的样子）
+    new_lines: List[str]     # 上下文行 + 新增行
+    no_newline_at_end: bool  # 新文件末尾没有换行
+
+
+def wants_revision(prompt: str, filename: str = "") -> bool:
+    """用户是否在要求修改上一次生成的脚本"""
+    text = (prompt or "").lower()
+    if not (any(w in text for w in _EDIT_WORDS) or _EDIT_WORDS_EN.search(text)):
+        return False
+    if _NEW_SCRIPT.search(text):
+        return False
+    return bool(_SCRIPT_REF.search(text)) or bool(filename and filename.lower() in text)
+
+
+def revision_context(filename: str, content: str, mode: str = "text") -> str:
+    """随本次请求附带的当前脚本与 PATCH 输出格式（只发送这一次，不写入对话记忆）"""
+    lines = content.count("\n") + (0 if content.endswith("\n") else 1)
+    fmt = PATCH_JSON_FORMAT if mode == "json" else PATCH_TEXT_FORMAT
+    return f"当前脚本 {filename}（共 {lines} 行）：\n```\n{content}\n```\n{fmt}"
+
+
+def parse_hunks(diff: str) -> List[Hunk]:
+    hunks, cur, prev = [], None, None
+    for line in diff.splitlines():
+        m = _HUNK.match(line)
+        if m:
+            cur = Hunk(int(m.group(1)), [], [], False)
+            hunks.append(cur)
+            prev = None
+            continue
+        if cur is None or line.startswith(("--- ", "+++ ", "diff ", "index ")):
+            continue
+        if line.startswith("\\"):
+            # "\ No newline at end of file" 紧跟在新文件最后一行之后时才影响结果
+            if prev in ("+", " "):
+                hunks[-1] = cur = cur._replace(no_newline_at_end=True)
+            continue
+        tag, body = (line[0], line[1:]) if line else (" ", "")
+        if tag == " ":
+            cur.old_lines.append(body)
+            cur.new_lines.append(body)
+        elif tag == "-":
+            cur.old_lines.append(body)
+        elif tag == "+":
+            cur.new_lines.append(body)
+        else:
+            raise PatchError(f"无法识别的 diff 行：{line[:60]}")
+        prev = tag
+    if not hunks:
+        raise PatchError("diff 中没有 @@ 块")
+    return hunks
+
+
+def _find(lines: List[str], block: List[str], expected: int, start: int) -> int:
+    """在 expected 附近查找 block（不早于 start），找不到返回 -1"""
+    if not block:
+        return max(expected, start)
+    for delta in range(_FUZZ + 1):
+        for pos in (expected - delta, expected + delta) if delta else (expected,):
+            if start <= pos <= len(lines) - len(block) and \
+                    all(a.rstrip() == b.rstrip() for a, b in zip(lines[pos:pos + len(block)], block)):
+                return pos
+    return -1
+
+
+def apply_patch(original: str, diff: str) -> str:
+    """把统一 diff 应用到原文，返回新内容；上下文不匹配时抛出 PatchError"""
+    lines = original.split("\n")
+    trailing_newline = original.endswith("\n")
+    if trailing_newline:
+        lines.pop()
+    out, cursor = [], 0
+    for n, hunk in enumerate(parse_hunks(diff), 1):
+        expected = hunk.old_start - 1 if hunk.old_lines else hunk.old_start
+        pos = _find(lines, hunk.old_lines, max(expected, 0), cursor)
+        if pos < 0:
+            preview = hunk.old_lines[0][:60] if hunk.old_lines else ""
+            raise PatchError(f"第 {n} 个修改块与当前脚本不一致（约第 {hunk.old_start} 行：{preview!r}）")
+        out.extend(lines[cursor:pos])
+        out.extend(hunk.new_lines)
+        cursor = pos + len(hunk.old_lines)
+        if cursor == len(lines):
+            # 改到了文件末尾：末尾是否换行以 diff 为准
+            trailing_newline = not hunk.no_newline_at_end
+    out.extend(lines[cursor:])
+    return "\n".join(out) + ("\n" if trailing_newline and out else "")
+
+
+def diff_stats(diff: str):
+    """返回 (新增行数, 删除行数)"""
+    added = removed = 0
+    for line in diff.splitlines():
+        if line.startswith("+") and not line.startswith("+++ "):
+            added += 1
+        elif line.startswith("-") and not line.startswith("--- "):
+            removed += 1
+    return added, removed
@@ -3,29 +3,239 @@
 """
 voice_input.py
 语音转文字模块（无 PyAudio 版，使用 sounddevice）
+
+录音方式：
+- 麦克风输入流（sd.InputStream）首次使用时打开并保持常开，之后每次录音无需重新打开设备；
+- 按帧做能量 + 过零率的语音活动检测（VAD），说话结束后静音超过设定时长即停止；
+- 去掉首尾静音后再交给识别器。识别器可插拔（默认 Google），
+  capture_utterance 也可以直接喂入合成音频帧，不依赖真实麦克风。
 """
 
-import sounddevice as sd
+import collections
+import os
+import queue
+import threading
+import time
+
 import numpy as np
-import speech_recognition as sr
 
-def record_once(duration=5, samplerate=16000):
-    """录制一次语音并识别为文字"""
-    r = sr.Recognizer()
+try:
+    import sounddevice as sd
+except Exception:   # 没有声卡 / PortAudio 时仍可对合成音频做检测与识别
+    sd = None
 
-    print("🎙️ 请开始说话（默认录制 5 秒，可修改 duration 参数）...")
-    audio_data = sd.rec(int(duration * samplerate), samplerate=samplerate, channels=1, dtype='int16')
-    sd.wait()
-    print("🧠 正在识别...")
+from utils import metrics
+
+SAMPLE_RATE = int(os.getenv("VOICE_SAMPLE_RATE", "16000"))
+FRAME_MS = int(os.getenv("VOICE_FRAME_MS", "30"))
+SILENCE_MS = int(os.getenv("VOICE_SILENCE_MS", "700"))          # 说话结束后多久停止
+MAX_SECONDS = float(os.getenv("VOICE_MAX_SECONDS", "15"))       # 单次录音上限
+START_TIMEOUT = float(os.getenv("VOICE_START_TIMEOUT", "5"))    # 一直没开口则放弃
+PREROLL_MS = int(os.getenv("VOICE_PREROLL_MS", "300"))          # 保留语音起点之前的音频
+ENERGY_THRESHOLD = float(os.getenv("VOICE_ENERGY_THRESHOLD", "0"))  # 0 表示根据底噪自适应
+VOICE_RECOGNIZER = os.getenv("VOICE_RECOGNIZER", "google")
+VOICE_LANGUAGE = os.getenv("VOICE_LANGUAGE", "zh-CN")
+
+
+# ========= 语音活动检测 =========
+class VoiceActivityDetector:
+    """
+    逐帧判断是否为语音：
+    - 帧能量（RMS）高于底噪的若干倍（或固定阈值）；
+    - 过零率不过高（排除嘶嘶声一类的宽带噪声）。
+    底噪在非语音帧上做指数平滑，环境噪声变化时阈值随之调整。
+    """
+
+    def __init__(self, energy_threshold: float = ENERGY_THRESHOLD, noise_ratio: float = 3.0,
+                 min_energy: float = 200.0, max_zcr: float = 0.35):
+        self.fixed_threshold = energy_threshold
+        self.noise_ratio = noise_ratio
+        self.min_energy = min_energy
+        self.max_zcr = max_zcr
+        self.noise_floor = None
+
+    @staticmethod
+    def frame_features(frame: np.ndarray):
+        """返回 (rms, zcr)"""
+        x = frame.astype(np.float32).ravel()
+        if x.size == 0:
+            return 0.0, 0.0
+        rms = float(np.sqrt(np.mean(x * x)))
+        signs = np.signbit(x)
+        zcr = float(np.count_nonzero(signs[1:] != signs[:-1])) / max(x.size - 1, 1)
+        return rms, zcr
+
+    def threshold(self) -> float:
+        if self.fixed_threshold > 0:
+            return self.fixed_threshold
+        floor = self.noise_floor if self.noise_floor is not None else 0.0
+        return max(self.min_energy, floor * self.noise_ratio)
+
+    def is_speech(self, frame: np.ndarray) -> bool:
+        rms, zcr = self.frame_features(frame)
+        speech = rms >= self.threshold() and zcr <= self.max_zcr
+        if not speech:
+            self.noise_floor = rms if self.noise_floor is None else 0.9 * self.noise_floor + 0.1 * rms
+        return speech
+
+
+def trim_silence(audio: np.ndarray, samplerate: int = SAMPLE_RATE, vad: VoiceActivityDetector = None,
+                 pad_ms: int = 100) -> np.ndarray:
+    """去掉首尾的静音帧（两端各保留 pad_ms 以免切掉辅音）"""
+    audio = np.asarray(audio).ravel()
+    frame_len = max(int(samplerate * FRAME_MS / 1000), 1)
+    vad = vad or VoiceActivityDetector()
+    voiced = [i for i in range(0, audio.size, frame_len) if vad.is_speech(audio[i:i + frame_len])]
+    if not voiced:
+        return audio[:0]
+    pad = int(samplerate * pad_ms / 1000)
+    start = max(voiced[0] - pad, 0)
+    end = min(voiced[-1] + frame_len + pad, audio.size)
+    return audio[start:end]
+
+
+def capture_utterance(frames, samplerate: int = SAMPLE_RATE, vad: VoiceActivityDetector = None,
+                      silence_ms: int = SILENCE_MS, max_seconds: float = MAX_SECONDS,
+                      start_timeout: float = START_TIMEOUT, preroll_ms: int = PREROLL_MS) -> np.ndarray:
+    """
+    从帧序列中截取一句话。frames 为 int16 帧的可迭代对象（麦克风或合成音频均可）。
+    检测到语音后开始收集，连续静音超过 silence_ms 后停止；返回去掉首尾静音的 int16 数组，
+    未检测到语音时返回空数组。时长按样本数计算，与真实时间无关。
+    """
+    vad = vad or VoiceActivityDetector()
+    preroll = collections.deque()
+    preroll_samples = int(samplerate * preroll_ms / 1000)
+    collected = []
+    speaking = False
+    silent_samples = heard = waited = 0
+    silence_limit = int(samplerate * silence_ms / 1000)
+    max_samples = int(samplerate * max_seconds)
+    start_limit = int(samplerate * start_timeout)
+
+    for frame in frames:
+        frame = np.asarray(frame, dtype=np.int16).ravel()
+        speech = vad.is_speech(frame)
+        if not speaking:
+            waited += frame.size
+            preroll.append(frame)
+            while sum(f.size for f in preroll) > preroll_samples + frame.size:
+                preroll.popleft()
+            if speech:
+                speaking = True
+                collected.extend(preroll)
+                heard = sum(f.size for f in preroll)
+                preroll.clear()
+            elif waited >= start_limit:
+                break
+            continue
+        collected.append(frame)
+        heard += frame.size
+        silent_samples = 0 if speech else silent_samples + frame.size
+        if silent_samples >= silence_limit or heard >= max_samples:
+            break
+
+    if not collected:
+        return np.zeros(0, dtype=np.int16)
+    return trim_silence(np.concatenate(collected), samplerate)
+
+
+# ========= 常开麦克风输入流 =========
+class MicrophoneStream:
+    """
+    保持打开的 sd.InputStream。平时回调只维护一小段预录缓冲，
+    listen() 期间才把帧送入队列，避免每次录音都重新打开设备。
+    """
+
+    def __init__(self, samplerate: int = SAMPLE_RATE, frame_ms: int = FRAME_MS, preroll_ms: int = PREROLL_MS):
+        self.samplerate = samplerate
+        self.blocksize = max(int(samplerate * frame_ms / 1000), 1)
+        self._preroll = collections.deque(maxlen=max(preroll_ms // max(frame_ms, 1), 1))
+        self._queue = queue.Queue()
+        self._listening = False
+        self._lock = threading.Lock()
+        self._stream = None
+
+    def _callback(self, indata, frames, time_info, status):
+        frame = indata[:, 0].copy()
+        with self._lock:
+            if self._listening:
+                self._queue.put(frame)
+            else:
+                self._preroll.append(frame)
+
+    def open(self):
+        if self._stream is not None:
+            return self
+        if sd is None:
+            raise RuntimeError("sounddevice 不可用，无法打开麦克风")
+        self._stream = sd.InputStream(samplerate=self.samplerate, channels=1, dtype="int16",
+                                      blocksize=self.blocksize, callback=self._callback)
+        self._stream.start()
+        return self
+
+    def close(self):
+        if self._stream is not None:
+            try:
+                self._stream.stop()
+                self._stream.close()
+            finally:
+                self._stream = None
 
-    # 将 numpy 数组转换为 speech_recognition 可识别的格式
-    audio_bytes = audio_data.tobytes()
-    audio = sr.AudioData(audio_bytes, samplerate, 2)  # 2 字节 = 16 位精度
+    def listen(self, timeout: float = 1.0):
+        """生成器：依次产出麦克风帧（先产出预录缓冲）；关闭生成器即停止收集"""
+        self.open()
+        with self._lock:
+            pending = list(self._preroll)
+            self._preroll.clear()
+            self._queue = queue.Queue()
+            self._listening = True
+        try:
+            yield from pending
+            while True:
+                try:
+                    yield self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    return   # 设备停止送数据
+        finally:
+            with self._lock:
+                self._listening = False
 
+
+_microphone = None
+_microphone_lock = threading.Lock()
+_capture_lock = threading.Lock()   # 多个会话同时点录音时依次进行
+
+
+def get_microphone() -> MicrophoneStream:
+    """进程内共享的常开麦克风流"""
+    global _microphone
+    with _microphone_lock:
+        if _microphone is None:
+            _microphone = MicrophoneStream().open()
+        return _microphone
+
+
+# ========= 可插拔识别器 =========
+# 识别器签名：recognizer(audio: np.ndarray[int16], samplerate: int) -> str
+_RECOGNIZERS = {}
+
+
+def register_recognizer(name: str, fn):
+    _RECOGNIZERS[name.lower()] = fn
+
+
+def get_recognizer(name: str = None):
+    name = (name or VOICE_RECOGNIZER).lower()
+    if name not in _RECOGNIZERS:
+        raise RuntimeError(f"未知的语音识别器：{name}（可选：{', '.join(sorted(_RECOGNIZERS))}）")
+    return _RECOGNIZERS[name]
+
+
+def recognize_google(audio: np.ndarray, samplerate: int = SAMPLE_RATE) -> str:
+    import speech_recognition as sr
+    data = sr.AudioData(np.asarray(audio, dtype=np.int16).tobytes(), samplerate, 2)  # 2 字节 = 16 位精度
     try:
-        text = r.recognize_google(audio, language="zh-CN")
-        print(f"💬 识别结果：{text}")
-        return text
+        return sr.Recognizer().recognize_google(data, language=VOICE_LANGUAGE)
     except sr.UnknownValueError:
         print("😕 无法识别语音")
     except sr.RequestError:
@@ -33,5 +243,44 @@ def record_once(duration=5, samplerate=16000):
     return ""
 
 
+register_recognizer("google", recognize_google)
+
+
+def record_once(duration=None, samplerate=SAMPLE_RATE, recognizer=None, frames=None):
+    """
+    录制一句话并识别为文字。
+    duration：单次录音上限（秒），默认 VOICE_MAX_SECONDS；
+    recognizer：识别函数或已注册的名称；
+    frames：可选的帧序列（测试时传入合成音频），默认使用常开麦克风。
+    """
+    if not callable(recognizer):
+        recognizer = get_recognizer(recognizer)
+    max_seconds = duration or MAX_SECONDS
+
+    print("🎙️ 请开始说话（说完停顿片刻即自动结束）...")
+    t0 = time.perf_counter()
+    if frames is None:
+        with _capture_lock:
+            source = get_microphone().listen()
+            try:
+                audio = capture_utterance(source, samplerate, max_seconds=max_seconds)
+            finally:
+                source.close()
+    else:
+        audio = capture_utterance(frames, samplerate, max_seconds=max_seconds)
+    metrics.observe("voice_capture_seconds", time.perf_counter() - t0)
+
+    if audio.size == 0:
+        print("😕 没有检测到语音")
+        return ""
+
+    print("🧠 正在识别...")
+    with metrics.timer("voice_recognize_seconds"):
+        text = recognizer(audio, samplerate) or ""
+    if text:
+        print(f"💬 识别结果：{text}")
+    return text
+
+
 if __name__ == "__main__":
     record_once()